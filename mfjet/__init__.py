@@ -5,14 +5,20 @@ MFJet
 """
 
 from .calculator_mf_euclidean import (
-    MFEuclideanCalculator
+    MFEuclideanCalculator,
+    MFEuclideanCalculatorAlphaComplex
 )
 from .calculator_mf_manhattan import (
-    MFManhattanCalculator
+    MFManhattanCalculator,
+    MFManhattanCalculatorSweepLine
 )
 from .calculator_mf_pixel import (
     MFPixelCalculator,
-    MFPixelCalculatorMarchingSquare
+    MFPixelCalculatorMarchingSquare,
+    MFPixelCalculatorEuclidean
+)
+from .calculator_mf_voxel import (
+    MFVoxelCalculator
 )
 
 from .minkowski_funcs import (
@@ -21,10 +27,38 @@ from .minkowski_funcs import (
     calc_length,
     calc_euler,
     calc_euler_poly,
+    calc_mfs_array,
+    calc_area_array,
+    calc_length_array,
+    calc_euler_array,
 )
 
 from .pixel_utils import (
+    coords_to_bin_idx,
     coords_to_binned_coords
 )
 
+from .batch_utils import (
+    ragged_to_flat,
+)
+
+from .dataset_utils import (
+    save_ragged,
+    load_ragged,
+    featurize_dataset,
+)
+
+from .parallel_utils import (
+    calc_mfs_shared,
+)
+
+from .cache_utils import (
+    MFCache,
+    CachedCalculator,
+)
+
+from .profiling import (
+    StageProfiler,
+)
+
 from .version import __version__
@@ -0,0 +1,208 @@
+"""
+Collection of codes for exact Minkowski functionals of a union of equal disks.
+
+The union of disks with radius r centered at given points is decomposed by the
+inclusion-exclusion formula over the alpha complex,
+
+    MF(union) = sum_{simplex s in alpha complex(r)} (-1)^dim(s) MF(intersection of disks in s),
+
+which is exact for any additive functional, i.e., Euler characteristic,
+boundary length, and area.
+The alpha complex is the subcomplex of the Delaunay triangulation whose simplices
+have filtration values (alpha radii) not larger than r.
+Each intersection of disks is a convex region bounded by circular arcs,
+so its boundary length and area are obtained analytically.
+
+"""
+import numpy as np
+import scipy.spatial
+
+
+def calc_alpha_complex(coords):
+    """
+    Calculate the alpha complex filtration of given points.
+
+    Parameters
+    ----------
+    coords : array_like with shape (N_pt, 2)
+
+    Returns
+    -------
+    points     : np.array with shape (N_v, 2)
+        unique points, i.e., vertices of the complex
+    edges      : np.array of int with shape (N_e, 2)
+        vertex indices of Delaunay edges
+    edge_alpha : np.array with shape (N_e,)
+        filtration value (radius) of each edge
+    triangles  : np.array of int with shape (N_t, 3)
+        vertex indices of Delaunay triangles
+    tri_alpha  : np.array with shape (N_t,)
+        filtration value (circumradius) of each triangle
+
+    """
+    points = np.unique(np.asarray(coords, dtype=float).reshape(-1, 2), axis=0)
+    n_points = points.shape[0]
+
+    triangles = np.zeros((0, 3), dtype=int)
+    if n_points >= 3:
+        try:
+            triangles = scipy.spatial.Delaunay(points).simplices
+        except scipy.spatial.QhullError:
+            # degenerate input, e.g., collinear points
+            triangles = np.zeros((0, 3), dtype=int)
+
+    if triangles.shape[0] == 0:
+        # points on a line: the Delaunay complex is a path along the line
+        if n_points >= 2:
+            direction = points[-1] - points[0]
+            order = np.argsort((points - points[0]) @ direction, kind="stable")
+            edges = np.stack([order[:-1], order[1:]], axis=-1)
+        else:
+            edges = np.zeros((0, 2), dtype=int)
+        edge_alpha = 0.5 * np.linalg.norm(points[edges[:, 1]] - points[edges[:, 0]], axis=-1)
+        return points, edges, edge_alpha, triangles, np.zeros(0)
+
+    tri_points = points[triangles]
+    tri_alpha = _calc_circumradius(tri_points)
+
+    # edges of each triangle, k-th edge is opposite to k-th vertex
+    tri_edges = np.stack([triangles[:, [1, 2]], triangles[:, [2, 0]], triangles[:, [0, 1]]], axis=1)
+    tri_edges = np.sort(tri_edges, axis=-1).reshape(-1, 2)
+    edges, edge_inverse = np.unique(tri_edges, axis=0, return_inverse=True)
+    edge_inverse = edge_inverse.reshape(-1)
+
+    # an edge is attached if an opposite vertex lies inside its diametral circle,
+    # i.e., the angle at the opposite vertex is obtuse.
+    vec_a = np.roll(tri_points, -1, axis=1) - tri_points
+    vec_b = np.roll(tri_points, -2, axis=1) - tri_points
+    attached = (np.sum(vec_a * vec_b, axis=-1) < 0).reshape(-1)
+
+    edge_alpha = 0.5 * np.linalg.norm(points[edges[:, 1]] - points[edges[:, 0]], axis=-1)
+    attached_alpha = np.full(edges.shape[0], np.inf)
+    np.minimum.at(
+        attached_alpha,
+        edge_inverse[attached],
+        np.repeat(tri_alpha, 3)[attached]
+    )
+    # an edge attached to a flat triangle of collinear points has an infinite filtration value
+    is_attached = np.zeros(edges.shape[0], dtype=bool)
+    is_attached[edge_inverse[attached]] = True
+    edge_alpha = np.where(is_attached, attached_alpha, edge_alpha)
+
+    return points, edges, edge_alpha, triangles, tri_alpha
+
+
+def calc_mfs_alpha_complex(points, edges, edge_alpha, triangles, tri_alpha, r):
+    """
+    Calculate Minkowski functionals of a union of disks from its alpha complex.
+
+    Parameters
+    ----------
+    points, edges, edge_alpha, triangles, tri_alpha :
+        alpha complex returned by calc_alpha_complex
+    r : float or array_like
+        The circle radius in the Minkowski sum.
+
+    Returns
+    -------
+    np.array with shape (3,) or (r.shape, 3)
+        array of Minkowski functionals given r.
+
+    """
+    r = np.asarray(r, dtype=float)
+    arr_r = r.reshape(-1, 1)
+
+    # work in coordinates centered at the points for numerical stability
+    points = points - points.mean(axis=0)
+
+    mask_edge = edge_alpha <= arr_r
+    mask_tri = tri_alpha <= arr_r
+
+    n_vertices = points.shape[0]
+    euler = n_vertices - mask_edge.sum(axis=-1) + mask_tri.sum(axis=-1)
+    length = n_vertices * 2 * np.pi * arr_r[:, 0]
+    area = n_vertices * np.pi * arr_r[:, 0]**2
+
+    if edges.shape[0] > 0:
+        edge_length, edge_area = calc_disk_intersection(points[edges], arr_r)
+        length = length - np.sum(edge_length, axis=-1, where=mask_edge)
+        area = area - np.sum(edge_area, axis=-1, where=mask_edge)
+    if triangles.shape[0] > 0:
+        tri_length, tri_area = calc_disk_intersection(points[triangles], arr_r)
+        length = length + np.sum(tri_length, axis=-1, where=mask_tri)
+        area = area + np.sum(tri_area, axis=-1, where=mask_tri)
+
+    arr_mfs = np.stack([euler, length, area], axis=-1)
+    return arr_mfs.reshape(r.shape + (3,))
+
+
+def calc_disk_intersection(centers, r):
+    """
+    Calculate boundary length and area of intersections of equal disks.
+
+    The boundary of the intersection consists of circular arcs. On the circle
+    around each center, the arc inside the other disks is the intersection of
+    angular intervals, and its contribution to the area is obtained by Green's theorem.
+
+    Parameters
+    ----------
+    centers : np.array with shape (N, k, 2)
+        centers of k disks for each of N intersections
+    r       : float or array_like broadcastable with shape (N,)
+        radius of disks
+
+    Returns
+    -------
+    length : np.array with shape broadcast(r, (N,))
+        boundary length of the intersection of disks
+    area   : np.array with shape broadcast(r, (N,))
+        area of the intersection of disks
+
+    """
+    r = np.asarray(r, dtype=float)
+    n_disks = centers.shape[1]
+
+    diff = centers[:, np.newaxis, :, :] - centers[:, :, np.newaxis, :]
+    dist = np.linalg.norm(diff, axis=-1)
+    angle = np.arctan2(diff[..., 1], diff[..., 0])
+
+    length = 0.
+    area = 0.
+    for i in range(n_disks):
+        # arc on i-th circle inside j-th disks, in the frame rotated by the first angle
+        others = [j for j in range(n_disks) if j != i]
+        angle_ref = angle[:, i, others[0]]
+        lo = np.full(np.broadcast_shapes(r.shape, angle_ref.shape), -np.pi)
+        hi = np.full(lo.shape, np.pi)
+        for j in others:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                half_width = np.arccos(np.clip(dist[:, i, j] / (2 * r), -1., 1.))
+            delta = np.mod(angle[:, i, j] - angle_ref + np.pi, 2 * np.pi) - np.pi
+            lo = np.maximum(lo, delta - half_width)
+            hi = np.minimum(hi, delta + half_width)
+        hi = np.maximum(hi, lo)
+
+        theta_lo = angle_ref + lo
+        theta_hi = angle_ref + hi
+        center_x = centers[:, i, 0]
+        center_y = centers[:, i, 1]
+        length = length + r * (hi - lo)
+        area = area + 0.5 * (
+            r**2 * (hi - lo)
+            + r * (
+                center_x * (np.sin(theta_hi) - np.sin(theta_lo))
+                - center_y * (np.cos(theta_hi) - np.cos(theta_lo))
+            )
+        )
+    return length, area
+
+
+def _calc_circumradius(tri_points):
+    len_a = np.linalg.norm(tri_points[:, 1] - tri_points[:, 2], axis=-1)
+    len_b = np.linalg.norm(tri_points[:, 2] - tri_points[:, 0], axis=-1)
+    len_c = np.linalg.norm(tri_points[:, 0] - tri_points[:, 1], axis=-1)
+    vec_b = tri_points[:, 2] - tri_points[:, 0]
+    vec_c = tri_points[:, 1] - tri_points[:, 0]
+    twice_area = np.abs(vec_b[:, 0] * vec_c[:, 1] - vec_b[:, 1] * vec_c[:, 0])
+    with np.errstate(divide="ignore"):
+        return len_a * len_b * len_c / (2 * twice_area)
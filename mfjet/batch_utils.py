@@ -0,0 +1,120 @@
+"""
+Utilities for handling batches of jets stored in a ragged (CSR-style) layout.
+
+A batch of N_jets jets is represented by a flat coordinate array with shape
+(N_total, 2) and an offset array with shape (N_jets + 1,), such that the
+constituents of the i-th jet are coords[offsets[i]:offsets[i+1]].
+
+"""
+import numpy as np
+
+
+def ragged_to_flat(list_coords, n_dim=2):
+    """
+    Concatenate a list of coordinate arrays into a flat array and offsets.
+
+    Parameters
+    ----------
+    list_coords : sequence of array_like with shape (N_pt_i, n_dim)
+        coordinates of each jet
+    n_dim       : int, default 2
+        the number of coordinates of each point
+
+    Returns
+    -------
+    coords  : np.array with shape (N_total, n_dim)
+        flat array of coordinates
+    offsets : np.array with shape (N_jets + 1,)
+        CSR-style offsets of each jet in coords
+
+    """
+    list_coords = [np.asarray(coords, dtype=float).reshape(-1, n_dim) for coords in list_coords]
+    offsets = np.zeros(len(list_coords) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([coords.shape[0] for coords in list_coords])
+    if len(list_coords) == 0:
+        return np.zeros((0, n_dim)), offsets
+    return np.concatenate(list_coords, axis=0), offsets
+
+
+def check_ragged(coords, offsets=None, n_dim=2):
+    """
+    Normalize ragged batch inputs into a flat array and offsets.
+
+    Parameters
+    ----------
+    coords  : array_like with shape (N_total, n_dim) or sequence of array_like
+        flat array of coordinates, or list of coordinate arrays of each jet
+        if offsets is None.
+    offsets : array_like with shape (N_jets + 1,), optional
+        CSR-style offsets of each jet in coords
+    n_dim   : int, default 2
+        the number of coordinates of each point
+
+    Returns
+    -------
+    coords  : np.array with shape (N_total, n_dim)
+    offsets : np.array with shape (N_jets + 1,)
+
+    """
+    if offsets is None:
+        return ragged_to_flat(coords, n_dim)
+
+    coords = np.asarray(coords)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if offsets.ndim != 1 or offsets.shape[0] == 0:
+        raise ValueError("offsets should be a non-empty 1d array")
+    if offsets[0] != 0 or offsets[-1] != coords.shape[0]:
+        raise ValueError(
+            "offsets should start from 0 and end with the number of coordinates: "
+            "offsets[0]={}, offsets[-1]={}, coords.shape[0]={}".format(offsets[0], offsets[-1], coords.shape[0])
+        )
+    if np.any(np.diff(offsets) < 0):
+        raise ValueError("offsets should be non-decreasing")
+    return coords, offsets
+
+
+def iter_ragged(coords, offsets):
+    """
+    Iterate over coordinates of each jet in a ragged batch.
+
+    Parameters
+    ----------
+    coords  : np.array with shape (N_total, ...)
+    offsets : np.array with shape (N_jets + 1,)
+
+    Yields
+    ------
+    np.array with shape (N_pt_i, ...)
+        view of coordinates of the i-th jet
+
+    """
+    for start, stop in zip(offsets[:-1], offsets[1:]):
+        yield coords[start:stop]
+
+
+def calc_mfs_batch(func, coords, r, offsets=None):
+    """
+    Compute MFs of each jet in a ragged batch with a given per-jet function.
+
+    Parameters
+    ----------
+    func    : callable
+        function computing MFs of a single jet, func(coords, r),
+        returning an array with shape (3,) or (r.shape, 3)
+    coords  : array_like with shape (N_total, 2) or sequence of array_like
+    r       : float or array_like
+    offsets : array_like with shape (N_jets + 1,), optional
+
+    Returns
+    -------
+    np.array with shape (N_jets, 3) or (N_jets, r.shape, 3)
+        array of Minkowski functionals of each jet.
+        Empty jets have vanishing Minkowski functionals.
+
+    """
+    coords, offsets = check_ragged(coords, offsets)
+    arr_mfs = np.zeros((offsets.shape[0] - 1,) + np.shape(r) + (3,))
+    for i, jet_coords in enumerate(iter_ragged(coords, offsets)):
+        if jet_coords.shape[0] > 0:
+            arr_mfs[i] = func(jet_coords, r)
+    return arr_mfs
@@ -0,0 +1,230 @@
+"""
+Benchmark suite of MF calculators on synthetic jets.
+
+Each calculator is timed on reproducible synthetic jets while varying one factor
+at a time around default values: the number of constituents, the number of radii,
+and the resolution parameter of the calculator (quad_segs or bin_width).
+Results are emitted as JSON, so that runs of different commits can be compared::
+
+    python -m mfjet.benchmark -o new.json --compare old.json
+
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+import scipy
+import shapely
+
+from . import cli
+from . import synthetic_jets
+from .version import __version__
+
+
+# calculator name and its resolution parameter
+BENCHMARK_CALCULATORS = {
+    "euclidean": "quad_segs",
+    "euclidean-alpha": None,
+    "manhattan": None,
+    "manhattan-sweep": None,
+    "pixel": "bin_width",
+    "pixel-marching-square": "bin_width",
+    "pixel-euclidean": "bin_width",
+}
+
+DEFAULT_FACTORS = {
+    "n_constituents": 50,
+    "n_radii": 10,
+    "quad_segs": 8,
+    "bin_width": 0.05,
+}
+
+DEFAULT_SWEEPS = {
+    # 500 constituents exceed the dense grid of manhattan-sweep, which takes the vectorized sweep
+    "n_constituents": [20, 50, 100, 200, 500],
+    "n_radii": [1, 10, 30],
+    "quad_segs": [4, 8, 16],
+    "bin_width": [0.1, 0.05, 0.02],
+}
+
+
+def time_calculator(calc, coords, offsets, r, repeat=3):
+    """
+    Measure the wall time of computing MFs of jets one by one.
+
+    Parameters
+    ----------
+    calc    : MF calculator
+    coords  : np.array with shape (N_total, 2)
+    offsets : np.array with shape (N_jets + 1,)
+    r       : np.array
+    repeat  : int, default 3
+        the number of repetitions, the best time is taken
+
+    Returns
+    -------
+    float
+        the best wall time per jet in seconds
+
+    """
+    n_jets = offsets.shape[0] - 1
+    list_coords = [coords[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+    best = np.inf
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        for jet_coords in list_coords:
+            calc.calc_mfs(jet_coords, r)
+        best = min(best, time.perf_counter() - time_start)
+    return best / n_jets
+
+
+def iter_cases(calculators=None, kinds=("qcd", "top"), sweeps=None):
+    """
+    Iterate over benchmark cases varying one factor at a time.
+
+    Yields
+    ------
+    dict with calculator, kind, n_constituents, n_radii, and the resolution parameter
+
+    """
+    calculators = list(BENCHMARK_CALCULATORS) if calculators is None else calculators
+    sweeps = DEFAULT_SWEEPS if sweeps is None else sweeps
+    for name in calculators:
+        param = BENCHMARK_CALCULATORS[name]
+        factors = ["n_constituents", "n_radii"] + ([param] if param is not None else [])
+        for kind in kinds:
+            seen = set()
+            for factor in factors:
+                for value in sweeps[factor]:
+                    case = {"calculator": name, "kind": kind}
+                    case.update({key: DEFAULT_FACTORS[key] for key in factors})
+                    case[factor] = value
+                    key = tuple(sorted(case.items()))
+                    if key not in seen:
+                        seen.add(key)
+                        yield case
+
+
+def run_benchmarks(calculators=None, kinds=("qcd", "top"), sweeps=None, n_jets=20, repeat=3, r_max=0.5, seed=0):
+    """
+    Run the benchmark suite.
+
+    Parameters
+    ----------
+    calculators : list of str, optional
+        names of calculators, default is all calculators in BENCHMARK_CALCULATORS
+    kinds       : tuple of str, default ("qcd", "top")
+        kinds of synthetic jets
+    sweeps      : dict, optional
+        values of each factor, default is DEFAULT_SWEEPS
+    n_jets      : int, default 20
+        the number of jets in each case
+    repeat      : int, default 3
+        the number of repetitions of each case
+    r_max       : float, default 0.5
+        radii are np.linspace(r_max / n_radii, r_max, n_radii)
+    seed        : int, default 0
+        random seed of synthetic jets
+
+    Returns
+    -------
+    dict with
+        metadata : versions of packages and the platform
+        results  : list of dict of each case with "time_per_jet" in seconds
+
+    """
+    results = []
+    for case in iter_cases(calculators, kinds, sweeps):
+        coords, offsets, _ = synthetic_jets.generate_jets(case["kind"], n_jets, case["n_constituents"], seed=seed)
+        r = np.linspace(r_max / case["n_radii"], r_max, case["n_radii"])
+        calc = cli.make_calculator(
+            case["calculator"],
+            quad_segs=case.get("quad_segs"),
+            bin_width=case.get("bin_width"),
+        )
+        result = dict(case)
+        result["n_jets"] = n_jets
+        result["time_per_jet"] = time_calculator(calc, coords, offsets, r, repeat=repeat)
+        results.append(result)
+
+    return {
+        "metadata": {
+            "mfjet": __version__,
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "shapely": shapely.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "n_jets": n_jets,
+            "repeat": repeat,
+            "r_max": r_max,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare_benchmarks(old, new):
+    """
+    Compare two benchmark results case by case.
+
+    Parameters
+    ----------
+    old, new : dict
+        results returned by run_benchmarks
+
+    Returns
+    -------
+    list of (dict, float)
+        each case found in both results and the ratio of time_per_jet, new / old
+
+    """
+    def case_key(result):
+        return tuple(sorted((key, value) for key, value in result.items() if key != "time_per_jet"))
+
+    dict_old = {case_key(result): result["time_per_jet"] for result in old["results"]}
+    comparison = []
+    for result in new["results"]:
+        key = case_key(result)
+        if key in dict_old:
+            case = {k: v for k, v in result.items() if k != "time_per_jet"}
+            comparison.append((case, result["time_per_jet"] / dict_old[key]))
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m mfjet.benchmark", description="Benchmark MF calculators.")
+    parser.add_argument("-o", "--output", default=None, help="output JSON, default is stdout")
+    parser.add_argument("--calculators", nargs="+", default=None, choices=sorted(BENCHMARK_CALCULATORS))
+    parser.add_argument("--kinds", nargs="+", default=["qcd", "top"], choices=["qcd", "top"])
+    parser.add_argument("--n-jets", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", default=None, help="JSON of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    benchmark = run_benchmarks(
+        calculators=args.calculators, kinds=tuple(args.kinds),
+        n_jets=args.n_jets, repeat=args.repeat, seed=args.seed,
+    )
+    if args.output is None:
+        json.dump(benchmark, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.output, "w") as file:
+            json.dump(benchmark, file, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as file:
+            old = json.load(file)
+        for case, ratio in compare_benchmarks(old, benchmark):
+            label = ", ".join(f"{key}={value}" for key, value in case.items())
+            print(f"{ratio:6.2f}x  {label}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
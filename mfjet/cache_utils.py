@@ -0,0 +1,382 @@
+"""
+Persistent content-addressed cache of MFs.
+
+MFs are stored in an sqlite database for each radius, keyed by a hash of
+the coordinate bytes of a jet, a hash of the calculator type and its parameters,
+and the radius. A calculator wrapped by CachedCalculator computes only radii
+missing in the cache, so that repeated featurizations over overlapping radius grids
+reuse earlier results::
+
+    calc = CachedCalculator(MFEuclideanCalculator(quad_segs=8), MFCache("mfs.sqlite"))
+    calc.calc_mfs_batch(coords, np.linspace(0, 1, 11), offsets)
+    calc.calc_mfs_batch(coords, np.linspace(0, 1, 21), offsets)  # computes only 10 radii
+
+The database is bounded by max_bytes of stored MFs, where the least recently used
+entries are evicted first. The total size is kept in a metadata row by triggers,
+and entries beyond max_bytes are evicted when the database is opened and after each write.
+Freed pages are reused but not returned to the file system.
+
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from . import batch_utils
+from .version import __version__
+
+
+# attributes of calculators determining their results
+CALCULATOR_PARAMS = (
+    "quad_segs",
+    "bin_width",
+    "eps",
+    "mode",
+    "diagonal_connected",
+    "split_components",
+    "phi_period",
+    "backend",
+    "aspect",
+)
+
+# approximate size of keys and bookkeeping of each entry in bytes
+ENTRY_OVERHEAD = 64
+
+
+def calculator_key(calc):
+    """
+    Hash the type and parameters of a calculator.
+    The version of mfjet is included, so that results of other versions are not reused.
+    A wrapped calculator held as the attribute calc is hashed recursively.
+
+    Parameters
+    ----------
+    calc : MF calculator
+
+    Returns
+    -------
+    bytes
+        16-byte digest
+
+    """
+    params = {"type": f"{type(calc).__module__}.{type(calc).__qualname__}", "version": __version__}
+    for name in CALCULATOR_PARAMS:
+        if hasattr(calc, name):
+            value = getattr(calc, name)
+            params[name] = value.tolist() if isinstance(value, np.ndarray) else value
+    if hasattr(calc, "calc"):
+        params["calc"] = calculator_key(calc.calc).hex()
+    return hashlib.blake2b(json.dumps(params, sort_keys=True).encode(), digest_size=16).digest()
+
+
+def coords_key(coords):
+    """
+    Hash the coordinate bytes of a jet.
+
+    Parameters
+    ----------
+    coords : array_like with shape (N_pt, n_dim)
+
+    Returns
+    -------
+    bytes
+        16-byte digest
+
+    """
+    coords = np.ascontiguousarray(coords, dtype=float)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.array(coords.shape, dtype=np.int64).tobytes())
+    digest.update(coords.tobytes())
+    return digest.digest()
+
+
+class MFCache:
+    """
+    Size-bounded LRU store of MFs in an sqlite database.
+
+    Parameters
+    ----------
+    path      : str
+        path of the database file, created if it does not exist
+    max_bytes : int, default 2**30
+        the maximum size of stored entries in bytes,
+        enforced when the database is opened and after each write
+    timeout   : float, default 30.
+        seconds to wait for a lock held by another process
+
+    """
+    def __init__(self, path, max_bytes=2 ** 30, timeout=30.):
+        self.path = os.fspath(path)
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.n_hits = 0
+        self.n_misses = 0
+        self._conn = None
+
+    def __getstate__(self):
+        # connections are not shared across processes
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=self.timeout)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            # entries replaced by INSERT OR REPLACE fire the delete trigger
+            self._conn.execute("PRAGMA recursive_triggers=ON")
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS mfs ("
+                    "jet BLOB, calc BLOB, r REAL, mfs BLOB, size INTEGER, last_used REAL, "
+                    "PRIMARY KEY (jet, calc, r)) WITHOUT ROWID"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS mfs_last_used ON mfs (last_used)")
+                self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+                # the total size of databases written without the metadata is counted once
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO meta SELECT 'size', COALESCE(SUM(size), 0) FROM mfs"
+                )
+                self._conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS mfs_insert AFTER INSERT ON mfs BEGIN "
+                    "UPDATE meta SET value = value + NEW.size WHERE key = 'size'; END"
+                )
+                self._conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS mfs_delete AFTER DELETE ON mfs BEGIN "
+                    "UPDATE meta SET value = value - OLD.size WHERE key = 'size'; END"
+                )
+                self._evict(self._conn)
+        return self._conn
+
+    def get(self, jet, calc, r):
+        """
+        Look up cached MFs of a jet.
+
+        Parameters
+        ----------
+        jet  : bytes
+            key of coordinates, see coords_key
+        calc : bytes
+            key of the calculator, see calculator_key
+        r    : np.array with shape (N_r,)
+            radii
+
+        Returns
+        -------
+        dict of float to np.array with shape (n_mfs,)
+            MFs of cached radii
+
+        """
+        return self.get_many([jet], calc, r)[0]
+
+    def get_many(self, jets, calc, r):
+        """
+        Look up cached MFs of several jets in a single transaction.
+
+        Parameters
+        ----------
+        jets : sequence of bytes
+        calc : bytes
+        r    : np.array with shape (N_r,)
+
+        Returns
+        -------
+        list of dict of float to np.array with shape (n_mfs,)
+            MFs of cached radii of each jet
+
+        """
+        conn = self._connect()
+        radii = [float(value) for value in np.unique(r)]
+        list_found = []
+        touched = []
+        now = time.time()
+        with conn:
+            for jet in jets:
+                found = {}
+                # sqlite limits the number of bound parameters
+                for start in range(0, len(radii), 500):
+                    chunk = radii[start:start + 500]
+                    rows = conn.execute(
+                        "SELECT r, mfs FROM mfs WHERE jet = ? AND calc = ? AND r IN ({})".format(",".join("?" * len(chunk))),
+                        [jet, calc] + chunk,
+                    ).fetchall()
+                    found.update((value, np.frombuffer(mfs, dtype=float)) for value, mfs in rows)
+                touched.extend((now, jet, calc, value) for value in found)
+                self.n_hits += len(found)
+                self.n_misses += len(radii) - len(found)
+                list_found.append(found)
+            conn.executemany("UPDATE mfs SET last_used = ? WHERE jet = ? AND calc = ? AND r = ?", touched)
+        return list_found
+
+    def put(self, jet, calc, r, arr_mfs):
+        """
+        Store MFs of a jet and evict least recently used entries beyond max_bytes.
+
+        Parameters
+        ----------
+        jet     : bytes
+        calc    : bytes
+        r       : np.array with shape (N_r,)
+        arr_mfs : np.array with shape (N_r, n_mfs)
+
+        """
+        self.put_many([(jet, calc, r, arr_mfs)])
+
+    def put_many(self, entries):
+        """
+        Store MFs of several jets in a single transaction.
+
+        Parameters
+        ----------
+        entries : iterable of (jet, calc, r, arr_mfs)
+            arguments of put
+
+        """
+        now = time.time()
+        rows = []
+        for jet, calc, r, arr_mfs in entries:
+            arr_mfs = np.asarray(arr_mfs, dtype=float).reshape(len(r), -1)
+            for value, mfs in zip(r, arr_mfs):
+                mfs = mfs.tobytes()
+                rows.append((jet, calc, float(value), mfs, len(mfs) + ENTRY_OVERHEAD, now))
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO mfs VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._evict(conn)
+
+    def _evict(self, conn):
+        size = conn.execute("SELECT value FROM meta WHERE key = 'size'").fetchone()[0]
+        if size <= self.max_bytes:
+            return
+        excess = size - self.max_bytes
+        freed = 0
+        keys = []
+        for jet, calc, r, entry_size in conn.execute("SELECT jet, calc, r, size FROM mfs ORDER BY last_used"):
+            keys.append((jet, calc, r))
+            freed += entry_size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM mfs WHERE jet = ? AND calc = ? AND r = ?", keys)
+
+    def size(self):
+        """
+        Return the number of entries and their size in bytes.
+
+        Returns
+        -------
+        (int, int)
+
+        """
+        conn = self._connect()
+        n_entries = conn.execute("SELECT COUNT(*) FROM mfs").fetchone()[0]
+        return n_entries, conn.execute("SELECT value FROM meta WHERE key = 'size'").fetchone()[0]
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM mfs")
+
+
+class CachedCalculator:
+    """
+    Wrapper of an MF calculator reusing MFs stored in an MFCache.
+
+    Parameters
+    ----------
+    calc  : MF calculator
+        any calculator with calc_mfs(coords, r) and calc_mfs_batch(coords, r, offsets)
+    cache : MFCache or str
+        cache, or path of its database
+
+    """
+    def __init__(self, calc, cache):
+        self.calc = calc
+        self.cache = MFCache(cache) if isinstance(cache, (str, os.PathLike)) else cache
+        self.calc_key = calculator_key(calc)
+
+    def calc_mfs(self, coords, r):
+        """
+        Compute MFs of a jet, where only radii missing in the cache are computed.
+
+        Parameters
+        ----------
+        coords : array_like with shape (N_pt, n_dim)
+        r      : float or array_like
+
+        Returns
+        -------
+        np.array with shape (n_mfs,) or (r.shape, n_mfs)
+
+        """
+        coords = np.asarray(coords, dtype=float)
+        r = np.asarray(r, dtype=float)
+        radii = r.ravel()
+        jet = coords_key(coords)
+        found = self.cache.get(jet, self.calc_key, radii)
+        r_missing = np.array([value for value in np.unique(radii) if float(value) not in found])
+        if r_missing.shape[0] > 0:
+            arr_mfs = self.calc.calc_mfs(coords, r_missing).reshape(r_missing.shape[0], -1)
+            self.cache.put(jet, self.calc_key, r_missing, arr_mfs)
+            found.update(zip(r_missing.tolist(), arr_mfs))
+        return np.stack([found[float(value)] for value in radii]).reshape(r.shape + (-1,))
+
+    def calc_mfs_batch(self, coords, r, offsets=None):
+        """
+        Compute MFs of each jet in a ragged batch, where jets missing any radius in the cache
+        are computed in a single batch over the union of their missing radii.
+
+        Parameters
+        ----------
+        coords  : array_like with shape (N_total, n_dim) or sequence of array_like
+        r       : float or array_like
+        offsets : array_like with shape (N_jets + 1,), optional
+
+        Returns
+        -------
+        np.array with shape (N_jets, n_mfs) or (N_jets, r.shape, n_mfs)
+
+        """
+        coords, offsets = batch_utils.check_ragged(coords, offsets)
+        coords = np.asarray(coords, dtype=float)
+        r = np.asarray(r, dtype=float)
+        radii = r.ravel()
+        r_unique = np.unique(radii)
+        n_jets = offsets.shape[0] - 1
+        if n_jets == 0:
+            return np.zeros((0,) + r.shape + (coords.shape[1] + 1,))
+
+        list_coords = list(batch_utils.iter_ragged(coords, offsets))
+        jets = [coords_key(jet_coords) for jet_coords in list_coords]
+        list_found = self.cache.get_many(jets, self.calc_key, r_unique)
+        missing = [i for i, found in enumerate(list_found) if len(found) < r_unique.shape[0]]
+        if missing:
+            r_missing = np.array([
+                value for value in r_unique
+                if any(float(value) not in list_found[i] for i in missing)
+            ])
+            coords_missing, offsets_missing = batch_utils.ragged_to_flat(
+                [list_coords[i] for i in missing], n_dim=coords.shape[1]
+            )
+            arr_mfs = self.calc.calc_mfs_batch(coords_missing, r_missing, offsets_missing)
+            arr_mfs = arr_mfs.reshape(len(missing), r_missing.shape[0], -1)
+            self.cache.put_many([(jets[i], self.calc_key, r_missing, mfs) for i, mfs in zip(missing, arr_mfs)])
+            for i, mfs in zip(missing, arr_mfs):
+                list_found[i].update(zip(r_missing.tolist(), mfs))
+
+        return np.stack([
+            np.stack([found[float(value)] for value in radii]) for found in list_found
+        ]).reshape((len(list_found),) + r.shape + (-1,))
@@ -4,11 +4,16 @@
 
 import numpy as np
 import shapely
-import shapely.ops
 
 from . import minkowski_funcs
+from . import batch_utils
+from . import alpha_utils
+from . import persistence_utils
+from . import cluster_utils
+from . import parallel_utils
+from .profiling import ProfilingMixin
 
-class MFEuclideanCalculator:
+class MFEuclideanCalculator(ProfilingMixin):
     """
     Minkowski functional calculator for the persistent analysis with 
     Steiner-type formula in Euclidean geometry.
@@ -20,13 +25,32 @@ class MFEuclideanCalculator:
         in the approximation of circular arcs. 
         This number will be used as quad_segs param in shapely.buffer method 
         if quad_segs is not provided to member funtions.
+    split_components : bool, default True
+        If true, points are split into clusters linked within 2r by a KD-tree,
+        and each cluster is dilated and measured independently.
+        Isolated points are measured analytically without geometry operations.
+        Radii at which all points are linked into a single cluster are dilated
+        in a single vectorized call as without clusters.
+    phi_period : float, optional
+        If given, the second coordinate (phi) is periodic with this period, e.g., 2 * np.pi,
+        and MFs are computed on the cylinder. The neighbour search is periodic,
+        and only clusters linked across phi = 0 are measured with copies near the seam.
+    n_threads : int, default 1
+        The number of threads evaluating radii of a jet concurrently, where larger radii
+        are started first. Shapely releases the GIL inside GEOS operations.
+        This number will be used if n_threads is not provided to calc_mfs.
 
 
     """
-    def __init__(self, quad_segs=8):
+    def __init__(self, quad_segs=8, split_components=True, phi_period=None, n_threads=1):
         self.quad_segs=quad_segs
+        self.split_components = split_components
+        self.phi_period = phi_period
+        self.n_threads = n_threads
+        # exact engine of calc_mfs_persistence, sharing the profiler
+        self.calc_alpha = MFEuclideanCalculatorAlphaComplex()
 
-    def calc_mfs(self, coords, r, quad_segs=None):
+    def calc_mfs(self, coords, r, quad_segs=None, n_threads=None):
         """
         Compute MFs given points dilated by a disk with radius r.
 
@@ -38,6 +62,8 @@ class MFEuclideanCalculator:
         quad_segs : int, default 8
             The number of linear segments in a quarter circle in 
             the approximation of circular arcs.
+        n_threads : int, default 1
+            The number of threads evaluating radii concurrently.
 
         Returns
         -------
@@ -49,21 +75,116 @@ class MFEuclideanCalculator:
                 - k=2: Area
 
         """
+        return self._calc_mfs_points(shapely.points(np.asarray(coords)), r, quad_segs, n_threads)
+
+    def _calc_mfs_points(self, points, r, quad_segs=None, n_threads=None):
         if np.ndim(r) == 0:
             if r == 0:
-                npt = coords.shape[0]
+                npt = points.shape[0]
                 return np.array([npt,0.,0.])
+            elif self.split_components or self.phi_period is not None:
+                return self._calc_mfs_clusters(points, r, quad_segs)
             else:
-                geom = self.dilate_points_by_disk(coords, r, quad_segs)
-                return minkowski_funcs.calc_mfs(geom)
+                geom = self._dilate_points_by_disk(points, r, quad_segs)
+                return self._measure_geoms(geom)
         else:
-            return np.stack(
-                [
-                    self.calc_mfs(coords, this_r, quad_segs)
-                    for this_r in r
-                ],
-                axis=0
+            r = np.asarray(r, dtype=float)
+            arr_mfs = np.zeros(r.shape + (3,))
+            arr_mfs[r == 0, 0] = points.shape[0]
+            n_threads = self.n_threads if n_threads is None else n_threads
+            r_nonzero = r[r != 0]
+            if self.phi_period is not None:
+                is_clustered = np.ones(r_nonzero.shape, dtype=bool)
+            elif self.split_components:
+                # radii linking all points are dilated together as without clusters
+                with self._stage("cluster"):
+                    is_clustered = ~cluster_utils.is_single_cluster(shapely.get_coordinates(points), r_nonzero, p=2)
+            else:
+                is_clustered = np.zeros(r_nonzero.shape, dtype=bool)
+            list_mfs = np.zeros(r_nonzero.shape + (3,))
+            if np.any(is_clustered):
+                list_mfs[is_clustered] = np.reshape(parallel_utils.map_radii(
+                    lambda this_r: self._calc_mfs_clusters(points, this_r, quad_segs), r_nonzero[is_clustered], n_threads
+                ), (-1, 3))
+            if not np.all(is_clustered):
+                list_mfs[~is_clustered] = np.reshape(
+                    self._calc_mfs_union(points, r_nonzero[~is_clustered], quad_segs, n_threads), (-1, 3)
+                )
+            arr_mfs[r != 0] = list_mfs
+            return arr_mfs
+
+    def _calc_mfs_union(self, points, r, quad_segs=None, n_threads=1):
+        if n_threads > 1:
+            return parallel_utils.map_radii(
+                lambda this_r: self._measure_geoms(self._dilate_points_by_disk(points, this_r, quad_segs)),
+                r, n_threads
+            )
+        return self._measure_geoms(self._dilate_points_by_disk(points, r, quad_segs))
+
+    def _calc_mfs_clusters(self, points, r, quad_segs=None):
+        quad_segs = self.quad_segs if quad_segs is None else quad_segs
+        # a dilated point is a regular polygon inscribed in the circle
+        n_segs = 4 * quad_segs
+        mfs_isolated = [
+            1.,
+            2 * n_segs * r * np.sin(np.pi / n_segs),
+            0.5 * n_segs * r**2 * np.sin(2 * np.pi / n_segs),
+        ]
+        dilate = lambda cluster_points, r: self._dilate_points_by_disk(cluster_points, r, quad_segs)
+        if not self.split_components:
+            return cluster_utils.calc_mfs_periodic(
+                shapely.get_coordinates(points), r, dilate, self.phi_period, measure=self._measure_geoms
             )
+        return cluster_utils.calc_mfs_clusters(
+            points, r, dilate, mfs_isolated, p=2,
+            measure=self._measure_geoms, stage=self._stage, period=self.phi_period
+        )
+
+    def _measure_geoms(self, geoms):
+        with self._stage("measure"):
+            if self.profiler is not None:
+                self._count("vertices", np.sum(shapely.get_num_coordinates(geoms)))
+            return minkowski_funcs.calc_mfs_array(geoms)
+
+    def calc_mfs_persistence(self, coords, r, return_events=False):
+        """
+        Compute exact MFs for all r from the alpha complex filtration of given points.
+        See MFEuclideanCalculatorAlphaComplex.calc_mfs_persistence.
+
+        """
+        return self.calc_alpha.calc_mfs_persistence(coords, r, return_events)
+
+    def calc_mfs_batch(self, coords, r, offsets=None, quad_segs=None):
+        """
+        Compute MFs of a batch of jets given points dilated by a disk with radius r.
+
+        Parameters
+        ----------
+        coords    : array_like with shape (N_total, 2) or sequence of array_like
+            Flat array of coordinates of all jets.
+            If offsets is None, a list of coordinate arrays of each jet.
+        r         : float or array_like
+            The circle radius in the Minkowski sum.
+        offsets   : array_like with shape (N_jets + 1,), optional
+            CSR-style offsets, coords[offsets[i]:offsets[i+1]] are the coordinates of i-th jet.
+        quad_segs : int, default 8
+            The number of linear segments in a quarter circle in 
+            the approximation of circular arcs.
+
+        Returns
+        -------
+        np.array with shape (N_jets, 3) or (N_jets, r.shape, 3)
+            array of Minkowski functionals of each jet given r.
+
+        """
+        coords, offsets = batch_utils.check_ragged(coords, offsets)
+        points = shapely.points(coords)
+        quad_segs = self.quad_segs if quad_segs is None else quad_segs
+        r = np.asarray(r, dtype=float)
+        return batch_utils.calc_mfs_batch(
+            lambda jet_points, r: self._calc_mfs_points(jet_points, r, quad_segs),
+            points, r, offsets
+        )
 
     def dilate_points_by_disk(self, coords, r, quad_segs=None):
         """
@@ -73,27 +194,134 @@ class MFEuclideanCalculator:
         Parameters
         ----------
         coords    : array_like with shape (N_pt, 2)
-        r         : float
+        r         : float or array_like
             The circle radius in the Minkowski sum.
+            If r is an array, all radii are buffered in a single vectorized call.
         quad_segs : int, default 8
             The number of linear segments in a quarter circle in 
             the approximation of circular arcs.
 
         Returns
         -------
-        shapely.Polygon or shapely.MultiPolygon
+        shapely.Polygon or shapely.MultiPolygon, or np.array of them with shape r.shape
             geometry object representing dilated points
 
         """
-        list_dilated_points  = [
-            shapely.geometry.Point(
-                *coord
-            ).buffer(
-                r,
-                cap_style='round',
-                quad_segs=self.quad_segs if quad_segs is None else quad_segs
+        return self._dilate_points_by_disk(shapely.points(np.asarray(coords)), r, quad_segs)
+
+    def _dilate_points_by_disk(self, points, r, quad_segs=None):
+        quad_segs = self.quad_segs if quad_segs is None else quad_segs
+        if np.ndim(r) == 0:
+            with self._stage("buffer"):
+                list_dilated_points = shapely.buffer(points, r, cap_style="round", quad_segs=quad_segs)
+            with self._stage("union"):
+                return shapely.union_all(list_dilated_points)
+        else:
+            r = np.asarray(r, dtype=float)
+            with self._stage("buffer"):
+                arr_dilated_points = shapely.buffer(points, r[..., np.newaxis], cap_style="round", quad_segs=quad_segs)
+            with self._stage("union"):
+                return shapely.union_all(arr_dilated_points, axis=-1)
+
+
+class MFEuclideanCalculatorAlphaComplex(ProfilingMixin):
+    """
+    Minkowski functional calculator for the persistent analysis with 
+    Steiner-type formula in Euclidean geometry.
+    This module computes exact MFs of a union of disks from the alpha complex 
+    of given points instead of polygon approximation with shapely.
+
+    """
+    def __init__(self):
+        pass
+
+    def calc_mfs(self, coords, r):
+        """
+        Compute MFs given points dilated by a disk with radius r.
+
+        Parameters
+        ----------
+        coords    : array_like with shape (N_pt, 2)
+        r         : float or array_like
+            The circle radius in the Minkowski sum.
+
+        Returns
+        -------
+        np.array with shape (3,) or (r.shape, 3)
+            array of Minkowski functionals given r. 
+            The last index k is labeling $k$-th Minkiwski functionals
+                - k=0: Euler characteristic
+                - k=1: Boundary length
+                - k=2: Area
+
+        """
+        coords = np.asarray(coords)
+        r = np.asarray(r, dtype=float)
+        with self._stage("alpha_complex"):
+            alpha_complex = alpha_utils.calc_alpha_complex(coords)
+        with self._stage("measure"):
+            arr_mfs = alpha_utils.calc_mfs_alpha_complex(*alpha_complex, r)
+        arr_mfs[r == 0] = [coords.shape[0], 0., 0.]
+        return arr_mfs
+
+    def calc_mfs_persistence(self, coords, r, return_events=False):
+        """
+        Compute MFs for all r from the alpha complex filtration of given points.
+        The filtration is computed once, and the Euler characteristic is obtained
+        by counting persistence pairs alive at each r.
+
+        Parameters
+        ----------
+        coords        : array_like with shape (N_pt, 2)
+        r             : float or array_like
+            The circle radius in the Minkowski sum.
+        return_events : bool, default False
+            If true, persistence pairs of the filtration are also returned.
+
+        Returns
+        -------
+        np.array with shape (3,) or (r.shape, 3)
+            array of Minkowski functionals given r. 
+        dict, optional
+            persistence pairs with keys "birth", "death", "weight" and "dim".
+            The Euler characteristic at r is the sum of weights of pairs with birth <= r < death.
+
+        """
+        coords = np.asarray(coords)
+        r = np.asarray(r, dtype=float)
+        with self._stage("alpha_complex"):
+            alpha_complex = alpha_utils.calc_alpha_complex(coords)
+        with self._stage("persistence"):
+            events = persistence_utils.calc_alpha_persistence(*alpha_complex)
+        with self._stage("measure"):
+            arr_mfs = alpha_utils.calc_mfs_alpha_complex(*alpha_complex, r)
+            arr_mfs[..., 0] = persistence_utils.eval_events(
+                events["birth"], events["death"], events["weight"], r
             )
-            for coord in coords
-        ]
-        geom_dilated_points = shapely.ops.unary_union(list_dilated_points)
-        return geom_dilated_points
+        arr_mfs[r == 0] = [coords.shape[0], 0., 0.]
+        if return_events:
+            return arr_mfs, events
+        return arr_mfs
+
+    def calc_mfs_batch(self, coords, r, offsets=None):
+        """
+        Compute MFs of a batch of jets given points dilated by a disk with radius r.
+
+        Parameters
+        ----------
+        coords    : array_like with shape (N_total, 2) or sequence of array_like
+            Flat array of coordinates of all jets.
+            If offsets is None, a list of coordinate arrays of each jet.
+        r         : float or array_like
+            The circle radius in the Minkowski sum.
+        offsets   : array_like with shape (N_jets + 1,), optional
+            CSR-style offsets, coords[offsets[i]:offsets[i+1]] are the coordinates of i-th jet.
+
+        Returns
+        -------
+        np.array with shape (N_jets, 3) or (N_jets, r.shape, 3)
+            array of Minkowski functionals of each jet given r.
+
+        """
+        r = np.asarray(r, dtype=float)
+        return batch_utils.calc_mfs_batch(self.calc_mfs, coords, r, offsets)
@@ -1,12 +1,16 @@
 
+import warnings
+
 import numpy as np
-import scipy.sparse
-import scipy.signal
+import scipy.ndimage
 
-from .calculator_mf_manhattan import MFManhattanCalculator
+from .calculator_mf_manhattan import MFManhattanCalculator, MFManhattanCalculatorSweepLine
 from . import pixel_utils
+from . import batch_utils
+from . import jit_utils
+from .profiling import ProfilingMixin
 
-class MFPixelCalculator:
+class MFPixelCalculator(ProfilingMixin):
     """
     Minkowski functional calculator for the persistent analysis with 
     Steiner-type formula in Manhattan geometry. 
@@ -31,12 +35,30 @@ class MFPixelCalculator:
     diagonal_connected : bool, default False:
         If true, diagonally connected pixels will be considered as a connected piece. 
         This flag will affect only calculation of Euler characteristics.
+        Only supported by the "sweep" backend.
+
+    backend : str, default "shapely"
+        If backend is "shapely", the union of dilated pixels is computed by MFManhattanCalculator.
+        If backend is "sweep", the union of dilated pixels is computed by MFManhattanCalculatorSweepLine
+        without shapely.
+
+    phi_period : float, optional
+        If given, the second coordinate (phi) is periodic with this period, e.g., 2 * np.pi,
+        and MFs are computed on the cylinder. The period should be a multiple of bin_width.
+        Only supported by the "shapely" backend.
+
+    n_threads : int, default 1
+        The number of threads evaluating radii of a jet concurrently, see MFManhattanCalculator.
+        Only used by the "shapely" backend.
 
     """
 
-    def __init__(self, bin_width=1., eps=1e-6, mode="center", diagonal_connected=False):
+    def __init__(self, bin_width=1., eps=1e-6, mode="center", diagonal_connected=False, backend="shapely", phi_period=None, n_threads=1):
         self.bin_width = bin_width
         self.mode = mode
+        self.diagonal_connected = diagonal_connected
+        self.backend = backend
+        self.phi_period = phi_period
 
         if mode == "center":
             self.offset = -bin_width * 0.5
@@ -46,10 +68,20 @@ class MFPixelCalculator:
             raise ValueError(f"unknown mode: {mode}")
         self.eps = eps
 
-        if diagonal_connected:
-            raise NotImplementedError("connected diagonal is not implemented yet. Please use MFPixelCalculatorMarchingSquare")
-
-        self.calc = MFManhattanCalculator()
+        if phi_period is not None:
+            # pixels are periodic, so that the period is rounded to a multiple of bin_width
+            phi_period = pixel_utils.calc_n_periodic_bins(phi_period, bin_width, eps) * bin_width
+
+        if backend == "shapely":
+            if diagonal_connected:
+                raise NotImplementedError("connected diagonal is not implemented yet. Please use MFPixelCalculatorMarchingSquare or backend=\"sweep\"")
+            self.calc = MFManhattanCalculator(phi_period=phi_period, n_threads=n_threads)
+        elif backend == "sweep":
+            if phi_period is not None:
+                raise NotImplementedError("periodic phi is not implemented yet. Please use MFPixelCalculatorMarchingSquare or backend=\"shapely\"")
+            self.calc = MFManhattanCalculatorSweepLine(diagonal_connected=diagonal_connected)
+        else:
+            raise ValueError(f"unknown backend: {backend}")
 
     def calc_mfs(self, coords, r):
         """
@@ -74,12 +106,58 @@ class MFPixelCalculator:
                k=2: Area
 
         """
-        buf_coords = pixel_utils.coords_to_binned_coords(coords, bin_width=self.bin_width, eps=self.eps, mode=self.mode)
-        half_width = self.bin_width * 0.5
-        buf_r = np.ceil((r + half_width * self.eps)/ half_width) * half_width
+        with self._stage("pixelization"):
+            buf_coords = pixel_utils.coords_to_binned_coords(coords, bin_width=self.bin_width, eps=self.eps, mode=self.mode)
+        buf_r = self.discretize_r(r)
         return self.calc.calc_mfs(buf_coords, buf_r)
 
-class MFPixelCalculatorMarchingSquare:
+    def calc_mfs_batch(self, coords, r, offsets=None):
+        """
+        Compute MFs of a batch of jets given points dilated by a square with half-width r.
+        Pixelation of coords and discretization of r are done once for the whole batch.
+
+        Parameters
+        ----------
+        coords    : array_like with shape (N_total, 2) or sequence of array_like
+            Flat array of coordinates of all jets.
+            If offsets is None, a list of coordinate arrays of each jet.
+        r         : float or array_like
+            Specifies the half-width of a square in the Minkowski sum.
+        offsets   : array_like with shape (N_jets + 1,), optional
+            CSR-style offsets, coords[offsets[i]:offsets[i+1]] are the coordinates of i-th jet.
+
+        Returns
+        -------
+        np.array with shape (N_jets, 3) or (N_jets, r.shape, 3)
+            array of Minkowski functionals of each jet given r.
+
+        """
+        coords, offsets = batch_utils.check_ragged(coords, offsets)
+        with self._stage("pixelization"):
+            bin_idx = pixel_utils.coords_to_bin_idx(coords, bin_width=self.bin_width, eps=self.eps, mode=self.mode)
+        buf_r = self.discretize_r(r)
+        return batch_utils.calc_mfs_batch(
+            lambda jet_bin_idx, buf_r: self.calc.calc_mfs(np.unique(jet_bin_idx, axis=0) * self.bin_width, buf_r),
+            bin_idx, buf_r, offsets
+        )
+
+    def discretize_r(self, r):
+        """
+        Discretize the dilation scale r into multiples of bin_width*0.5.
+
+        Parameters
+        ----------
+        r         : float or array_like
+
+        Returns
+        -------
+        float or np.array with the same shape of r
+
+        """
+        half_width = self.bin_width * 0.5
+        return np.ceil((np.asarray(r, dtype=float) + half_width * self.eps)/ half_width) * half_width
+
+class MFPixelCalculatorMarchingSquare(ProfilingMixin):
     """
     Minkowski functional calculator for the persistent analysis with
     Steiner-type formula in Manhattan geometry.
@@ -104,11 +182,54 @@ class MFPixelCalculatorMarchingSquare:
     diagonal_connected : bool, default False:
         If true, diagonally connected pixels will be considered as a connected piece.
         This flag will affect only calculation of Euler characteristics.
+    radius_scan : str, default "distance_transform"
+        Algorithm used for an array of r.
+        If radius_scan is "distance_transform", the chessboard distance transform of the image
+        is computed once, and MFs for all r are obtained from the radius at which 
+        each 2x2 configuration is switched on.
+        If radius_scan is "dilation", the image is dilated for each r.
+    tile_size : int, optional
+        If given, pixelated coords are represented sparsely by tiles of tile_size x tile_size pixels.
+        Only tiles within the reach of the dilation from occupied pixels are dilated and measured,
+        so that the cost scales with the number of constituents and the radius 
+        rather than the area of the bounding box. 
+        The distance transform is used for all r regardless of radius_scan.
+        Tiles are efficient if tile_size is not smaller than the largest r in units of pixels,
+        since each tile is processed together with a halo of that width.
+    phi_period : float, optional
+        If given, the second coordinate (phi) is periodic with this period, e.g., 2 * np.pi,
+        and MFs are computed on the cylinder. The period should be a multiple of bin_width.
+        If the dilated pixels do not reach around the cylinder, the cylinder is cut open 
+        in the largest gap between occupied columns, and the image is measured as usual.
+        Otherwise, the image covering the whole period is dilated and measured with wrap-around columns.
+        Images given to calc_mfs are assumed to cover the whole period along the second axis.
+    backend : str, default "numpy"
+        If backend is "numba", pixelation, dilation and counting of 2x2 configurations of 
+        coords are fused into a JIT-compiled loop, and jets in calc_mfs_batch are processed 
+        in parallel threads. Results are identical to the "numpy" backend.
+        It falls back to "numpy" with a warning if numba is not installed,
+        and it is not used with tile_size, phi_period, or image inputs.
 
     """
 
-    def __init__(self, bin_width=1., eps=1e-6, mode="center", diagonal_connected=False):
+    def __init__(self, bin_width=1., eps=1e-6, mode="center", diagonal_connected=False, radius_scan="distance_transform", tile_size=None, phi_period=None, backend="numpy"):
         self.bin_width = bin_width
+        self.mode = mode
+        self.diagonal_connected = diagonal_connected
+        self.tile_size = tile_size
+        self.phi_period = phi_period
+        self.n_phi_bins = None if phi_period is None else pixel_utils.calc_n_periodic_bins(phi_period, bin_width, eps)
+
+        if radius_scan not in ("distance_transform", "dilation"):
+            raise ValueError(f"unknown radius_scan: {radius_scan}")
+        self.radius_scan = radius_scan
+
+        if backend not in ("numpy", "numba"):
+            raise ValueError(f"unknown backend: {backend}")
+        if backend == "numba" and not jit_utils.HAS_NUMBA:
+            warnings.warn("numba is not installed, the numpy backend is used instead.", RuntimeWarning)
+            backend = "numpy"
+        self.backend = backend
 
         if mode == "center":
             self.offset = -bin_width * 0.5
@@ -118,7 +239,7 @@ class MFPixelCalculatorMarchingSquare:
             raise ValueError(f"unknown mode: {mode}")
         self.eps = eps
 
-
+        # weights of the 2x2 binary encoding of pixels (i, j), (i, j-1), (i-1, j), (i-1, j-1)
         self.filter_binary = np.array([[1,2],[4,8]], dtype=int)
 
         # lookup table for (local MF * 4)
@@ -157,10 +278,12 @@ class MFPixelCalculatorMarchingSquare:
         coords    : array_like with shape (N_pt, 2)
         r         : float or array_like
             Specifies the half-width of a square in the Minkowski sum.
+        img       : array_like with shape (H, W) or (N_img, H, W), optional
+            binary image, or stack of binary images, used instead of coords.
 
         Returns
         -------
-        np.array with shape (3,) or (r.shape, 3)
+        np.array with shape (3,) or (r.shape, 3), or (N_img, 3) or (N_img, r.shape, 3) for a stack of images
             array of Minkowski functionals given r.
             The last index k is labeling $k$-th Minkiwski functionals
                k=0: Euler characteristic
@@ -169,51 +292,685 @@ class MFPixelCalculatorMarchingSquare:
 
         """
         if img is None:
+            if self._use_jit():
+                coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+                return self.calc_mfs_jit(coords, r, np.array([0, coords.shape[0]]))[0]
+            if self.tile_size is not None or self.n_phi_bins is not None:
+                return self.calc_mfs_from_bin_idx(self.coord_to_bin_idx(np.asarray(coords)), self.r_to_square_width(r))
             img = self.coord_to_img(coords)
-        if np.ndim(r) == 0:
-            if r == 0:
-                #npt = coords.shape[0]
-                #return np.array([npt,0.,0.])
+        elif np.ndim(img) == 3 or self.n_phi_bins is not None:
+            return self.calc_mfs_from_imgs(img, r)
+        return self.calc_mfs_from_square_width(img, self.r_to_square_width(r))
+
+    def calc_mfs_batch(self, coords, r, offsets=None):
+        """
+        Compute MFs of a batch of jets given points dilated by a square with half-width r.
+        Pixelation of coords and discretization of r are done once for the whole batch.
+
+        Parameters
+        ----------
+        coords    : array_like with shape (N_total, 2) or sequence of array_like
+            Flat array of coordinates of all jets.
+            If offsets is None, a list of coordinate arrays of each jet.
+        r         : float or array_like
+            Specifies the half-width of a square in the Minkowski sum.
+        offsets   : array_like with shape (N_jets + 1,), optional
+            CSR-style offsets, coords[offsets[i]:offsets[i+1]] are the coordinates of i-th jet.
+
+        Returns
+        -------
+        np.array with shape (N_jets, 3) or (N_jets, r.shape, 3)
+            array of Minkowski functionals of each jet given r.
+
+        """
+        coords, offsets = batch_utils.check_ragged(coords, offsets)
+        if self._use_jit():
+            return self.calc_mfs_jit(coords, r, offsets)
+        bin_idx = self.coord_to_bin_idx(coords)
+        square_width = self.r_to_square_width(r)
+        return batch_utils.calc_mfs_batch(self.calc_mfs_from_bin_idx, bin_idx, square_width, offsets)
+
+    def calc_mfs_jit(self, coords, r, offsets):
+        """
+        Compute MFs of a batch of jets by the JIT-compiled kernel, see jit_utils.
+
+        Parameters
+        ----------
+        coords    : np.array with shape (N_total, 2)
+        r         : float or array_like
+            Specifies the half-width of a square in the Minkowski sum.
+        offsets   : np.array with shape (N_jets + 1,)
+
+        Returns
+        -------
+        np.array with shape (N_jets, 3) or (N_jets, r.shape, 3)
+
+        """
+        square_width = self.r_to_square_width(r)
+        list_width, idx_width = np.unique(square_width.reshape(-1), return_inverse=True)
+        with self._stage("measure"):
+            count_code = jit_utils.count_codes_batch(
+                np.ascontiguousarray(coords, dtype=float), np.asarray(offsets, dtype=np.int64),
+                float(self.offset), float(self.bin_width), float(self.eps), list_width.astype(np.int64),
+            )
+        arr_mfs = (count_code @ self.lookup_mf_local) // 4
+        arr_mfs = arr_mfs * np.array([1., self.bin_width, self.bin_width**2])# count bin width
+        return arr_mfs[:, idx_width.reshape(-1)].reshape((count_code.shape[0],) + square_width.shape + (3,))
+
+    def _use_jit(self):
+        return self.backend == "numba" and self.tile_size is None and self.n_phi_bins is None
+
+    def calc_mfs_from_bin_idx(self, bin_idx, square_width):
+        """
+        Compute MFs of occupied pixels dilated by square filters with given widths.
+
+        Parameters
+        ----------
+        bin_idx      : np.array of int with shape (N_pt, 2)
+            indices of occupied pixels
+        square_width : int or array_like of int
+            the width of the square filter in units of pixels
+
+        Returns
+        -------
+        np.array with shape (3,) or (square_width.shape, 3)
+
+        """
+        if self.n_phi_bins is not None:
+            # dilated pixels across a gap of square_width - 1 columns do not touch
+            with self._stage("pixelization"):
+                bin_idx_unrolled = pixel_utils.unroll_periodic_bin_idx(bin_idx, self.n_phi_bins, np.max(square_width))
+            if bin_idx_unrolled is None:
+                with self._stage("pixelization"):
+                    img = pixel_utils.bin_idx_to_cylinder_img(bin_idx, self.n_phi_bins)
+                return self.calc_mfs_from_distance_transform(img, square_width, periodic=True)
+            bin_idx = bin_idx_unrolled
+        if self.tile_size is not None:
+            return self.calc_mfs_from_tiles(bin_idx, square_width)
+        return self.calc_mfs_from_square_width(self.bin_idx_to_img(bin_idx), square_width)
+
+    def r_to_square_width(self, r):
+        """
+        Convert the dilation scale r into the width of the square filter in units of pixels.
+        r = 0 corresponds to the width 1, i.e., no dilation.
+
+        Parameters
+        ----------
+        r         : float or array_like
+
+        Returns
+        -------
+        int or np.array of int with the same shape of r
+
+        """
+        r = np.asarray(r, dtype=float)
+        square_width = np.ceil((r + self.bin_width*self.eps) / (self.bin_width * 0.5)).astype(int)
+        return np.where(r == 0, 1, np.maximum(square_width, 1))
+
+    def calc_mfs_from_square_width(self, img, square_width):
+        """
+        Compute MFs of the image dilated by a square filter with given width.
+
+        Parameters
+        ----------
+        img          : np.array with shape (H, W)
+            binary image
+        square_width : int or array_like of int
+            the width of the square filter in units of pixels
+
+        Returns
+        -------
+        np.array with shape (3,) or (square_width.shape, 3)
+
+        """
+        if np.ndim(square_width) == 0:
+            if square_width == 1:
                 return self.calc_mfs_from_img(img)
             else:
-                square_width = np.ceil((r + self.bin_width*self.eps) / (self.bin_width * 0.5)).astype(int)
-                if square_width == 0:
-                    return self.calc_mfs_from_img(img)
-                else:
-                    img_dilated = self.dilate_img_by_square(img, square_width)
-                    return self.calc_mfs_from_img(img_dilated)
+                img_dilated = self.dilate_img_by_square(img, square_width)
+                return self.calc_mfs_from_img(img_dilated)
+        elif self.radius_scan == "distance_transform":
+            return self.calc_mfs_from_distance_transform(img, square_width)
         else:
             return np.stack(
                 [
-                    self.calc_mfs(img=img, r=this_r)
-                    for this_r in r
+                    self.calc_mfs_from_square_width(img, this_square_width)
+                    for this_square_width in square_width
                 ],
                 axis=0
             )
 
+    def calc_mfs_from_distance_transform(self, img, square_width, periodic=False):
+        """
+        Compute MFs of the image dilated by square filters with all given widths at once.
+
+        Each pixel is split into 2x2 sub-pixels, so that squares with both odd and even widths
+        are aligned to the sub-pixel grid. A sub-pixel is covered by the image dilated by 
+        a square with width w if its chessboard distance to the image is smaller than w.
+
+        Parameters
+        ----------
+        img          : np.array with shape (H, W) or (N_img, H, W)
+            binary image or stack of binary images
+        square_width : array_like of int
+            the width of the square filter in units of pixels
+        periodic     : bool, default False
+            If true, the second axis of the image is periodic. 
+            Columns are padded by wrap-around, and 2x2 configurations across 
+            the last and the first columns are counted once.
+
+        Returns
+        -------
+        np.array with shape (square_width.shape, 3) or (N_img, square_width.shape, 3)
+
+        """
+        img = np.asarray(img)
+        if img.ndim == 2:
+            return self.calc_mfs_from_distance_transform(img[np.newaxis], square_width, periodic)[0]
+
+        square_width = np.asarray(square_width, dtype=int)
+        if square_width.size == 0:
+            return np.zeros((img.shape[0],) + square_width.shape + (3,))
+        width_max = square_width.max()
+
+        with self._stage("dilation"):
+            img_fine = np.repeat(np.repeat(img != 0, 2, axis=-2), 2, axis=-1)
+            pad = width_max + 1
+            if periodic:
+                n_col = img_fine.shape[-1]
+                img_fine = np.pad(img_fine, ((0, 0), (0, 0), (pad, pad)), mode="wrap")
+                img_fine = np.pad(img_fine, ((0, 0), (pad, pad), (0, 0)))
+            else:
+                img_fine = np.pad(img_fine, ((0, 0), (pad, pad), (pad, pad)))
+            img_switch_on = self._calc_switch_on(img_fine, width_max)
+            if periodic:
+                # the first column is the wrapped last column
+                img_switch_on = img_switch_on[:, :, pad - 1:pad + n_col]
+        self._count("image_pixels", img_switch_on.size)
+
+        with self._stage("measure"):
+            arr_mfs = pixel_utils.scan_local_mfs(img_switch_on, width_max, self.lookup_mf_local)
+        arr_mfs = arr_mfs[:, square_width] // 4
+        half_width = self.bin_width * 0.5
+        arr_mfs = arr_mfs * np.array([1., half_width, half_width**2])# count bin width
+        return arr_mfs
+
+    def calc_mfs_from_tiles(self, bin_idx, square_width):
+        """
+        Compute MFs of occupied pixels dilated by square filters with given widths,
+        using the sparse representation by tiles.
+
+        Each active tile is processed with its halo, which contains all pixels within 
+        the reach of the dilation, and only 2x2 configurations whose lower right pixel
+        lies in the tile are counted. MFs are the sum over tiles.
+
+        Parameters
+        ----------
+        bin_idx      : np.array of int with shape (N_pt, 2)
+            indices of occupied pixels
+        square_width : int or array_like of int
+            the width of the square filter in units of pixels
+
+        Returns
+        -------
+        np.array with shape (3,) or (square_width.shape, 3)
+
+        """
+        square_width = np.asarray(square_width, dtype=int)
+        if square_width.size == 0:
+            return np.zeros(square_width.shape + (3,))
+        width_max = square_width.max()
+        # sub-pixels are covered within the chessboard distance width_max - 1,
+        # and 2x2 configurations extend one more sub-pixel
+        halo = (width_max + 1) // 2
+        tile_size = self.tile_size
+
+        with self._stage("pixelization"):
+            tiles, imgs = pixel_utils.bin_idx_to_tiles(bin_idx, tile_size, halo)
+        with self._stage("dilation"):
+            img_fine = np.repeat(np.repeat(imgs, 2, axis=-2), 2, axis=-1)
+            img_switch_on = self._calc_switch_on(img_fine, width_max)
+            img_switch_on = img_switch_on[:, 2 * halo - 1:2 * (halo + tile_size), 2 * halo - 1:2 * (halo + tile_size)]
+        self._count("image_pixels", img_switch_on.size)
+
+        with self._stage("measure"):
+            arr_mfs = pixel_utils.scan_local_mfs(img_switch_on, width_max, self.lookup_mf_local).sum(axis=0)
+        arr_mfs = arr_mfs[square_width] // 4
+        half_width = self.bin_width * 0.5
+        arr_mfs = arr_mfs * np.array([1., half_width, half_width**2])# count bin width
+        return arr_mfs
+
+    def _calc_switch_on(self, img_fine, width_max):
+        # chessboard distance within each image of the stack
+        metric = np.zeros((3, 3, 3), dtype=bool)
+        metric[1] = True
+        img_switch_on = scipy.ndimage.distance_transform_cdt(~img_fine, metric=metric) + 1
+        img_switch_on[img_switch_on <= 0] = width_max + 1 # empty images
+        return img_switch_on
+
+    def calc_mfs_from_imgs(self, imgs, r=0):
+        """
+        Compute MFs of a stack of binary images on a common pixel grid.
+        The 2x2 configurations of all images are encoded at once by shifted-array arithmetic.
+
+        Parameters
+        ----------
+        imgs : array_like with shape (N_img, H, W)
+            stack of binary images
+        r    : float or array_like
+            Specifies the half-width of a square in the Minkowski sum.
+
+        Returns
+        -------
+        np.array with shape (N_img, 3) or (N_img, r.shape, 3)
+            array of Minkowski functionals of each image given r.
+
+        """
+        imgs = np.asarray(imgs) != 0
+        square_width = self.r_to_square_width(r)
+        if self.n_phi_bins is not None:
+            return self.calc_mfs_from_distance_transform(imgs, square_width, periodic=True)
+        elif np.ndim(square_width) == 0 and square_width == 1:
+            with self._stage("measure"):
+                count_code = self.count_binary_encoding(imgs)
+            self._count("image_pixels", imgs.size)
+            arr_mfs = (count_code @ self.lookup_mf_local) // 4
+            return arr_mfs * np.array([1., self.bin_width, self.bin_width**2])# count bin width
+        elif self.radius_scan == "distance_transform" or np.ndim(square_width) == 0:
+            return self.calc_mfs_from_distance_transform(imgs, square_width)
+        else:
+            return np.stack(
+                [
+                    self.calc_mfs_from_imgs(
+                        self.dilate_imgs_by_square(imgs, this_square_width), 0
+                    )
+                    for this_square_width in square_width.reshape(-1)
+                ],
+                axis=1
+            ).reshape((imgs.shape[0],) + square_width.shape + (3,))
+
+    def count_binary_encoding(self, imgs):
+        """
+        Count 2x2 binary encodings of a stack of binary images, weighted by filter_binary.
+        Images are encoded as uint8, so that the only full-size integer array is
+        the index of the histogram.
+
+        Parameters
+        ----------
+        imgs : np.array with shape (N_img, H, W)
+            stack of binary images
+
+        Returns
+        -------
+        np.array of int with shape (N_img, 16)
+            the number of each 2x2 encoding in each image
+
+        """
+        img_padded = np.pad(imgs != 0, ((0, 0), (1, 1), (1, 1))).view(np.uint8)
+        weight = self.filter_binary.astype(np.uint8)
+        code = (
+            img_padded[:, 1:, 1:] * weight[0, 0]
+            | img_padded[:, 1:, :-1] * weight[0, 1]
+            | img_padded[:, :-1, 1:] * weight[1, 0]
+            | img_padded[:, :-1, :-1] * weight[1, 1]
+        ).reshape(imgs.shape[0], -1)
+        if imgs.shape[0] > 1:
+            code = code + 16 * np.arange(imgs.shape[0])[:, np.newaxis]
+        return np.bincount(code.reshape(-1), minlength=16 * imgs.shape[0]).reshape(-1, 16)
+
+    def dilate_imgs_by_square(self, imgs, square_width):
+        """
+        Dilate a stack of binary images by a square filter with given width.
+
+        Parameters
+        ----------
+        imgs         : np.array with shape (N_img, H, W)
+        square_width : int
+
+        Returns
+        -------
+        np.array of bool with shape (N_img, H + 2 * (square_width - 1), W + 2 * (square_width - 1))
+
+        """
+        pad = square_width - 1
+        with self._stage("dilation"):
+            # the square filter is separable into boolean maximum filters along each axis
+            img_dilated = np.pad(imgs != 0, ((0, 0), (pad, pad), (pad, pad)))
+            for axis in (-2, -1):
+                img_dilated = scipy.ndimage.maximum_filter1d(img_dilated, square_width, axis=axis, mode="constant", cval=0)
+        return img_dilated
+
+    def coord_to_bin_idx(self, coord):
+        with self._stage("pixelization"):
+            return pixel_utils.coords_to_bin_idx(coord, bin_width=self.bin_width, eps=self.eps, mode=self.mode)
+
+    def bin_idx_to_img(self, bin_idx):
+        with self._stage("pixelization"):
+            return pixel_utils.bin_idx_to_img(bin_idx)
+
     def coord_to_img(self, coord):
-        bin_idx = np.floor((coord - self.offset + self.bin_width * self.eps) / self.bin_width).astype(int)
-        bin_idx_min = bin_idx.min(axis=0)
-        img = scipy.sparse.coo_array(
-            (
-                np.ones(coord.shape[0], dtype=int),
-                (bin_idx - bin_idx_min).T
-            )
-        ).astype(bool).astype(int).toarray()
-        return img
+        """
+        Pixelate points into a binary image cropped to their bounding box.
+        The image is boolean (one byte per pixel). Earlier releases returned an integer image,
+        which is obtained by img.astype(int).
+
+        Parameters
+        ----------
+        coord : array_like with shape (N_pt, 2)
+
+        Returns
+        -------
+        np.array of bool with shape (H, W)
+
+        """
+        return self.bin_idx_to_img(self.coord_to_bin_idx(coord))
+
+    def coord_to_level_img(self, coord, weights):
+        """
+        Pixelate weighted points into a grey-level image.
+        The level of a pixel is the maximum weight of points in the pixel, 
+        and empty pixels have the level -inf.
+
+        Parameters
+        ----------
+        coord   : array_like with shape (N_pt, 2)
+        weights : array_like with shape (N_pt,)
+
+        Returns
+        -------
+        np.array with shape (H, W)
+
+        """
+        bin_idx = self.coord_to_bin_idx(coord)
+        bin_idx = bin_idx - bin_idx.min(axis=0)
+        img_level = np.full(bin_idx.max(axis=0) + 1, -np.inf)
+        np.maximum.at(img_level, tuple(bin_idx.T), np.asarray(weights, dtype=float))
+        return img_level
+
+    def calc_mfs_grey(self, coords=None, weights=None, thresholds=None, r=0, img=None):
+        """
+        Compute MFs of excursion sets of weighted points or a grey-level image
+        for all pairs of thresholds and dilation scales.
+        The excursion set at a threshold t consists of pixels with the level >= t.
+        Since dilation by a square commutes with thresholding, the grey-level image is 
+        dilated by a maximum filter once for each r, and MFs for all thresholds are 
+        obtained from a single sorted filtration over the pixel levels.
+
+        Parameters
+        ----------
+        coords     : array_like with shape (N_pt, 2)
+        weights    : array_like with shape (N_pt,)
+            weights of points, e.g., transverse momenta.
+            The level of a pixel is the maximum weight of points in the pixel.
+        thresholds : array_like
+            thresholds of excursion sets
+        r          : float or array_like, default 0
+            Specifies the half-width of a square in the Minkowski sum.
+        img        : array_like with shape (H, W), optional
+            grey-level image used instead of coords and weights
+
+        Returns
+        -------
+        np.array with shape (thresholds.shape, r.shape, 3)
+            array of Minkowski functionals given thresholds and r.
+
+        """
+        if self.n_phi_bins is not None:
+            raise NotImplementedError("periodic phi is not implemented yet for grey-level images")
+        if img is None:
+            img = self.coord_to_level_img(coords, weights)
+        img = np.asarray(img, dtype=float)
+        thresholds = np.asarray(thresholds, dtype=float)
+        square_width = self.r_to_square_width(r)
+
+        # step j of the filtration is the excursion set at the j-th largest threshold
+        thresholds_sorted = np.sort(thresholds.reshape(-1))
+        n_thresholds = thresholds_sorted.shape[0]
+        idx_thresholds = n_thresholds - 1 - np.searchsorted(thresholds_sorted, thresholds, side="left")
+
+        dict_mfs = {}
+        for this_square_width in np.unique(square_width):
+            with self._stage("dilation"):
+                img_level = np.pad(img, this_square_width, constant_values=-np.inf)
+                if this_square_width > 1:
+                    img_level = scipy.ndimage.maximum_filter(img_level, size=this_square_width, mode="constant", cval=-np.inf)
+            self._count("image_pixels", img_level.size)
+            with self._stage("measure"):
+                img_switch_on = n_thresholds - np.searchsorted(thresholds_sorted, img_level, side="right")
+                arr_mfs = pixel_utils.scan_local_mfs(img_switch_on, n_thresholds - 1, self.lookup_mf_local) // 4
+            dict_mfs[this_square_width] = arr_mfs * np.array([1., self.bin_width, self.bin_width**2])# count bin width
+
+        arr_mfs = np.stack([dict_mfs[this_square_width] for this_square_width in square_width.reshape(-1)], axis=1)
+        arr_mfs = arr_mfs.reshape((n_thresholds,) + square_width.shape + (3,))
+        return arr_mfs[idx_thresholds]
 
     def dilate_img_by_square(self, img, square_width):
-        filter_square = np.ones((square_width, square_width), dtype=int)
-        img_dilated = scipy.signal.convolve(img, filter_square).astype(bool).astype(int)
-        return img_dilated
+        """
+        Dilate a binary image by a square filter with given width, see dilate_imgs_by_square.
+        The dilated image is boolean, as is coord_to_img.
+
+        """
+        return self.dilate_imgs_by_square(np.asarray(img)[np.newaxis], square_width)[0]
 
     def calc_mfs_from_img(self, img):
-        subimage_binary_encoding = scipy.signal.convolve(
-            img,
-            self.filter_binary
+        self._count("image_pixels", np.size(img))
+        with self._stage("measure"):
+            count_code = self.count_binary_encoding(np.asarray(img)[np.newaxis])[0]
+            arr_mfs = (count_code @ self.lookup_mf_local) // 4
+        arr_mfs = arr_mfs * np.array([1., self.bin_width, self.bin_width**2])# count bin width
+        return arr_mfs
+
+
+
+class MFPixelCalculatorEuclidean(ProfilingMixin):
+    """
+    Minkowski functional calculator for the persistent analysis with 
+    Steiner-type formula in Euclidean geometry. 
+    This module is for pixelerated binary image analysis.
+
+    Pixels are dilated by a discrete disk, i.e., a pixel is switched on if 
+    the Euclidean distance between its center and the center of an occupied pixel 
+    is not larger than r. The exact Euclidean distance transform of the image is 
+    computed once, so that MFs for all r are obtained by a single scan.
+    The dilated image is measured by the marching square algorithm on the polygon 
+    connecting midpoints between switched-on and switched-off pixel centers.
+
+    Compared to the union of disks centered at the pixel centers, 
+        * the boundary length is overestimated since the boundary consists of segments 
+          along 8 directions. For a straight boundary, the ratio is cos(t) + (sqrt(2) - 1) sin(t)
+          for the angle t in [0, pi/4] from the nearest axis, i.e., at most 8.3% and 5.5% on average
+          over isotropic directions. Arcs of discrete disks add errors of order bin_width / r,
+        * the area error is of order bin_width * (boundary length). A discrete disk gains a ring
+          of pixels whenever r^2 / bin_width^2 crosses a sum of two squares, e.g., 21 pixels
+          at r = 2.25 bin_width for the area of 15.9 pixels, i.e., 29% larger,
+        * the Euler characteristic differs where disks touch or gaps between them close
+          within a pixel.
+    Errors against the alpha complex of pixel centers are bounded on synthetic jets by
+
+        r / bin_width    boundary length    area    Euler characteristic
+        >= 2             20%                30%     8
+        >= 10            12%                1.5%    5
+        >= 20            9%                 0.5%    4
+        >= 50            7%                 0.2%    1
+
+    with a margin over the maximum errors measured on 300 jets,
+    while discrete disks smaller than 2 pixels are not resolved. At r = 0, the Euler characteristic
+    is the number of occupied pixels, and the boundary length and the area vanish.
+
+    Parameters
+    ----------
+    bin_width : float, default 1.
+        pixel width
+    eps : float, default 1e-6
+        epsilon parameter for determining points on the closed boundary of given pixel.
+        For a pixel [x0,x1) x [y0,y1), the tolerance of covering points on the closed boundary will be 
+            (x-x0) >= -(bin_width) * (eps), (y-y0) >= -(bin_width) * (eps).
+        The same tolerance is used for pixels on the boundary of the discrete disk.
+    mode : str, default is "center"
+        If mode is "center", pixel's center will be used as its representative coordinate.
+        If mode is "corner", pixel's left bottom corner will be used as its representative coordinate.
+    diagonal_connected : bool, default False:
+        If true, diagonally connected pixels will be considered as a connected piece.
+    phi_period : float, optional
+        If given, the second coordinate (phi) is periodic with this period, e.g., 2 * np.pi,
+        and MFs are computed on the cylinder. The period should be a multiple of bin_width.
+        Images cover the whole period along the second axis, whose columns wrap around
+        in the distance transform and the marching square.
+
+    """
+
+    def __init__(self, bin_width=1., eps=1e-6, mode="center", diagonal_connected=False, phi_period=None):
+        self.bin_width = bin_width
+        self.mode = mode
+        self.diagonal_connected = diagonal_connected
+        self.phi_period = phi_period
+        self.n_phi_bins = None if phi_period is None else pixel_utils.calc_n_periodic_bins(phi_period, bin_width, eps)
+
+        if mode == "center":
+            self.offset = -bin_width * 0.5
+        elif mode == "corner":
+            self.offset = 0
+        else:
+            raise ValueError(f"unknown mode: {mode}")
+        self.eps = eps
+
+        # lookup table for local MFs of the midpoint polygon in units of bin_width
+        side = np.sqrt(0.5)
+        single = [0.25, side, 1/8]
+        adjacent = [0, 1, 1/2]
+        diagonal = [-0.5, 2 * side, 3/4] if diagonal_connected else [0.5, 2 * side, 1/4]
+        triple = [-0.25, side, 7/8]
+        self.lookup_mf_local = np.array([
+            [0, 0, 0],
+            single,
+            single,
+            adjacent,
+            single,
+            adjacent,
+            diagonal,
+            triple,
+            single,
+            diagonal,
+            adjacent,
+            triple,
+            adjacent,
+            triple,
+            triple,
+            [0, 0, 1],
+        ], dtype=float)
+
+    def calc_mfs(self, coords=None, r=None, img=None):
+        """
+        Compute MFs given points dilated by a disk with radius r.
+        This function automatically takes care of pixelation of coords.
+
+        Parameters
+        ----------
+        coords    : array_like with shape (N_pt, 2)
+        r         : float or array_like
+            The circle radius in the Minkowski sum.
+        img       : array_like with shape (H, W), optional
+            binary image used instead of coords.
+
+        Returns
+        -------
+        np.array with shape (3,) or (r.shape, 3)
+            array of Minkowski functionals given r.
+            The last index k is labeling $k$-th Minkiwski functionals
+               k=0: Euler characteristic
+               k=1: Boundary length
+               k=2: Area
+
+        """
+        if img is None:
+            img = self.coord_to_img(coords)
+        return self.calc_mfs_from_img(img, r)
+
+    def calc_mfs_batch(self, coords, r, offsets=None):
+        """
+        Compute MFs of a batch of jets given points dilated by a disk with radius r.
+        Pixelation of coords is done once for the whole batch.
+
+        Parameters
+        ----------
+        coords    : array_like with shape (N_total, 2) or sequence of array_like
+            Flat array of coordinates of all jets.
+            If offsets is None, a list of coordinate arrays of each jet.
+        r         : float or array_like
+            The circle radius in the Minkowski sum.
+        offsets   : array_like with shape (N_jets + 1,), optional
+            CSR-style offsets, coords[offsets[i]:offsets[i+1]] are the coordinates of i-th jet.
+
+        Returns
+        -------
+        np.array with shape (N_jets, 3) or (N_jets, r.shape, 3)
+            array of Minkowski functionals of each jet given r.
+
+        """
+        coords, offsets = batch_utils.check_ragged(coords, offsets)
+        with self._stage("pixelization"):
+            bin_idx = pixel_utils.coords_to_bin_idx(coords, bin_width=self.bin_width, eps=self.eps, mode=self.mode)
+        r = np.asarray(r, dtype=float)
+        return batch_utils.calc_mfs_batch(
+            lambda jet_bin_idx, r: self.calc_mfs_from_img(self.bin_idx_to_img(jet_bin_idx), r),
+            bin_idx, r, offsets
         )
-        img_mfs_local = self.lookup_mf_local[subimage_binary_encoding]
-        arr_mfs = img_mfs_local.sum(axis=-2).sum(axis=-2) // 4
+
+    def calc_mfs_from_img(self, img, r):
+        """
+        Compute MFs of the image dilated by discrete disks with all given radii at once.
+
+        Parameters
+        ----------
+        img : array_like with shape (H, W)
+            binary image, covering the whole period along the second axis if phi_period is given
+        r   : float or array_like
+            The circle radius in the Minkowski sum.
+
+        Returns
+        -------
+        np.array with shape (3,) or (r.shape, 3)
+
+        """
+        img = np.asarray(img) != 0
+        r = np.asarray(r, dtype=float)
+        # squared radii in units of pixels, distances between pixel centers are integers when squared
+        r2 = (r / self.bin_width)**2 + self.eps
+        r2_sorted = np.unique(r2)
+        pad = int(np.ceil(np.sqrt(r2_sorted[-1]))) + 1
+
+        with self._stage("dilation"):
+            n_col = img.shape[1]
+            if self.n_phi_bins is not None:
+                img = np.pad(np.pad(img, ((0, 0), (pad, pad)), mode="wrap"), ((pad, pad), (0, 0)))
+            else:
+                img = np.pad(img, pad)
+            if np.any(img):
+                dist2 = np.rint(scipy.ndimage.distance_transform_edt(~img)**2)
+            else:
+                dist2 = np.full(img.shape, np.inf)
+            img_switch_on = np.searchsorted(r2_sorted, dist2, side="left")
+            if self.n_phi_bins is not None:
+                # the first column is the wrapped last column
+                img_switch_on = img_switch_on[:, pad - 1:pad + n_col]
+        self._count("image_pixels", img_switch_on.size)
+
+        with self._stage("measure"):
+            arr_mfs = pixel_utils.scan_local_mfs(img_switch_on, r2_sorted.shape[0] - 1, self.lookup_mf_local)
+        arr_mfs[..., 0] = np.rint(arr_mfs[..., 0])
+        arr_mfs = arr_mfs[np.searchsorted(r2_sorted, r2)]
         arr_mfs = arr_mfs * np.array([1., self.bin_width, self.bin_width**2])# count bin width
+        # dilation by r = 0 keeps the occupied pixels as points
+        arr_mfs[r == 0] = [np.count_nonzero(img), 0., 0.]
         return arr_mfs
 
+    def bin_idx_to_img(self, bin_idx):
+        with self._stage("pixelization"):
+            if self.n_phi_bins is not None:
+                return pixel_utils.bin_idx_to_cylinder_img(bin_idx, self.n_phi_bins)
+            return pixel_utils.bin_idx_to_img(bin_idx)
+
+    def coord_to_img(self, coord):
+        with self._stage("pixelization"):
+            bin_idx = pixel_utils.coords_to_bin_idx(np.asarray(coord), bin_width=self.bin_width, eps=self.eps, mode=self.mode)
+        return self.bin_idx_to_img(bin_idx)
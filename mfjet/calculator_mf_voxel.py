@@ -0,0 +1,327 @@
+""" A module containing MF calculators for voxelated 3D images, e.g., layered calorimeter deposits
+
+"""
+
+import numpy as np
+import scipy.ndimage
+
+from . import pixel_utils
+from . import batch_utils
+from .profiling import ProfilingMixin
+
+class MFVoxelCalculator(ProfilingMixin):
+    """
+    Minkowski functional calculator for the persistent analysis with
+    Steiner-type formula in 3D Manhattan geometry.
+    This module is for voxelated binary image analysis, e.g., calorimeter deposits
+    binned in (layer, eta, phi).
+
+    Points are voxelated, and each voxel is dilated by a cuboid with half-widths r * aspect.
+    MFs of the union of voxels are the sum of local MFs of 2x2x2 configurations
+    around each vertex of the voxel grid (marching cubes), where local MFs of all 256
+    configurations are tabulated. MFs are
+        k=0: Euler characteristic
+        k=1: integrated mean curvature, e.g., 3 pi for a unit cube
+        k=2: surface area
+        k=3: volume
+
+    Parameters
+    ----------
+    bin_width : float or array_like with shape (3,), default 1.
+        voxel width along each axis
+    eps : float, default 1e-6
+        epsilon parameter for determining points on the closed boundary of given voxel.
+        For a voxel [x0,x1) x [y0,y1) x [z0,z1), the tolerance of covering points on the closed boundary will be
+            (x-x0) >= -(bin_width) * (eps), and so on.
+    mode : str, default is "center"
+        If mode is "center", voxel's center will be used as its representative coordinate.
+        If mode is "corner", voxel's lower corner will be used as its representative coordinate.
+    diagonal_connected : bool, default False:
+        If true, voxels touching at edges or vertices will be considered as a connected piece,
+        i.e., voxels are closed cubes. Otherwise, only voxels sharing faces are connected,
+        i.e., the interior of the union of voxels is measured.
+        This flag affects the Euler characteristic and the mean curvature.
+    aspect : array_like with shape (3,), default (1., 1., 1.)
+        relative half-widths of the cuboid along each axis.
+        For example, (0, 1, 1) dilates points only within each layer.
+
+    """
+
+    def __init__(self, bin_width=1., eps=1e-6, mode="center", diagonal_connected=False, aspect=(1., 1., 1.)):
+        self.bin_width = np.broadcast_to(np.asarray(bin_width, dtype=float), (3,)).copy()
+        self.mode = mode
+        self.diagonal_connected = diagonal_connected
+        self.aspect = np.broadcast_to(np.asarray(aspect, dtype=float), (3,)).copy()
+
+        if mode not in ("center", "corner"):
+            raise ValueError(f"unknown mode: {mode}")
+        self.eps = eps
+
+        # lookup table for local MFs in units of voxels, see make_lookup_mf_local_3d
+        self.lookup_mf_local = make_lookup_mf_local_3d(diagonal_connected)
+        b0, b1, b2 = self.bin_width
+        self.scale_mf_local = np.array([1., b0, b1, b2, b1 * b2, b0 * b2, b0 * b1, b0 * b1 * b2])
+
+    def calc_mfs(self, coords=None, r=None, img=None):
+        """
+        Compute MFs given points dilated by a cuboid with half-widths r * aspect.
+        This function automatically takes care of voxelation of coords and discretization of dilation scale.
+        The dilation scale along each axis will be discretized as follows:
+            r * aspect -> Ceil[r * aspect / (bin_width*0.5)] * (bin_width*0.5)
+
+        Parameters
+        ----------
+        coords    : array_like with shape (N_pt, 3)
+        r         : float or array_like
+            Specifies the half-width of a cuboid in the Minkowski sum.
+        img       : array_like with shape (D, H, W) or (N_img, D, H, W), optional
+            binary image, or stack of binary images, used instead of coords.
+
+        Returns
+        -------
+        np.array with shape (4,) or (r.shape, 4), or (N_img, 4) or (N_img, r.shape, 4) for a stack of images
+            array of Minkowski functionals given r.
+            The last index k is labeling $k$-th Minkiwski functionals
+               k=0: Euler characteristic
+               k=1: Integrated mean curvature
+               k=2: Surface area
+               k=3: Volume
+
+        """
+        if img is None:
+            img = self.coord_to_img(coords)
+        img = np.asarray(img)
+        if img.ndim == 3:
+            return self.calc_mfs_from_imgs(img[np.newaxis], r)[0]
+        return self.calc_mfs_from_imgs(img, r)
+
+    def calc_mfs_batch(self, coords, r, offsets=None, chunk_size=256):
+        """
+        Compute MFs of a batch of jets given points dilated by a cuboid with half-widths r * aspect.
+        Voxelation of coords is done once for the whole batch, and jets are stacked into
+        images with a common shape, which are dilated and measured at once.
+
+        Parameters
+        ----------
+        coords     : array_like with shape (N_total, 3) or sequence of array_like
+            Flat array of coordinates of all jets.
+            If offsets is None, a list of coordinate arrays of each jet.
+        r          : float or array_like
+            Specifies the half-width of a cuboid in the Minkowski sum.
+        offsets    : array_like with shape (N_jets + 1,), optional
+            CSR-style offsets, coords[offsets[i]:offsets[i+1]] are the coordinates of i-th jet.
+        chunk_size : int, default 256
+            the number of jets stacked at once, which bounds the memory of the stack
+
+        Returns
+        -------
+        np.array with shape (N_jets, 4) or (N_jets, r.shape, 4)
+            array of Minkowski functionals of each jet given r.
+            Empty jets have vanishing Minkowski functionals.
+
+        """
+        coords, offsets = batch_utils.check_ragged(coords, offsets, n_dim=3)
+        bin_idx = self.coord_to_bin_idx(coords)
+        n_jets = offsets.shape[0] - 1
+        arr_mfs = np.zeros((n_jets,) + np.shape(r) + (4,))
+        for start in range(0, n_jets, chunk_size):
+            stop = min(start + chunk_size, n_jets)
+            imgs = self.bin_idx_to_imgs(bin_idx[offsets[start]:offsets[stop]], offsets[start:stop + 1] - offsets[start])
+            arr_mfs[start:stop] = self.calc_mfs_from_imgs(imgs, r)
+        return arr_mfs
+
+    def r_to_cuboid_width(self, r):
+        """
+        Convert the dilation scale r into the widths of the cuboid filter in units of voxels.
+        r = 0 corresponds to the width 1, i.e., no dilation.
+
+        Parameters
+        ----------
+        r         : float or array_like
+
+        Returns
+        -------
+        np.array of int with shape (r.shape, 3)
+
+        """
+        r = np.asarray(r, dtype=float)[..., np.newaxis] * self.aspect
+        cuboid_width = np.ceil((r + self.bin_width*self.eps) / (self.bin_width * 0.5)).astype(int)
+        return np.where(r == 0, 1, np.maximum(cuboid_width, 1))
+
+    def calc_mfs_from_imgs(self, imgs, r):
+        """
+        Compute MFs of a stack of binary images dilated by cuboid filters for all given r.
+        Each distinct cuboid is applied once to the whole stack by separable boolean maximum filters.
+
+        Parameters
+        ----------
+        imgs : array_like with shape (N_img, D, H, W)
+            stack of binary images
+        r    : float or array_like
+            Specifies the half-width of a cuboid in the Minkowski sum.
+
+        Returns
+        -------
+        np.array with shape (N_img, 4) or (N_img, r.shape, 4)
+
+        """
+        imgs = np.asarray(imgs) != 0
+        cuboid_width = self.r_to_cuboid_width(r)
+        list_width, idx_width = np.unique(cuboid_width.reshape(-1, 3), axis=0, return_inverse=True)
+
+        pad = list_width.max(axis=0) - 1
+        with self._stage("dilation"):
+            imgs = np.pad(imgs, [(0, 0)] + [(p, p) for p in pad])
+
+        count_code = np.zeros((imgs.shape[0], list_width.shape[0], 256), dtype=np.int64)
+        for i, width in enumerate(list_width):
+            with self._stage("dilation"):
+                img_dilated = imgs
+                for axis in range(3):
+                    if width[axis] > 1:
+                        img_dilated = scipy.ndimage.maximum_filter1d(img_dilated, width[axis], axis=axis + 1, mode="constant", cval=0)
+            self._count("image_pixels", img_dilated.size)
+            with self._stage("measure"):
+                count_code[:, i] = self.count_binary_encoding(img_dilated)
+
+        arr_mfs = (count_code @ self.lookup_mf_local) * self.scale_mf_local
+        arr_mfs = np.stack([
+            np.rint(arr_mfs[..., 0]),
+            arr_mfs[..., 1:4].sum(axis=-1),
+            arr_mfs[..., 4:7].sum(axis=-1),
+            arr_mfs[..., 7],
+        ], axis=-1)
+        return arr_mfs[:, idx_width.reshape(-1)].reshape((imgs.shape[0],) + cuboid_width.shape[:-1] + (4,))
+
+    def count_binary_encoding(self, imgs):
+        """
+        Count 2x2x2 binary encodings of a stack of binary images.
+
+        Parameters
+        ----------
+        imgs : np.array with shape (N_img, D, H, W)
+            stack of binary images
+
+        Returns
+        -------
+        np.array of int with shape (N_img, 256)
+            the number of each 2x2x2 encoding in each image
+
+        """
+        img_padded = np.pad(imgs != 0, ((0, 0), (1, 1), (1, 1), (1, 1))).view(np.uint8)
+        code = np.zeros((imgs.shape[0],) + tuple(n + 1 for n in imgs.shape[1:]), dtype=np.uint8)
+        for bit, shift in enumerate(np.ndindex(2, 2, 2)):
+            # bit 4a+2b+c encodes the voxel img[i-a, j-b, k-c]
+            view = tuple(slice(None, -1) if s else slice(1, None) for s in shift)
+            code |= img_padded[(slice(None),) + view] << bit
+        code = code.reshape(imgs.shape[0], -1)
+        if imgs.shape[0] > 1:
+            code = code + 256 * np.arange(imgs.shape[0])[:, np.newaxis]
+        return np.bincount(code.reshape(-1), minlength=256 * imgs.shape[0]).reshape(-1, 256)
+
+    def coord_to_bin_idx(self, coord):
+        with self._stage("pixelization"):
+            bin_idx = pixel_utils.coords_to_bin_idx(np.asarray(coord, dtype=float), bin_width=self.bin_width, eps=self.eps, mode=self.mode)
+        return bin_idx
+
+    def bin_idx_to_img(self, bin_idx):
+        with self._stage("pixelization"):
+            bin_idx = bin_idx - bin_idx.min(axis=0)
+            img = np.zeros(bin_idx.max(axis=0) + 1, dtype=bool)
+            img[tuple(bin_idx.T)] = True
+        return img
+
+    def bin_idx_to_imgs(self, bin_idx, offsets):
+        """
+        Voxelate a ragged batch of voxel indices into a stack of binary images with a common shape.
+        Each jet is placed at the lower corner of its image.
+
+        Parameters
+        ----------
+        bin_idx : np.array of int with shape (N_total, 3)
+        offsets : np.array with shape (N_jets + 1,)
+
+        Returns
+        -------
+        np.array of bool with shape (N_jets, D, H, W)
+
+        """
+        with self._stage("pixelization"):
+            n_pt = np.diff(offsets)
+            jet = np.repeat(np.arange(n_pt.shape[0]), n_pt)
+            if jet.shape[0] == 0:
+                return np.zeros((n_pt.shape[0], 1, 1, 1), dtype=bool)
+            bin_idx_min = np.zeros((n_pt.shape[0], 3), dtype=bin_idx.dtype)
+            nonempty = n_pt > 0
+            bin_idx_min[nonempty] = np.minimum.reduceat(bin_idx, offsets[:-1][nonempty], axis=0)
+            bin_idx = bin_idx - bin_idx_min[jet]
+            imgs = np.zeros((n_pt.shape[0],) + tuple(bin_idx.max(axis=0) + 1), dtype=bool)
+            imgs[(jet,) + tuple(bin_idx.T)] = True
+        return imgs
+
+    def coord_to_img(self, coord):
+        return self.bin_idx_to_img(self.coord_to_bin_idx(coord))
+
+
+def make_lookup_mf_local_3d(diagonal_connected=False):
+    """
+    Tabulate local MFs of 2x2x2 voxel configurations around a vertex of the voxel grid.
+
+    Voxels are unit cubes, and each cell of the cubical complex is shared by vertices:
+    an edge by 2, a face by 4, and a voxel by 8.
+        * volume: occupied voxels / 8
+        * surface area: faces between an occupied and an empty voxel / 4
+        * integrated mean curvature: (1/2) sum of edge length x exterior dihedral angle,
+          where an edge has the angle pi/2 for 1 occupied voxel out of 4, -pi/2 for 3,
+          and -pi (closed cubes) or pi (interior) for 2 diagonal voxels
+        * Euler characteristic: V - E/2 + F/4 - C/8 of cells of the closed cubes,
+          or -(V - E/2 + F/4 - C/8) of open cells in the interior of the union,
+          since the alternating sum of open cells of an open 3-manifold is -chi.
+
+    Parameters
+    ----------
+    diagonal_connected : bool, default False
+        If true, voxels are closed cubes. Otherwise, the interior of the union is measured.
+
+    Returns
+    -------
+    np.array with shape (256, 8)
+        Columns are the Euler characteristic, mean curvature of edges along axes 0, 1, 2,
+        surface area of faces normal to axes 0, 1, 2, and volume, in units of voxels.
+        The row is the encoding sum of img[i-a, j-b, k-c] * 2**(4a+2b+c).
+
+    """
+    lookup = np.zeros((256, 8))
+    for code in range(256):
+        occupied = np.array([(code >> bit) & 1 for bit in range(8)], dtype=bool).reshape(2, 2, 2)
+        n_voxel = np.count_nonzero(occupied)
+        # the central vertex is in the closed union if any voxel is occupied
+        n_cells = [
+            float(occupied.any() if diagonal_connected else occupied.all()),
+            0., 0., n_voxel,
+        ]
+        for axis in range(3):
+            # faces normal to the axis separate the two halves along the axis
+            halves = np.moveaxis(occupied, axis, 0)
+            n_boundary_face = np.count_nonzero(halves[0] != halves[1])
+            n_cells[2] += np.count_nonzero(halves[0] | halves[1] if diagonal_connected else halves[0] & halves[1])
+            lookup[code, 4 + axis] = n_boundary_face / 4
+
+            # edges along the axis are surrounded by the four voxels in each half
+            for quarter in halves:
+                n_around = np.count_nonzero(quarter)
+                n_cells[1] += (n_around > 0) if diagonal_connected else (n_around == 4)
+                if n_around == 1:
+                    angle = np.pi / 2
+                elif n_around == 3:
+                    angle = -np.pi / 2
+                elif n_around == 2 and quarter[0, 0] == quarter[1, 1]:
+                    angle = -np.pi if diagonal_connected else np.pi
+                else:
+                    angle = 0.
+                lookup[code, 1 + axis] += angle / 4
+
+        euler = n_cells[0] - n_cells[1] / 2 + n_cells[2] / 4 - n_cells[3] / 8
+        lookup[code, 0] = euler if diagonal_connected else -euler
+        lookup[code, 7] = n_voxel / 8
+    return lookup
@@ -0,0 +1,168 @@
+"""
+Command-line interface for featurizing datasets of jets.
+
+Example
+-------
+Compute MFs of jets in jets.npz for 21 radii in [0, 1] with 8 processes::
+
+    mfjet jets.npz -o mfs.npy --calculator euclidean --quad-segs 8 --r 0:1:21 --workers 8
+
+See dataset_utils for the layout of datasets.
+
+"""
+import argparse
+import contextlib
+import inspect
+import sys
+import time
+
+import numpy as np
+
+from .calculator_mf_euclidean import MFEuclideanCalculator, MFEuclideanCalculatorAlphaComplex
+from .calculator_mf_manhattan import MFManhattanCalculator, MFManhattanCalculatorSweepLine
+from .calculator_mf_pixel import MFPixelCalculator, MFPixelCalculatorMarchingSquare, MFPixelCalculatorEuclidean
+from .calculator_mf_voxel import MFVoxelCalculator
+from . import cache_utils
+from . import dataset_utils
+from .version import __version__
+
+
+CALCULATORS = {
+    "euclidean": MFEuclideanCalculator,
+    "euclidean-alpha": MFEuclideanCalculatorAlphaComplex,
+    "manhattan": MFManhattanCalculator,
+    "manhattan-sweep": MFManhattanCalculatorSweepLine,
+    "pixel": MFPixelCalculator,
+    "pixel-marching-square": MFPixelCalculatorMarchingSquare,
+    "pixel-euclidean": MFPixelCalculatorEuclidean,
+    "voxel": MFVoxelCalculator,
+}
+
+
+def make_calculator(name, **params):
+    """
+    Create an MF calculator by its name.
+    Parameters which are None are ignored, and other parameters should be accepted by the calculator.
+
+    Parameters
+    ----------
+    name   : str
+        one of the keys of CALCULATORS
+    params : dict
+        parameters of the calculator, e.g., quad_segs, bin_width, eps, mode, diagonal_connected, phi_period
+
+    Returns
+    -------
+    MF calculator
+
+    Raises
+    ------
+    ValueError
+        If the name is unknown, or a parameter which is not None is not accepted by the calculator.
+
+    """
+    if name not in CALCULATORS:
+        raise ValueError(f"unknown calculator: {name}")
+    cls = CALCULATORS[name]
+    params = {key: value for key, value in params.items() if value is not None}
+    accepted = inspect.signature(cls).parameters
+    ignored = sorted(key for key in params if key not in accepted)
+    if ignored:
+        raise ValueError(f"calculator {name} does not accept: {', '.join(ignored)}")
+    return cls(**params)
+
+
+def parse_radius(spec):
+    """
+    Parse a radius grid specification.
+
+    Parameters
+    ----------
+    spec : str
+        "start:stop:num" for np.linspace(start, stop, num), or
+        comma-separated radii, e.g., "0,0.1,0.2"
+
+    Returns
+    -------
+    np.array with shape (N_r,)
+
+    """
+    if ":" in spec:
+        start, stop, num = spec.split(":")
+        return np.linspace(float(start), float(stop), int(num))
+    return np.array([float(value) for value in spec.split(",")])
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="mfjet",
+        description="Compute Minkowski functionals of jets in a ragged dataset.",
+    )
+    parser.add_argument("input", help="input .npz with coords and offsets, or .npy of coords")
+    parser.add_argument("-o", "--output", required=True, help="output .npy with shape (N_jets, N_r, N_mfs), N_mfs = 3 in 2D and 4 in 3D")
+    parser.add_argument("--offsets", default=None, help="input .npy of offsets if input is .npy")
+    parser.add_argument("--calculator", default="euclidean", choices=sorted(CALCULATORS))
+    parser.add_argument("--quad-segs", type=int, default=None)
+    parser.add_argument("--bin-width", type=float, default=None)
+    parser.add_argument("--eps", type=float, default=None)
+    parser.add_argument("--mode", default=None, choices=["center", "corner"])
+    parser.add_argument("--diagonal-connected", action="store_true", default=None)
+    parser.add_argument("--phi-period", type=float, default=None, help="period of phi, e.g., 6.283185307179586")
+    parser.add_argument("--r", default="0:1:11", help="radius grid, start:stop:num or comma-separated list")
+    parser.add_argument("--workers", type=int, default=1, help="the number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=1024, help="the number of jets in each chunk")
+    parser.add_argument("--cache", default=None, help="sqlite database caching MFs of each jet and radius")
+    parser.add_argument("--cache-size", type=float, default=1., help="the maximum size of the cache in GiB")
+    parser.add_argument("--no-resume", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--quiet", action="store_true", help="do not report progress")
+    parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        calc = make_calculator(
+            args.calculator,
+            quad_segs=args.quad_segs,
+            bin_width=args.bin_width,
+            eps=args.eps,
+            mode=args.mode,
+            diagonal_connected=args.diagonal_connected,
+            phi_period=args.phi_period,
+        )
+    except ValueError as err:
+        parser.error(str(err))
+    cache = None
+    if args.cache is not None:
+        cache = cache_utils.MFCache(args.cache, max_bytes=int(args.cache_size * 2 ** 30))
+        calc = cache_utils.CachedCalculator(calc, cache)
+    r = parse_radius(args.r)
+
+    time_start = time.perf_counter()
+    n_start = []
+
+    def report(n_done, n_jets):
+        if not n_start:
+            n_start.append(n_done)
+            return
+        elapsed = time.perf_counter() - time_start
+        throughput = (n_done - n_start[0]) / elapsed if elapsed > 0 else 0.
+        print(f"{n_done}/{n_jets} jets, {throughput:.1f} jets/s", file=sys.stderr, flush=True)
+
+    # the cache is closed to checkpoint its write-ahead log
+    with (contextlib.nullcontext() if cache is None else cache):
+        dataset_utils.featurize_dataset(
+            calc, args.input, args.output, r,
+            offsets_path=args.offsets,
+            chunk_size=args.chunk_size,
+            resume=not args.no_resume,
+            callback=None if args.quiet else report,
+            n_workers=args.workers,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
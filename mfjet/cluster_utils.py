@@ -0,0 +1,259 @@
+"""
+Collection of codes for decomposing dilated points into connected clusters.
+
+Dilated points with a shape of radius r are disjoint unless their centers are
+closer than the linking length 2r in the metric of the shape,
+i.e., the Euclidean distance for disks and the Chebyshev distance for squares.
+Since Minkowski functionals are additive over disjoint sets, MFs of the union
+are the sum of MFs of clusters of the friends-of-friends graph,
+and isolated points contribute MFs of a single dilated shape.
+
+If the second coordinate (phi) is periodic, the neighbour search is periodic.
+Clusters linked across the seam phi = 0 ~ period are measured on the cylinder
+by cutting it open along a seam and correcting MFs of the strip, see calc_mfs_periodic.
+
+"""
+import contextlib
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.spatial
+import shapely
+
+from . import minkowski_funcs
+
+
+def calc_cluster_labels(coords, linking_length, p=2, period=None):
+    """
+    Label friends-of-friends clusters of given points.
+
+    Parameters
+    ----------
+    coords         : array_like with shape (N_pt, 2)
+    linking_length : float
+        points closer than or equal to the linking length are linked
+    p              : float, default 2
+        Minkowski p-norm of the distance, 2 for Euclidean and np.inf for Chebyshev
+    period         : float, optional
+        period of the second coordinate, if it is periodic
+
+    Returns
+    -------
+    n_clusters : int
+        the number of clusters
+    labels     : np.array of int with shape (N_pt,)
+        cluster label of each point
+
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if period is not None:
+        coords = wrap_periodic(coords, period)
+    pairs = _query_pairs(coords, linking_length, p, period)
+    return _label_pairs(pairs, coords.shape[0])
+
+
+def is_single_cluster(coords, r, p=2, rtol=1e-9):
+    """
+    Determine radii at which all dilated points are linked into a single cluster,
+    so that splitting into clusters does not shrink the problem.
+    Clusters only merge as r grows, and the smallest such radius is found by bisection.
+
+    Parameters
+    ----------
+    coords : array_like with shape (N_pt, 2)
+    r      : float or array_like
+        radius of the dilation, points are linked within 2r (1 + rtol)
+    p      : float, default 2
+        Minkowski p-norm of the linking distance
+    rtol   : float, default 1e-9
+        relative margin of the linking length, see calc_mfs_clusters
+
+    Returns
+    -------
+    np.array of bool with shape r.shape
+
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    r = np.asarray(r, dtype=float)
+    r_sorted = np.unique(r)
+    if coords.shape[0] == 0 or r_sorted.shape[0] == 0:
+        return np.zeros(r.shape, dtype=bool)
+    lo, hi = 0, r_sorted.shape[0]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        pairs = _query_pairs(coords, 2 * r_sorted[mid] * (1 + rtol), p, None)
+        if _label_pairs(pairs, coords.shape[0])[0] == 1:
+            hi = mid
+        else:
+            lo = mid + 1
+    if lo == r_sorted.shape[0]:
+        return np.zeros(r.shape, dtype=bool)
+    return r >= r_sorted[lo]
+
+
+def calc_mfs_clusters(points, r, dilate, mfs_isolated, p=2, rtol=1e-9, measure=None, stage=None, period=None):
+    """
+    Calculate Minkowski functionals of dilated points cluster by cluster.
+
+    Parameters
+    ----------
+    points       : np.array of shapely.Point with shape (N_pt,)
+    r            : float
+        radius of the dilation, points are linked within 2r (1 + rtol)
+    dilate       : callable
+        function dilate(points, r) returning the union of dilated points
+    mfs_isolated : array_like with shape (3,)
+        Minkowski functionals of a single dilated point
+    p            : float, default 2
+        Minkowski p-norm of the linking distance
+    rtol         : float, default 1e-9
+        relative margin of the linking length.
+        Clusters are allowed to be coarser than connected components,
+        so that touching shapes are never split.
+    measure      : callable, optional
+        function measure(geoms) returning MFs of an array of geometries with shape (N, 3),
+        default is minkowski_funcs.calc_mfs_array
+    stage        : callable, optional
+        function stage(name) returning a context manager timing the clustering stage
+    period       : float, optional
+        period of the second coordinate, if it is periodic
+
+    Returns
+    -------
+    np.array with shape (3,)
+        sum of Minkowski functionals of clusters
+
+    """
+    measure = minkowski_funcs.calc_mfs_array if measure is None else measure
+    linking_length = 2 * r * (1 + rtol)
+    with (contextlib.nullcontext() if stage is None else stage("cluster")):
+        coords = shapely.get_coordinates(points)
+        if period is not None:
+            coords = wrap_periodic(coords, period)
+            if 2 * linking_length >= period:
+                # dilated points may overlap with themselves around the cylinder
+                return calc_mfs_periodic(coords, r, dilate, period, measure)
+            points = shapely.points(coords)
+        pairs = _query_pairs(coords, linking_length, p, period)
+        n_clusters, labels = _label_pairs(pairs, coords.shape[0])
+    size = np.bincount(labels, minlength=n_clusters)
+
+    arr_mfs = np.count_nonzero(size == 1) * np.asarray(mfs_isolated, dtype=float)
+    if period is not None:
+        # clusters linked across the seam are measured on the cylinder
+        crossing = np.abs(coords[pairs[:, 0], 1] - coords[pairs[:, 1], 1]) > 0.5 * period
+        is_periodic = np.zeros(n_clusters, dtype=bool)
+        is_periodic[labels[pairs[crossing, 0]]] = True
+        for label in np.nonzero(is_periodic)[0]:
+            arr_mfs = arr_mfs + calc_mfs_periodic(coords[labels == label], r, dilate, period, measure)
+        size[is_periodic] = 0
+
+    idx_clustered = np.nonzero(size[labels] > 1)[0]
+    if idx_clustered.shape[0] == 0:
+        return arr_mfs
+
+    # points of each cluster are contiguous after sorting by labels
+    idx_clustered = idx_clustered[np.argsort(labels[idx_clustered], kind="stable")]
+    bounds = np.nonzero(np.diff(labels[idx_clustered]))[0] + 1
+    geoms = np.array([dilate(points[idx], r) for idx in np.split(idx_clustered, bounds)], dtype=object)
+    return arr_mfs + measure(geoms).sum(axis=0)
+
+
+def calc_mfs_periodic(coords, r, dilate, period, measure=None):
+    """
+    Calculate Minkowski functionals of dilated points on a cylinder,
+    where the second coordinate (phi) is periodic.
+
+    The cylinder is cut open along a seam, and the union of dilated points
+    including copies shifted by multiples of the period near the seam is clipped 
+    to the strip between the two sides of the seam. Gluing the sides back,
+    the Euler characteristic decreases by the number of intervals on the seam,
+    and the boundary length decreases by twice the length of the seam inside the union.
+    The seam is placed in the largest gap of phi of points and edges of dilated points.
+
+    Parameters
+    ----------
+    coords  : np.array with shape (N_pt, 2)
+    r       : float
+        radius of the dilation
+    dilate  : callable
+        function dilate(points, r) returning the union of dilated points
+    period  : float
+        period of the second coordinate
+    measure : callable, optional
+        function measure(geom) returning MFs, default is minkowski_funcs.calc_mfs_array
+
+    Returns
+    -------
+    np.array with shape (3,)
+
+    """
+    measure = minkowski_funcs.calc_mfs_array if measure is None else measure
+    coords = wrap_periodic(coords, period)
+    phi = coords[:, 1]
+
+    # seam in the middle of the largest gap
+    phi_edges = np.sort(np.mod(np.concatenate([phi, phi - r, phi + r]), period))
+    gaps = np.diff(np.append(phi_edges, phi_edges[0] + period))
+    idx_gap = np.argmax(gaps)
+    phi_seam = phi_edges[idx_gap] + 0.5 * gaps[idx_gap]
+    phi = np.mod(phi - phi_seam, period)
+
+    # copies of points whose dilation reaches the strip [0, period]
+    n_copies = int(np.ceil(r / period))
+    list_coords = []
+    for k in range(-n_copies, n_copies + 1):
+        shifted = phi + k * period
+        near = (shifted > -r) & (shifted < period + r)
+        list_coords.append(np.stack([coords[near, 0], shifted[near]], axis=-1))
+    geom = dilate(shapely.points(np.concatenate(list_coords)), r)
+
+    x_min = coords[:, 0].min() - r - 1
+    x_max = coords[:, 0].max() + r + 1
+    geom_strip = shapely.intersection(geom, shapely.box(x_min, 0, x_max, period))
+    seam = shapely.intersection(geom, shapely.LineString([(x_min, 0), (x_max, 0)]))
+    seam = shapely.get_parts(shapely.get_parts(seam))
+    seam = seam[(shapely.get_type_id(seam) == shapely.GeometryType.LINESTRING) & (shapely.length(seam) > 0)]
+    n_intervals = 0
+    seam_length = 0.
+    if seam.shape[0] > 0:
+        seam = shapely.line_merge(shapely.multilinestrings(seam))
+        n_intervals = shapely.get_num_geometries(seam)
+        seam_length = shapely.length(seam)
+
+    return measure(geom_strip) - np.array([n_intervals, 2 * seam_length, 0.])
+
+
+def wrap_periodic(coords, period):
+    """
+    Wrap the second coordinate into [0, period).
+
+    Parameters
+    ----------
+    coords : array_like with shape (N_pt, 2)
+    period : float
+
+    Returns
+    -------
+    np.array with shape (N_pt, 2)
+
+    """
+    coords = np.array(coords, dtype=float).reshape(-1, 2)
+    phi = np.mod(coords[:, 1], period)
+    coords[:, 1] = np.where(phi >= period, 0., phi)
+    return coords
+
+
+def _query_pairs(coords, linking_length, p, period):
+    boxsize = None if period is None else [0., period]
+    tree = scipy.spatial.cKDTree(coords, boxsize=boxsize)
+    return tree.query_pairs(linking_length, p=p, output_type="ndarray")
+
+
+def _label_pairs(pairs, n_points):
+    graph = scipy.sparse.coo_array(
+        (np.ones(pairs.shape[0], dtype=np.int8), (pairs[:, 0], pairs[:, 1])),
+        shape=(n_points, n_points)
+    )
+    return scipy.sparse.csgraph.connected_components(graph, directed=False)
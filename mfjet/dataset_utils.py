@@ -0,0 +1,253 @@
+"""
+Utilities for featurizing datasets of jets larger than memory.
+
+A dataset is stored in the ragged (CSR-style) layout of batch_utils,
+i.e., a flat coordinate array with shape (N_total, n_dim) and an offset array
+with shape (N_jets + 1,), either
+
+* in a .npz archive with members "coords" and "offsets", or
+* in a .npy file of coordinates with a separate .npy file of offsets.
+
+Arrays in .npy files and uncompressed .npz archives are memory-mapped,
+so that jets are streamed chunk by chunk from the disk.
+MFs are written into a preallocated memory-mapped .npy file, and a JSON
+checkpoint records the number of finished jets, so that an interrupted run
+resumes from the last finished chunk.
+
+"""
+import concurrent.futures
+import contextlib
+import json
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+from . import batch_utils
+from . import cache_utils
+
+
+def save_ragged(path, coords, offsets=None):
+    """
+    Save a ragged batch of jets into an uncompressed .npz archive.
+
+    Parameters
+    ----------
+    path    : str
+        path of the .npz archive
+    coords  : array_like with shape (N_total, n_dim) or sequence of array_like
+        If offsets is None, a list of coordinate arrays of each jet with n_dim = 2.
+    offsets : array_like with shape (N_jets + 1,), optional
+
+    """
+    coords, offsets = batch_utils.check_ragged(coords, offsets)
+    np.savez(path, coords=np.asarray(coords, dtype=float), offsets=offsets)
+
+
+def load_ragged(path, offsets_path=None, coords_key="coords", offsets_key="offsets"):
+    """
+    Open a ragged batch of jets without loading coordinates into memory.
+
+    Parameters
+    ----------
+    path         : str
+        path of a .npz archive or a .npy file of coordinates
+    offsets_path : str, optional
+        path of a .npy file of offsets, required if path is a .npy file
+    coords_key   : str, default "coords"
+        name of coordinates in the .npz archive
+    offsets_key  : str, default "offsets"
+        name of offsets in the .npz archive
+
+    Returns
+    -------
+    coords  : np.memmap or np.array with shape (N_total, n_dim)
+        Compressed .npz members are loaded into memory.
+    offsets : np.memmap or np.array with shape (N_jets + 1,)
+
+    """
+    if path.endswith(".npz"):
+        coords = _load_npz_member(path, coords_key)
+        offsets = _load_npz_member(path, offsets_key)
+    else:
+        if offsets_path is None:
+            raise ValueError("offsets_path is required for coordinates in a .npy file")
+        coords = np.load(path, mmap_mode="r")
+        offsets = np.load(offsets_path, mmap_mode="r")
+    return batch_utils.check_ragged(coords, offsets)
+
+
+def featurize_dataset(
+        calc, input_path, output_path, r,
+        offsets_path=None, chunk_size=1024, checkpoint_path=None, resume=True, callback=None,
+        n_workers=1,
+):
+    """
+    Compute MFs of all jets in a dataset chunk by chunk.
+
+    Peak memory is bounded by the chunk size. After each chunk, the output is flushed
+    and the checkpoint is atomically replaced, so that the run can be resumed.
+
+    Parameters
+    ----------
+    calc            : MF calculator
+        any calculator with calc_mfs_batch(coords, r, offsets)
+    input_path      : str
+        path of the dataset, see load_ragged
+    output_path     : str
+        path of the output .npy file with shape (N_jets, r.shape, n_mfs),
+        where n_mfs = n_dim + 1 is the number of MFs of points with n_dim coordinates
+    r               : float or array_like
+        dilation scale passed to the calculator
+    offsets_path    : str, optional
+        path of offsets for a .npy dataset
+    chunk_size      : int, default 1024
+        the number of jets in each chunk
+    checkpoint_path : str, optional
+        path of the JSON checkpoint, default is output_path + ".ckpt.json"
+    resume          : bool, default True
+        If true and a checkpoint consistent with the inputs, the radii and
+        the type and parameters of the calculator exists, finished chunks are skipped.
+    callback        : callable, optional
+        function callback(n_done, n_jets) called at the start and after each chunk
+    n_workers       : int, default 1
+        the number of worker processes. If larger than 1, chunks are computed 
+        by a process pool and the checkpoint records the finished leading chunks.
+
+    Returns
+    -------
+    np.memmap with shape (N_jets, r.shape, n_mfs)
+        array of Minkowski functionals of each jet
+
+    """
+    coords, offsets = load_ragged(input_path, offsets_path)
+    r = np.asarray(r, dtype=float)
+    n_jets = offsets.shape[0] - 1
+    n_mfs = coords.shape[1] + 1
+    if checkpoint_path is None:
+        checkpoint_path = output_path + ".ckpt.json"
+
+    state = {
+        "input_path": os.path.abspath(input_path),
+        "n_jets": n_jets,
+        "r": r.tolist(),
+        "calculator": cache_utils.calculator_key(calc).hex(),
+        "n_done": 0,
+    }
+    checkpoint = _read_checkpoint(checkpoint_path) if resume else None
+    if (
+        checkpoint is not None
+        and all(checkpoint.get(key) == state[key] for key in ["input_path", "n_jets", "r", "calculator"])
+        and os.path.exists(output_path)
+    ):
+        state["n_done"] = checkpoint["n_done"]
+        arr_mfs = np.lib.format.open_memmap(output_path, mode="r+")
+    else:
+        arr_mfs = np.lib.format.open_memmap(
+            output_path, mode="w+", dtype=float, shape=(n_jets,) + r.shape + (n_mfs,)
+        )
+        _write_checkpoint(checkpoint_path, state)
+
+    if callback is not None:
+        callback(state["n_done"], n_jets)
+    starts = range(state["n_done"], n_jets, chunk_size)
+    finished = {}
+    for start, stop, chunk_mfs in _iter_chunk_mfs(calc, coords, offsets, r, starts, chunk_size, n_workers):
+        arr_mfs[start:stop] = chunk_mfs
+        finished[start] = stop
+        if start != state["n_done"]:
+            continue
+        while state["n_done"] in finished:
+            state["n_done"] = finished.pop(state["n_done"])
+        arr_mfs.flush()
+        _write_checkpoint(checkpoint_path, state)
+        if callback is not None:
+            callback(state["n_done"], n_jets)
+    return arr_mfs
+
+
+def _calc_chunk_mfs(calc, coords, offsets, r):
+    return calc.calc_mfs_batch(coords, r, offsets)
+
+
+def _calc_chunk_mfs_worker(calc, coords, offsets, r):
+    # calculators are unpickled for each chunk, and caches are closed with the chunk
+    cache = calc.cache if isinstance(calc, cache_utils.CachedCalculator) else None
+    with (contextlib.nullcontext() if cache is None else cache):
+        return calc.calc_mfs_batch(coords, r, offsets)
+
+
+def _iter_chunk_mfs(calc, coords, offsets, r, starts, chunk_size, n_workers):
+    # yields (start, stop, mfs) of chunks, in order of completion
+    n_jets = offsets.shape[0] - 1
+
+    def load_chunk(start):
+        stop = min(start + chunk_size, n_jets)
+        chunk_offsets = np.asarray(offsets[start:stop + 1], dtype=np.int64)
+        chunk_coords = np.asarray(coords[chunk_offsets[0]:chunk_offsets[-1]], dtype=float)
+        return stop, chunk_coords, chunk_offsets - chunk_offsets[0]
+
+    if n_workers <= 1:
+        for start in starts:
+            stop, chunk_coords, chunk_offsets = load_chunk(start)
+            yield start, stop, _calc_chunk_mfs(calc, chunk_coords, chunk_offsets, r)
+        return
+
+    # the number of chunks in flight is bounded to keep memory bounded
+    iter_starts = iter(starts)
+    pending = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        while True:
+            for start in iter_starts:
+                stop, chunk_coords, chunk_offsets = load_chunk(start)
+                future = executor.submit(_calc_chunk_mfs_worker, calc, chunk_coords, chunk_offsets, r)
+                pending[future] = (start, stop)
+                if len(pending) >= 2 * n_workers:
+                    break
+            if len(pending) == 0:
+                return
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                start, stop = pending.pop(future)
+                yield start, stop, future.result()
+
+
+def _load_npz_member(path, key):
+    # members stored without compression are memory-mapped at their data offset
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(key + ".npy")
+        if info.compress_type != zipfile.ZIP_STORED:
+            with archive.open(info) as file:
+                return np.lib.format.read_array(file)
+    with open(path, "rb") as file:
+        file.seek(info.header_offset + 26)
+        len_name, len_extra = struct.unpack("<HH", file.read(4))
+        file.seek(info.header_offset + 30 + len_name + len_extra)
+        if np.lib.format.read_magic(file) == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+    if np.prod(shape) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(
+        path, dtype=dtype, mode="r", offset=offset, shape=shape,
+        order="F" if fortran_order else "C"
+    )
+
+
+def _read_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r") as file:
+        return json.load(file)
+
+
+def _write_checkpoint(checkpoint_path, state):
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, checkpoint_path)
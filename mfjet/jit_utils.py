@@ -0,0 +1,119 @@
+"""
+Optional JIT-compiled kernels of the marching square algorithm.
+
+If numba is installed, pixelation, dilation by squares and counting of 2x2 configurations
+of a jet are fused into a single compiled loop, and jets in a batch are processed
+in parallel threads. Without numba, the kernels are plain Python functions,
+and calculators use their NumPy implementations instead.
+
+"""
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAS_NUMBA = numba is not None
+
+if HAS_NUMBA:
+    njit = numba.njit
+    prange = numba.prange
+else:
+    def njit(*args, **kwargs):
+        return lambda func: func
+    prange = range
+
+
+@njit(cache=True)
+def count_codes_jet(coords, offset, bin_width, eps, square_width, counts):
+    """
+    Count 2x2 binary encodings of the pixelated image of a jet dilated by squares.
+
+    Parameters
+    ----------
+    coords       : np.array with shape (N_pt, 2)
+    offset       : float
+        offset of pixel edges, see MFPixelCalculatorMarchingSquare
+    bin_width    : float
+    eps          : float
+    square_width : np.array of int with shape (N_w,)
+        widths of the square filter in units of pixels
+    counts       : np.array of int with shape (N_w, 16)
+        the number of each encoding is added to counts
+
+    """
+    n_pt = coords.shape[0]
+    if n_pt == 0:
+        return
+    bin_idx = np.empty((n_pt, 2), dtype=np.int64)
+    for k in range(n_pt):
+        for axis in range(2):
+            bin_idx[k, axis] = int(np.floor((coords[k, axis] - offset + bin_width * eps) / bin_width))
+    idx_min = bin_idx[0].copy()
+    idx_max = bin_idx[0].copy()
+    for k in range(1, n_pt):
+        for axis in range(2):
+            idx_min[axis] = min(idx_min[axis], bin_idx[k, axis])
+            idx_max[axis] = max(idx_max[axis], bin_idx[k, axis])
+
+    # pixels start from 1 after an empty border, and dilation extends them by width - 1
+    # towards larger indices followed by another empty border
+    width_max = 1
+    for i_width in range(square_width.shape[0]):
+        width_max = max(width_max, square_width[i_width])
+    n_row = idx_max[0] - idx_min[0] + width_max + 2
+    n_col = idx_max[1] - idx_min[1] + width_max + 2
+    img = np.zeros((n_row, n_col), dtype=np.uint8)
+    for k in range(n_pt):
+        img[1 + bin_idx[k, 0] - idx_min[0], 1 + bin_idx[k, 1] - idx_min[1]] = 1
+
+    row_prev = np.zeros(n_col, dtype=np.uint8)
+    row_curr = np.zeros(n_col, dtype=np.uint8)
+    last_i = np.empty(n_col, dtype=np.int64)
+    for i_width in range(square_width.shape[0]):
+        width = square_width[i_width]
+        last_i[:] = -width
+        row_prev[:] = 0
+        for i in range(n_row):
+            # a pixel is on if an occupied pixel is within the last width rows and columns,
+            # last_j is the last occupied column in the row, and last_i[j] is the last row
+            # having an occupied pixel within the last width columns of j
+            last_j = -width
+            for j in range(n_col):
+                if img[i, j]:
+                    last_j = j
+                if j - last_j < width:
+                    last_i[j] = i
+                row_curr[j] = i - last_i[j] < width
+            for j in range(1, n_col):
+                code = row_curr[j] | (row_curr[j - 1] << 1) | (row_prev[j] << 2) | (row_prev[j - 1] << 3)
+                counts[i_width, code] += 1
+            row_prev, row_curr = row_curr, row_prev
+
+
+@njit(cache=True, parallel=True)
+def count_codes_batch(coords, offsets, offset, bin_width, eps, square_width):
+    """
+    Count 2x2 binary encodings of pixelated images of jets in a ragged batch dilated by squares,
+    where jets are processed in parallel.
+
+    Parameters
+    ----------
+    coords       : np.array with shape (N_total, 2)
+    offsets      : np.array of int with shape (N_jets + 1,)
+    offset       : float
+    bin_width    : float
+    eps          : float
+    square_width : np.array of int with shape (N_w,)
+
+    Returns
+    -------
+    np.array of int with shape (N_jets, N_w, 16)
+
+    """
+    n_jets = offsets.shape[0] - 1
+    counts = np.zeros((n_jets, square_width.shape[0], 16), dtype=np.int64)
+    for i_jet in prange(n_jets):
+        count_codes_jet(coords[offsets[i_jet]:offsets[i_jet + 1]], offset, bin_width, eps, square_width, counts[i_jet])
+    return counts
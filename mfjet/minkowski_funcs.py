@@ -112,3 +112,90 @@ def calc_euler_poly(poly):
     num_exteriors = 1
     num_interiors = len(poly.interiors)
     return num_exteriors - num_interiors
+
+
+def calc_mfs_array(geoms):
+    """
+    Calculate Minkowski functionals of an array of geometries in one call.
+
+    Parameters
+    ----------
+    geoms  : shapely.Geometry or array_like of shapely.Polygon or shapely.MultiPolygon
+        input geometry objects
+
+    Returns
+    -------
+    np.array with shape (geoms.shape + (3,))
+        Minkowski functionals MF[..., k] of given geometries
+
+        * k=0: Euler characteristic
+        * k=1: boundary length
+        * k=2: area
+
+    """
+    return np.stack([
+        calc_euler_array(geoms),
+        calc_length_array(geoms),
+        calc_area_array(geoms),
+    ], axis=-1)
+
+
+def calc_area_array(geoms):
+    """
+    Calculate areas of an array of geometries.
+
+    Parameters
+    ----------
+    geoms  : array_like of shapely.Geometry
+
+    Returns
+    -------
+    np.array with shape geoms.shape
+
+    """
+    return shapely.area(geoms)
+
+
+def calc_length_array(geoms):
+    """
+    Calculate boundary lengths of an array of (multi)polygons.
+    The length of a polygon is the total length of its exterior and interior rings.
+
+    Parameters
+    ----------
+    geoms  : array_like of shapely.Polygon or shapely.MultiPolygon
+
+    Returns
+    -------
+    np.array with shape geoms.shape
+
+    """
+    return shapely.length(geoms)
+
+
+def calc_euler_array(geoms):
+    """
+    Calculate Euler characteristics of an array of (multi)polygons.
+    Each non-empty polygon contributes 1 - (the number of interior rings).
+
+    Parameters
+    ----------
+    geoms  : array_like of shapely.Polygon or shapely.MultiPolygon
+
+    Returns
+    -------
+    np.array with shape geoms.shape
+
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    geoms_flat = geoms.reshape(-1)
+    type_id = shapely.get_type_id(geoms_flat)
+    is_polygonal = (type_id == shapely.GeometryType.POLYGON) | (type_id == shapely.GeometryType.MULTIPOLYGON)
+    if not np.all(is_polygonal):
+        unsupported = geoms_flat[~is_polygonal][0]
+        raise TypeError("unsupported type: {}".format(type(unsupported)))
+
+    parts, index = shapely.get_parts(geoms_flat, return_index=True)
+    euler_parts = np.where(shapely.is_empty(parts), 0, 1 - shapely.get_num_interior_rings(parts))
+    euler = np.bincount(index, weights=euler_parts, minlength=geoms_flat.shape[0])
+    return euler.reshape(geoms.shape)
@@ -0,0 +1,249 @@
+"""
+Shared-memory parallel computation of MFs of a ragged batch of jets.
+
+The flat coordinate array, the offsets and the output array are placed in shared memory,
+and worker processes receive only index ranges of jets. Each worker repeatedly takes
+the next chunk of jets from a shared counter (guided self-scheduling), where chunks
+shrink as the remaining work decreases, so that jets with widely varying multiplicity
+are load-balanced without pickling coordinates or MFs.
+
+The whole batch is held in memory. For datasets larger than memory, see
+dataset_utils.featurize_dataset, which streams chunks from the disk.
+
+Radii of a single jet are evaluated concurrently by map_radii on a shared thread pool,
+which runs in parallel where shapely releases the GIL inside GEOS operations.
+
+"""
+import concurrent.futures
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import traceback
+
+import numpy as np
+
+from . import batch_utils
+
+
+def calc_mfs_shared(calc, coords, r, offsets=None, n_workers=None, min_chunk_size=8):
+    """
+    Compute MFs of a ragged batch of jets with a pool of processes sharing memory.
+
+    Parameters
+    ----------
+    calc           : MF calculator
+        any calculator with calc_mfs_batch(coords, r, offsets), used as the kernel of chunks
+    coords         : array_like with shape (N_total, n_dim) or sequence of array_like
+        Flat array of coordinates of all jets.
+        If offsets is None, a list of coordinate arrays of each jet with n_dim = 2.
+    r              : float or array_like
+        dilation scale passed to the calculator
+    offsets        : array_like with shape (N_jets + 1,), optional
+        CSR-style offsets, coords[offsets[i]:offsets[i+1]] are the coordinates of i-th jet.
+    n_workers      : int, optional
+        the number of worker processes, default is os.cpu_count().
+        If 1, MFs are computed in the current process.
+    min_chunk_size : int, default 8
+        the minimum number of jets in each chunk
+
+    Returns
+    -------
+    np.array with shape (N_jets, n_mfs) or (N_jets, r.shape, n_mfs)
+        array of Minkowski functionals of each jet, where n_mfs = n_dim + 1
+
+    """
+    from multiprocessing import shared_memory
+
+    coords, offsets = batch_utils.check_ragged(coords, offsets)
+    coords = np.asarray(coords, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    r = np.asarray(r, dtype=float)
+    n_jets = offsets.shape[0] - 1
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    n_workers = max(1, min(n_workers, n_jets))
+    if n_workers == 1:
+        return calc.calc_mfs_batch(coords, r, offsets)
+
+    output_shape = (n_jets,) + r.shape + (coords.shape[1] + 1,)
+    list_shm = []
+    try:
+        specs = []
+        for shape, dtype, value in [
+            (coords.shape, coords.dtype, coords),
+            (offsets.shape, offsets.dtype, offsets),
+            (output_shape, np.dtype(float), None),
+        ]:
+            shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+            list_shm.append(shm)
+            if value is not None:
+                np.ndarray(shape, dtype=dtype, buffer=shm.buf)[...] = value
+            specs.append((shm.name, shape, dtype.str))
+
+        ctx = multiprocessing.get_context()
+        counter = ctx.Value("q", 0)
+        error_reader, error_writer = ctx.Pipe(duplex=False)
+        error_lock = ctx.Lock()
+        workers = [
+            ctx.Process(
+                target=_run_worker,
+                args=(calc, specs, r, counter, n_workers, min_chunk_size, error_writer, error_lock),
+            )
+            for _ in range(n_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        list_error = _join_workers(workers, error_reader)
+        error_reader.close()
+        error_writer.close()
+        if list_error:
+            raise RuntimeError("worker process failed:\n" + list_error[0])
+        failed = [worker.exitcode for worker in workers if worker.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"worker process exited with code {failed[0]}")
+
+        return np.ndarray(output_shape, dtype=float, buffer=list_shm[2].buf).copy()
+    finally:
+        for shm in list_shm:
+            shm.close()
+            shm.unlink()
+
+
+def next_chunk_stop(offsets, start, n_workers, min_chunk_size=8):
+    """
+    Determine the end of the next chunk of jets by guided self-scheduling.
+    The chunk holds about 1 / (2 n_workers) of the remaining constituents,
+    and at least min_chunk_size jets.
+
+    Parameters
+    ----------
+    offsets        : np.array with shape (N_jets + 1,)
+    start          : int
+        index of the first jet of the chunk
+    n_workers      : int
+    min_chunk_size : int, default 8
+
+    Returns
+    -------
+    int
+        index of the jet after the chunk
+
+    """
+    n_jets = offsets.shape[0] - 1
+    n_remaining = offsets[-1] - offsets[start]
+    target = offsets[start] + n_remaining // (2 * n_workers)
+    stop = int(np.searchsorted(offsets, target, side="right")) - 1
+    return min(max(stop, start + min_chunk_size), n_jets)
+
+
+def _join_workers(workers, error_reader):
+    # tracebacks are read while waiting, since a worker blocks on sending one larger than the pipe buffer
+    list_error = []
+    running = {worker.sentinel: worker for worker in workers}
+    while running:
+        for ready in multiprocessing.connection.wait([error_reader] + list(running)):
+            if ready is error_reader:
+                list_error.append(error_reader.recv())
+            else:
+                running.pop(ready).join()
+    while error_reader.poll():
+        list_error.append(error_reader.recv())
+    return list_error
+
+
+def _run_worker(calc, specs, r, counter, n_workers, min_chunk_size, error_writer, error_lock):
+    from multiprocessing import shared_memory
+
+    list_shm = [shared_memory.SharedMemory(name=name) for name, _, _ in specs]
+    try:
+        _run_chunks(calc, list_shm, specs, r, counter, n_workers, min_chunk_size)
+    except BaseException:
+        # other workers stop before their next chunk
+        with counter.get_lock():
+            counter.value = np.iinfo(np.int64).max
+        with error_lock:
+            error_writer.send(traceback.format_exc())
+    for shm in list_shm:
+        shm.close()
+
+
+def _run_chunks(calc, list_shm, specs, r, counter, n_workers, min_chunk_size):
+    coords, offsets, arr_mfs = [
+        np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        for shm, (_, shape, dtype) in zip(list_shm, specs)
+    ]
+    n_jets = offsets.shape[0] - 1
+    while True:
+        with counter.get_lock():
+            start = counter.value
+            if start >= n_jets:
+                return
+            stop = next_chunk_stop(offsets, start, n_workers, min_chunk_size)
+            counter.value = stop
+        arr_mfs[start:stop] = calc.calc_mfs_batch(
+            coords[offsets[start]:offsets[stop]], r, offsets[start:stop + 1] - offsets[start]
+        )
+
+
+_THREAD_POOLS = {}
+_THREAD_POOLS_LOCK = threading.Lock()
+
+
+def get_thread_pool(n_threads):
+    """
+    Return a thread pool with n_threads workers shared within the process.
+
+    Parameters
+    ----------
+    n_threads : int
+
+    Returns
+    -------
+    concurrent.futures.ThreadPoolExecutor
+
+    """
+    with _THREAD_POOLS_LOCK:
+        pool = _THREAD_POOLS.get(n_threads)
+        if pool is None:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix="mfjet")
+            _THREAD_POOLS[n_threads] = pool
+        return pool
+
+
+def _reset_thread_pools():
+    # threads of the parent do not exist in a forked child
+    global _THREAD_POOLS_LOCK
+    _THREAD_POOLS.clear()
+    _THREAD_POOLS_LOCK = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_thread_pools)
+
+
+def map_radii(func, r, n_threads=1):
+    """
+    Evaluate a function for each radius, concurrently on a thread pool if n_threads > 1.
+    Larger radii are submitted first, since their unions are the most expensive.
+
+    Parameters
+    ----------
+    func      : callable
+        function of a single radius, func(r)
+    r         : array_like
+        radii, flattened
+    n_threads : int, default 1
+        the number of threads
+
+    Returns
+    -------
+    list
+        func(r) for each radius in the order of r
+
+    """
+    r = np.asarray(r, dtype=float).ravel()
+    if n_threads is None or n_threads <= 1 or r.shape[0] <= 1:
+        return [func(this_r) for this_r in r]
+    pool = get_thread_pool(n_threads)
+    futures = {i: pool.submit(func, r[i]) for i in np.argsort(-r, kind="stable")}
+    return [futures[i].result() for i in range(r.shape[0])]
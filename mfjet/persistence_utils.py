@@ -0,0 +1,346 @@
+"""
+Collection of codes for persistent MF curves computed from filtration events.
+
+A filtration event is an interval [birth, death) of the dilation scale r with a weight.
+The Euler characteristic of the dilated points is given by the weighted number
+of events alive at r,
+
+    MF0(r) = sum_{events} weight * 1[birth <= r < death].
+
+* Euclidean geometry: events are persistence pairs of the alpha complex.
+  Connected components (H0) have weight +1 and holes (H1) have weight -1.
+* Manhattan geometry: events are the (upper-right) corners of the union of squares.
+  Convex corners have weight +1 and reflex corners have weight -1.
+  Since the squares are convex and satisfy the Helly property, the corners are
+  determined by Chebyshev distances between constituents only.
+  Corner events treat squares as closed, so that squares touching at a corner are connected.
+  If they are disconnected instead, each pinch point, where only two opposite quadrants
+  are covered, is split into two and adds one to the Euler characteristic,
+  see calc_chebyshev_pinch_count.
+
+"""
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+
+
+def calc_alpha_persistence(points, edges, edge_alpha, triangles, tri_alpha):
+    """
+    Calculate persistence pairs of the alpha complex filtration.
+
+    Parameters
+    ----------
+    points, edges, edge_alpha, triangles, tri_alpha :
+        alpha complex returned by alpha_utils.calc_alpha_complex
+
+    Returns
+    -------
+    dict with
+        birth  : np.array with shape (N_events,)
+        death  : np.array with shape (N_events,)
+            np.inf for the essential component
+        weight : np.array with shape (N_events,)
+            +1 for components and -1 for holes
+        dim    : np.array with shape (N_events,)
+            homology dimension of each event
+
+    """
+    n_vertices = points.shape[0]
+
+    # H0: components die at the edges of the minimum spanning tree
+    if edges.shape[0] > 0:
+        graph = scipy.sparse.coo_array(
+            (edge_alpha, (edges[:, 0], edges[:, 1])),
+            shape=(n_vertices, n_vertices)
+        )
+        mst = scipy.sparse.csgraph.minimum_spanning_tree(graph)
+        death_h0 = np.sort(mst.data)
+    else:
+        death_h0 = np.zeros(0)
+    death_h0 = np.concatenate([death_h0, np.full(n_vertices - death_h0.shape[0], np.inf)])
+    birth_h0 = np.zeros(n_vertices)
+
+    # H1: elder rule on the dual graph of triangles and the outer face,
+    # processing edges in decreasing order
+    n_tri = triangles.shape[0]
+    birth_h1 = []
+    death_h1 = []
+    if n_tri > 0:
+        tri_edges = np.sort(
+            np.stack([triangles[:, [1, 2]], triangles[:, [2, 0]], triangles[:, [0, 1]]], axis=1),
+            axis=-1
+        ).reshape(-1, 2)
+        edge_idx = _lookup_edge_idx(edges, tri_edges, n_vertices)
+        tri_idx = np.repeat(np.arange(n_tri), 3)
+        order = np.argsort(edge_idx, kind="stable")
+        edge_idx, tri_idx = edge_idx[order], tri_idx[order]
+        # faces adjacent to each edge, hull edges are adjacent to the outer face n_tri
+        first = np.searchsorted(edge_idx, np.arange(edges.shape[0]), side="left")
+        count = np.bincount(edge_idx, minlength=edges.shape[0])
+        face_a = tri_idx[first]
+        face_b = np.where(count == 2, tri_idx[np.minimum(first + 1, tri_idx.shape[0] - 1)], n_tri)
+
+        parent = list(range(n_tri + 1))
+        key = list(tri_alpha) + [np.inf]
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for e in np.argsort(-edge_alpha, kind="stable"):
+            a = find(face_a[e])
+            b = find(face_b[e])
+            if a == b:
+                continue
+            if key[a] < key[b]:
+                a, b = b, a
+            birth_h1.append(edge_alpha[e])
+            death_h1.append(key[b])
+            parent[b] = a
+
+    return {
+        "birth": np.concatenate([birth_h0, np.asarray(birth_h1, dtype=float)]),
+        "death": np.concatenate([death_h0, np.asarray(death_h1, dtype=float)]),
+        "weight": np.concatenate([np.ones(n_vertices), -np.ones(len(birth_h1))]),
+        "dim": np.concatenate([np.zeros(n_vertices, dtype=int), np.ones(len(birth_h1), dtype=int)]),
+    }
+
+
+def calc_chebyshev_corner_events(coords):
+    """
+    Calculate corner events of the union of squares centered at given points.
+
+    For each orientation (sx, sy) in {+1, -1}^2, corners of the union of squares
+    with half-width r facing the (sx, sy) direction are
+
+    * convex corners (x_a + sx r, y_a + sy r) for r in [0, s_a),
+      where 2 s_a is the Chebyshev distance from a to the nearest point dominating a
+      in the (sx, sy) direction, and
+    * reflex corners (x_a + sx r, y_b + sy r) for r in [t_ab, u_ab),
+      where b dominates a in the sx direction, a dominates b in the sy direction,
+      2 t_ab is the Chebyshev distance between a and b, and 2 u_ab is the Chebyshev
+      distance from the corner (x_a, y_b) to the nearest point dominating it.
+
+    Parameters
+    ----------
+    coords : array_like with shape (N_pt, 2)
+
+    Returns
+    -------
+    list of dict, one for each orientation (sx, sy), with
+        birth  : np.array with shape (N_events,)
+        death  : np.array with shape (N_events,)
+        weight : np.array with shape (N_events,)
+            +1 for convex corners and -1 for reflex corners
+        corner : np.array with shape (N_events, 2)
+            corner position at r = 0
+        orientation : tuple (sx, sy)
+
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    list_events = []
+    for sx in [1, -1]:
+        for sy in [1, -1]:
+            x = sx * coords[:, 0]
+            y = sy * coords[:, 1]
+            birth, death, weight, idx_x, idx_y = _calc_upper_right_corner_events(x, y)
+            list_events.append({
+                "birth": birth,
+                "death": death,
+                "weight": weight,
+                "corner": np.stack([coords[idx_x, 0], coords[idx_y, 1]], axis=-1),
+                "orientation": (sx, sy),
+            })
+    return list_events
+
+
+def calc_mfs_chebyshev_corner_events(list_events, r):
+    """
+    Calculate Minkowski functionals of the union of squares from its corner events.
+
+    Each corner at (X + sx r, Y + sy r) with weight w contributes
+    w/4 to the Euler characteristic, w (sx X + sy Y + 2r) to the boundary length,
+    and w (sx sy X Y + (sx X + sy Y) r + r^2) to the area.
+
+    Parameters
+    ----------
+    list_events : list of dict
+        corner events returned by calc_chebyshev_corner_events
+    r           : float or array_like
+        Specifies the half-width of a square in the Minkowski sum.
+
+    Returns
+    -------
+    np.array with shape (3,) or (r.shape, 3)
+        array of Minkowski functionals given r.
+
+    """
+    r = np.asarray(r, dtype=float)
+    birth = np.concatenate([events["birth"] for events in list_events])
+    death = np.concatenate([events["death"] for events in list_events])
+    weight = np.concatenate([events["weight"] for events in list_events])
+    corner = np.concatenate([events["corner"] for events in list_events])
+    sign = np.concatenate([
+        np.broadcast_to(events["orientation"], events["corner"].shape)
+        for events in list_events
+    ])
+
+    corner = corner - corner.mean(axis=0) if corner.shape[0] > 0 else corner
+    coef_1 = np.sum(sign * corner, axis=-1)
+    coef_2 = sign[:, 0] * sign[:, 1] * corner[:, 0] * corner[:, 1]
+
+    # polynomial coefficients of (MF0, MF1, MF2) in powers (r^0, r^1, r^2)
+    coef = np.zeros(weight.shape + (3, 3))
+    coef[:, 0, 0] = 0.25
+    coef[:, 1, 0] = coef_1
+    coef[:, 1, 1] = 2
+    coef[:, 2, 0] = coef_2
+    coef[:, 2, 1] = coef_1
+    coef[:, 2, 2] = 1
+    coef = coef * weight[:, np.newaxis, np.newaxis]
+
+    coef_active = eval_events(birth, death, coef, r)
+    arr_r = r[..., np.newaxis]
+    return coef_active[..., 0] + coef_active[..., 1] * arr_r + coef_active[..., 2] * arr_r**2
+
+
+def calc_chebyshev_pinch_count(coords, r):
+    """
+    Count pinch points of the union of squares centered at given points.
+    A pinch point is a point where two squares touch at their corners
+    and only the two opposite quadrants around it are covered by the union.
+    Pinch points appear only at scales r equal to half of the Chebyshev distance
+    of a pair of points on a diagonal.
+
+    Parameters
+    ----------
+    coords : array_like with shape (N_pt, 2)
+    r      : float or array_like
+        Specifies the half-width of a square in the Minkowski sum.
+
+    Returns
+    -------
+    np.array of int with shape r.shape
+        the number of pinch points
+
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    r = np.asarray(r, dtype=float)
+    count = np.zeros(r.shape, dtype=int)
+
+    idx_a, idx_b = np.triu_indices(coords.shape[0], k=1)
+    diff = np.abs(coords[idx_b] - coords[idx_a])
+    diagonal = (diff[:, 0] == diff[:, 1]) & (diff[:, 0] > 0)
+    idx_a, idx_b = idx_a[diagonal], idx_b[diagonal]
+    scale = 0.5 * diff[diagonal, 0]
+
+    for this_r in np.intersect1d(r, scale):
+        touch = scale == this_r
+        pinch = np.unique(0.5 * (coords[idx_a[touch]] + coords[idx_b[touch]]), axis=0)
+        # quadrant (sx, sy) around a pinch point is covered if the square contains
+        # the points pinch + (sx, sy) * delta for small delta > 0
+        covered = []
+        for sx in [1, -1]:
+            for sy in [1, -1]:
+                covered_axis = []
+                for axis, sign in enumerate([sx, sy]):
+                    offset = pinch[:, np.newaxis, axis] - coords[:, axis]
+                    if sign > 0:
+                        covered_axis.append((offset >= -this_r) & (offset < this_r))
+                    else:
+                        covered_axis.append((offset > -this_r) & (offset <= this_r))
+                covered.append(np.any(covered_axis[0] & covered_axis[1], axis=-1))
+        # quadrants are ordered as (+, +), (+, -), (-, +), (-, -)
+        covered = np.stack(covered, axis=-1)
+        n_pinch = np.count_nonzero(
+            (covered == [True, False, False, True]).all(axis=-1)
+            | (covered == [False, True, True, False]).all(axis=-1)
+        )
+        count[r == this_r] = n_pinch
+    return count
+
+
+def eval_events(birth, death, value, r):
+    """
+    Sum values of events alive at given scales.
+
+    Parameters
+    ----------
+    birth : np.array with shape (N_events,)
+    death : np.array with shape (N_events,)
+    value : np.array with shape (N_events, ...)
+    r     : float or array_like
+
+    Returns
+    -------
+    np.array with shape (r.shape, ...)
+        sum of values of events with birth <= r < death.
+
+    """
+    r = np.asarray(r, dtype=float)
+    value = np.asarray(value, dtype=float)
+    zero = np.zeros((1,) + value.shape[1:])
+
+    order_birth = np.argsort(birth, kind="stable")
+    cumsum_birth = np.concatenate([zero, np.cumsum(value[order_birth], axis=0)])
+    order_death = np.argsort(death, kind="stable")
+    cumsum_death = np.concatenate([zero, np.cumsum(value[order_death], axis=0)])
+
+    n_born = np.searchsorted(birth[order_birth], r, side="right")
+    n_dead = np.searchsorted(death[order_death], r, side="right")
+    return cumsum_birth[n_born] - cumsum_death[n_dead]
+
+
+def _calc_upper_right_corner_events(x, y):
+    n_points = x.shape[0]
+    # ranks with ties broken by index, so that dominance is a strict order
+    rank_x = np.empty(n_points, dtype=int)
+    rank_x[np.argsort(x, kind="stable")] = np.arange(n_points)
+    rank_y = np.empty(n_points, dtype=int)
+    rank_y[np.argsort(y, kind="stable")] = np.arange(n_points)
+
+    # convex corners: a is alive until a point dominating a covers its corner
+    dominate = (rank_x[:, np.newaxis] > rank_x) & (rank_y[:, np.newaxis] > rank_y)
+    dist = np.maximum(x[:, np.newaxis] - x, y[:, np.newaxis] - y)
+    death_convex = 0.5 * np.min(np.where(dominate, dist, np.inf), axis=0, initial=np.inf)
+    birth_convex = np.zeros(n_points)
+    idx_convex = np.arange(n_points)
+
+    # reflex corners at (x_a, y_b) for pairs of b in lower right of a
+    list_birth, list_death, list_a, list_b = [], [], [], []
+    for a in range(n_points):
+        idx_b = np.nonzero((rank_x > rank_x[a]) & (rank_y < rank_y[a]))[0]
+        if idx_b.shape[0] == 0:
+            continue
+        birth = 0.5 * np.maximum(x[idx_b] - x[a], y[a] - y[idx_b])
+        mask_p = rank_x > rank_x[a]
+        cover = mask_p & (rank_y > rank_y[idx_b, np.newaxis])
+        dist = np.maximum(x - x[a], y - y[idx_b, np.newaxis])
+        death = 0.5 * np.min(np.where(cover, dist, np.inf), axis=-1, initial=np.inf)
+        alive = birth < death
+        list_birth.append(birth[alive])
+        list_death.append(death[alive])
+        list_a.append(np.full(np.count_nonzero(alive), a))
+        list_b.append(idx_b[alive])
+
+    birth_reflex = np.concatenate([np.zeros(0)] + list_birth)
+    death_reflex = np.concatenate([np.zeros(0)] + list_death)
+    idx_a = np.concatenate([np.zeros(0, dtype=int)] + list_a)
+    idx_b = np.concatenate([np.zeros(0, dtype=int)] + list_b)
+
+    return (
+        np.concatenate([birth_convex, birth_reflex]),
+        np.concatenate([death_convex, death_reflex]),
+        np.concatenate([np.ones(n_points), -np.ones(birth_reflex.shape[0])]),
+        np.concatenate([idx_convex, idx_a]),
+        np.concatenate([idx_convex, idx_b]),
+    )
+
+
+def _lookup_edge_idx(edges, query, n_vertices):
+    edge_key = edges[:, 0] * n_vertices + edges[:, 1]
+    query_key = query[:, 0] * n_vertices + query[:, 1]
+    order = np.argsort(edge_key)
+    return order[np.searchsorted(edge_key[order], query_key)]
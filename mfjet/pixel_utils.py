@@ -1,6 +1,6 @@
 import numpy as np
 
-def coords_to_binned_coords(coords, bin_width=1., eps=1e-6, mode="center"):
+def coords_to_bin_idx(coords, bin_width=1., eps=1e-6, mode="center"):
     if mode == "center":
         offset = -bin_width * 0.5
     elif mode == "corner":
@@ -8,7 +8,225 @@ def coords_to_binned_coords(coords, bin_width=1., eps=1e-6, mode="center"):
     else:
         raise ValueError(f"unknown mode: {mode}")
     bin_idx = np.floor((coords - offset + bin_width * eps) / bin_width).astype(int)
+    return bin_idx
+
+def coords_to_binned_coords(coords, bin_width=1., eps=1e-6, mode="center"):
+    bin_idx = coords_to_bin_idx(coords, bin_width=bin_width, eps=eps, mode=mode)
     bin_idx = np.unique(bin_idx, axis=0)
     binned_coords = bin_idx * bin_width
     return binned_coords
 
+def scan_local_mfs(img_switch_on, n_step, lookup_mf_local):
+    """
+    Sum local MFs of 2x2 configurations for a nested sequence of binary images.
+
+    The binary image at step s is (img_switch_on <= s), i.e., each pixel is switched on
+    at the step img_switch_on and stays on. The lookup table is expanded into
+    contributions of subsets of the four pixels of 2x2 configurations (Moebius transform),
+    and a subset is switched on at the maximum step of its pixels.
+    The sums over configurations for all steps are obtained by histogramming 
+    these steps and taking a cumulative sum.
+
+    Parameters
+    ----------
+    img_switch_on   : np.array of int with shape (..., H, W)
+        step at which each pixel is switched on.
+        Pixels on the boundary of the image should not be switched on until n_step.
+        Leading dimensions are treated as a batch of images.
+    n_step          : int
+        the number of steps
+    lookup_mf_local : np.array with shape (16, K)
+        lookup table of local MFs for the 2x2 binary encoding
+        img[i,j] * 1 + img[i,j-1] * 2 + img[i-1,j] * 4 + img[i-1,j-1] * 8
+
+    Returns
+    -------
+    np.array with shape (..., n_step + 1, K)
+        sum of local MFs of the binary image at steps 0, 1, ..., n_step
+
+    """
+    batch_shape = img_switch_on.shape[:-2]
+    img_switch_on = img_switch_on.reshape((-1,) + img_switch_on.shape[-2:])
+    n_batch = img_switch_on.shape[0]
+    n_bin = n_step + 2
+
+    # steps of each image are histogrammed into separate bins
+    img_step = np.minimum(img_switch_on, n_step + 1)
+    img_step = img_step + (n_bin * np.arange(n_batch)).reshape(-1, 1, 1)
+    views = [
+        img_step[:, 1:, 1:],
+        img_step[:, 1:, :-1],
+        img_step[:, :-1, 1:],
+        img_step[:, :-1, :-1],
+    ]
+
+    mf_subset = calc_moebius_transform(lookup_mf_local)
+    step_subset = {}
+    arr_mfs = np.zeros((n_batch * n_bin, lookup_mf_local.shape[-1]), dtype=lookup_mf_local.dtype)
+    for code in range(1, 16):
+        lowest_bit = code & -code
+        if code == lowest_bit:
+            step_subset[code] = views[lowest_bit.bit_length() - 1]
+        else:
+            step_subset[code] = np.maximum(step_subset[code ^ lowest_bit], views[lowest_bit.bit_length() - 1])
+        if np.any(mf_subset[code] != 0):
+            count = np.bincount(step_subset[code].reshape(-1), minlength=n_batch * n_bin)
+            arr_mfs += count[:, np.newaxis] * mf_subset[code]
+
+    arr_mfs = np.cumsum(arr_mfs.reshape(n_batch, n_bin, -1), axis=1)[:, :n_step + 1]
+    return arr_mfs.reshape(batch_shape + arr_mfs.shape[1:])
+
+def calc_moebius_transform(lookup_mf_local):
+    """
+    Expand a lookup table of 2x2 configurations into contributions of pixel subsets.
+
+    Parameters
+    ----------
+    lookup_mf_local : np.array with shape (16, K)
+
+    Returns
+    -------
+    np.array with shape (16, K)
+        contributions f[S] of pixel subsets S such that 
+        lookup_mf_local[code] = sum_{S subset of code} f[S]
+
+    """
+    mf_subset = np.array(lookup_mf_local, copy=True)
+    for bit in range(4):
+        for code in range(16):
+            if code >> bit & 1:
+                mf_subset[code] -= mf_subset[code ^ (1 << bit)]
+    return mf_subset
+
+def bin_idx_to_tiles(bin_idx, tile_size, halo):
+    """
+    Scatter occupied pixels into local images of tiles around them.
+
+    The pixel plane is divided into square tiles. A tile is active if it lies within
+    the Chebyshev distance halo (in units of pixels) from an occupied pixel.
+    The local image of an active tile covers the tile and its halo.
+
+    Parameters
+    ----------
+    bin_idx   : np.array of int with shape (N_pt, 2)
+        indices of occupied pixels
+    tile_size : int
+        width of a tile in units of pixels
+    halo      : int
+        width of the halo around each tile in units of pixels
+
+    Returns
+    -------
+    tiles     : np.array of int with shape (N_tile, 2)
+        indices of active tiles, the tile t covers pixels [t * tile_size, (t + 1) * tile_size)
+    imgs      : np.array of bool with shape (N_tile, tile_size + 2 * halo, tile_size + 2 * halo)
+        local images, imgs[n, i, j] is the pixel tiles[n] * tile_size - halo + (i, j)
+
+    """
+    bin_idx = np.unique(np.asarray(bin_idx, dtype=int).reshape(-1, 2), axis=0)
+    reach = -(-halo // tile_size)
+    offsets = np.stack(
+        np.meshgrid(np.arange(-reach, reach + 1), np.arange(-reach, reach + 1), indexing="ij"),
+        axis=-1
+    ).reshape(-1, 2)
+
+    # candidate tiles of each pixel, i.e., tiles whose local images may contain the pixel
+    candidate = (bin_idx // tile_size)[:, np.newaxis, :] + offsets
+    local_idx = bin_idx[:, np.newaxis, :] - candidate * tile_size + halo
+    inside = np.all((local_idx >= 0) & (local_idx < tile_size + 2 * halo), axis=-1)
+
+    tiles, tile_inverse = np.unique(candidate.reshape(-1, 2), axis=0, return_inverse=True)
+    tile_inverse = tile_inverse.reshape(inside.shape)
+    imgs = np.zeros((tiles.shape[0], tile_size + 2 * halo, tile_size + 2 * halo), dtype=bool)
+    imgs[tile_inverse[inside], local_idx[inside][:, 0], local_idx[inside][:, 1]] = True
+    return tiles, imgs
+
+def calc_n_periodic_bins(period, bin_width=1., eps=1e-6):
+    """
+    Calculate the number of bins covering a periodic axis.
+
+    Parameters
+    ----------
+    period    : float
+    bin_width : float, default 1.
+    eps       : float, default 1e-6
+        relative tolerance for the period being a multiple of the bin width
+
+    Returns
+    -------
+    int
+
+    """
+    n_bins = int(np.rint(period / bin_width))
+    if n_bins < 1 or abs(period / bin_width - n_bins) > eps * n_bins:
+        raise ValueError(
+            "period should be a multiple of bin_width: period={}, bin_width={}".format(period, bin_width)
+        )
+    return n_bins
+
+def unroll_periodic_bin_idx(bin_idx, n_bins, min_gap):
+    """
+    Shift periodic column indices so that occupied columns do not wrap around,
+    by cutting the cylinder in the largest gap between occupied columns.
+
+    Parameters
+    ----------
+    bin_idx : np.array of int with shape (N_pt, 2)
+        pixel indices, the second index is periodic
+    n_bins  : int
+        the number of bins along the periodic axis
+    min_gap : int
+        the minimum number of empty columns required at the cut
+
+    Returns
+    -------
+    np.array of int with shape (N_pt, 2), or None if there is no such gap
+
+    """
+    col = np.mod(bin_idx[:, 1], n_bins)
+    col_occupied = np.unique(col)
+    gaps = np.diff(np.append(col_occupied, col_occupied[0] + n_bins)) - 1
+    idx_gap = np.argmax(gaps)
+    if gaps[idx_gap] < min_gap:
+        return None
+    col_start = col_occupied[(idx_gap + 1) % col_occupied.shape[0]]
+    return np.stack([bin_idx[:, 0], np.mod(col - col_start, n_bins)], axis=-1)
+
+def bin_idx_to_img(bin_idx):
+    """
+    Pixelate pixel indices into a binary image cropped to their bounding box.
+
+    Parameters
+    ----------
+    bin_idx : np.array of int with shape (N_pt, 2)
+
+    Returns
+    -------
+    np.array of bool with shape (H, W)
+
+    """
+    bin_idx = bin_idx - bin_idx.min(axis=0)
+    img = np.zeros(bin_idx.max(axis=0) + 1, dtype=bool)
+    img[tuple(bin_idx.T)] = True
+    return img
+
+def bin_idx_to_cylinder_img(bin_idx, n_bins):
+    """
+    Pixelate pixel indices into a binary image on a cylinder,
+    whose second axis covers the whole period.
+
+    Parameters
+    ----------
+    bin_idx : np.array of int with shape (N_pt, 2)
+    n_bins  : int
+        the number of bins along the periodic axis
+
+    Returns
+    -------
+    np.array of bool with shape (H, n_bins)
+
+    """
+    row = bin_idx[:, 0] - bin_idx[:, 0].min()
+    img = np.zeros((row.max() + 1, n_bins), dtype=bool)
+    img[row, np.mod(bin_idx[:, 1], n_bins)] = True
+    return img
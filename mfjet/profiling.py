@@ -0,0 +1,157 @@
+"""
+Opt-in profiling of MF calculators.
+
+Calculators accumulate wall time and the number of calls of each stage,
+e.g., pixelization, dilation, union and measurement, together with counters
+of geometry sizes, e.g., vertices of unioned polygons and pixels of dilated images.
+Profiling is disabled by default, where each stage costs only a method call::
+
+    calc = MFEuclideanCalculator()
+    with calc.profile() as profiler:
+        calc.calc_mfs(coords, r)
+    profiler.as_dict()
+
+"""
+import contextlib
+import threading
+import time
+
+
+class StageProfiler:
+    """
+    Accumulator of wall time and calls of stages and counters.
+    Statistics may be accumulated from several threads.
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """
+        Clear all accumulated statistics.
+
+        """
+        self.stage_time = {}
+        self.stage_calls = {}
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Context manager accumulating the wall time of a stage.
+
+        Parameters
+        ----------
+        name : str
+            name of the stage
+
+        """
+        time_start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_time(name, time.perf_counter() - time_start)
+
+    def add_time(self, name, elapsed, calls=1):
+        with self._lock:
+            self.stage_time[name] = self.stage_time.get(name, 0.) + elapsed
+            self.stage_calls[name] = self.stage_calls.get(name, 0) + calls
+
+    def add_count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def as_dict(self):
+        """
+        Return accumulated statistics.
+
+        Returns
+        -------
+        dict with
+            stages   : dict of stage name to {"time": seconds, "calls": int}
+            counters : dict of counter name to int
+
+        """
+        return {
+            "stages": {
+                name: {"time": self.stage_time[name], "calls": self.stage_calls[name]}
+                for name in self.stage_time
+            },
+            "counters": dict(self.counters),
+        }
+
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class ProfilingMixin:
+    """
+    Mixin adding the opt-in profiling surface to calculators.
+    Calculators held as attributes share the profiler of their owner.
+
+    """
+    profiler = None
+
+    @contextlib.contextmanager
+    def profile(self, profiler=None):
+        """
+        Context manager enabling profiling within its scope.
+
+        Parameters
+        ----------
+        profiler : StageProfiler, optional
+            profiler accumulating statistics, a new one is created if not given
+
+        Yields
+        ------
+        StageProfiler
+
+        """
+        previous = self.profiler
+        profiler = StageProfiler() if profiler is None else profiler
+        self._set_profiler(profiler)
+        try:
+            yield profiler
+        finally:
+            self._set_profiler(previous)
+
+    def enable_profiling(self, profiler=None):
+        """
+        Enable profiling until disable_profiling is called.
+
+        Returns
+        -------
+        StageProfiler
+
+        """
+        profiler = StageProfiler() if profiler is None else profiler
+        self._set_profiler(profiler)
+        return profiler
+
+    def disable_profiling(self):
+        self._set_profiler(None)
+
+    def _set_profiler(self, profiler):
+        self.profiler = profiler
+        for value in vars(self).values():
+            if isinstance(value, ProfilingMixin):
+                value._set_profiler(profiler)
+
+    def _stage(self, name):
+        if self.profiler is None:
+            return _NULL_STAGE
+        return self.profiler.stage(name)
+
+    def _count(self, name, value=1):
+        if self.profiler is not None:
+            self.profiler.add_count(name, value)
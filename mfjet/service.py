@@ -0,0 +1,343 @@
+"""
+Asyncio front-end computing MFs of single jets with micro-batching.
+
+Concurrent requests are coalesced into micro-batches, which are computed by
+calc_mfs_batch in a thread or process pool, so that the event loop is never blocked::
+
+    async with MFBatchService(MFPixelCalculatorMarchingSquare(bin_width=0.05)) as service:
+        arr_mfs = await service.submit(coords, r)
+        service.metrics()
+
+A batch is dispatched when it reaches max_batch_size requests, or when max_wait seconds
+have passed since its first request. Requests with different r are batched separately.
+Coordinates are validated on submission, so that a malformed request fails alone.
+If computing a batch raises, the exception is set on all requests of the batch.
+A synthetic load generator is available as::
+
+    python -m mfjet.service --rate 2000 --n-requests 5000
+
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import sys
+import time
+
+import numpy as np
+
+from . import cli
+from . import synthetic_jets
+
+
+class MFBatchService:
+    """
+    Micro-batching service of an MF calculator.
+
+    Parameters
+    ----------
+    calc           : MF calculator
+        any calculator with calc_mfs_batch(coords, r, offsets)
+    max_batch_size : int, default 64
+        the maximum number of requests in a batch
+    max_wait       : float, default 0.002
+        the maximum time in seconds a request waits for other requests of its batch
+    executor       : str, default "thread"
+        "thread" or "process" pool computing batches.
+        Process workers receive the calculator once at their start.
+    n_workers      : int, default 1
+        the number of workers, which is also the number of batches in flight
+    max_latencies  : int, default 100000
+        the number of recent latencies kept for metrics
+    n_dim          : int, default 2
+        the number of coordinates of each point
+
+    """
+    def __init__(self, calc, max_batch_size=64, max_wait=0.002, executor="thread", n_workers=1, max_latencies=100000, n_dim=2):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"unknown executor: {executor}")
+        self.calc = calc
+        self.n_dim = n_dim
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = executor
+        self.n_workers = n_workers
+
+        self.latencies = collections.deque(maxlen=max_latencies)
+        self.n_requests = 0
+        self.n_completed = 0
+        self.n_failed = 0
+        self.n_batched = 0
+        self.n_batches = 0
+        self.max_queue_depth = 0
+        self._queue = None
+        self._pool = None
+        self._collector = None
+        self._slots = None
+        self._tasks = set()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def start(self):
+        """
+        Start the pool and the collector of requests.
+
+        """
+        if self._collector is not None:
+            return
+        if self.executor == "thread":
+            self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.n_workers)
+        else:
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.n_workers, initializer=_init_worker, initargs=(self.calc,)
+            )
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.n_workers)
+        self._collector = asyncio.get_running_loop().create_task(self._collect())
+
+    async def close(self):
+        """
+        Finish pending requests and shut down the pool.
+
+        """
+        if self._collector is None:
+            return
+        await self._queue.join()
+        self._collector.cancel()
+        try:
+            await self._collector
+        except asyncio.CancelledError:
+            pass
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._collector = None
+        self._pool.shutdown(wait=True)
+        self._pool = None
+
+    async def submit(self, coords, r):
+        """
+        Compute MFs of a single jet.
+
+        Parameters
+        ----------
+        coords : array_like with shape (N_pt, n_dim)
+            a flat array is reshaped into (-1, n_dim), e.g., [] for an empty jet
+        r      : float or array_like
+            dilation scale passed to the calculator
+
+        Returns
+        -------
+        np.array with shape (n_mfs,) or (r.shape, n_mfs)
+
+        Raises
+        ------
+        ValueError
+            if coords cannot be shaped into (N_pt, n_dim)
+
+        """
+        if self._collector is None:
+            raise RuntimeError("the service is not started")
+        try:
+            coords = np.asarray(coords, dtype=float)
+            if coords.ndim < 2:
+                coords = coords.reshape(-1, self.n_dim)
+            if coords.ndim != 2 or coords.shape[1] != self.n_dim:
+                raise ValueError(f"coords should have shape (N_pt, {self.n_dim}), got {coords.shape}")
+            r = np.asarray(r, dtype=float)
+        except (TypeError, ValueError):
+            self.n_requests += 1
+            self.n_failed += 1
+            raise
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((coords, r, future, time.perf_counter()))
+        self.n_requests += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return await future
+
+    def metrics(self):
+        """
+        Return latency, batching and queue metrics.
+
+        Returns
+        -------
+        dict with
+            n_requests, n_completed, n_failed      : counts of submitted, completed and failed requests
+            n_batches                              : the number of computed batches
+            mean_batch_size                        : the mean number of requests in a batch
+            latency_p50, latency_p99, latency_max  : latencies of recent requests in seconds
+            queue_depth, max_queue_depth           : the number of requests waiting for batching
+
+        """
+        latencies = np.array(self.latencies)
+        n_done = latencies.shape[0]
+        return {
+            "n_requests": self.n_requests,
+            "n_completed": self.n_completed,
+            "n_failed": self.n_failed,
+            "n_batches": self.n_batches,
+            "mean_batch_size": self.n_batched / self.n_batches if self.n_batches > 0 else 0.,
+            "latency_p50": float(np.percentile(latencies, 50)) if n_done > 0 else None,
+            "latency_p99": float(np.percentile(latencies, 99)) if n_done > 0 else None,
+            "latency_max": float(latencies.max()) if n_done > 0 else None,
+            "queue_depth": self.queue_depth(),
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+    def queue_depth(self):
+        return 0 if self._queue is None else self._queue.qsize()
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [await self._queue.get()]
+            deadline = requests[0][3] + self.max_wait
+            while len(requests) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    requests.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # requests already in the queue join the batch without waiting
+            while len(requests) < self.max_batch_size and not self._queue.empty():
+                requests.append(self._queue.get_nowait())
+
+            batches = {}
+            for request in requests:
+                batches.setdefault((request[1].shape, request[1].tobytes()), []).append(request)
+            for batch in batches.values():
+                await self._slots.acquire()
+                task = loop.create_task(self._run_batch(batch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        try:
+            try:
+                list_coords = [request[0] for request in batch]
+                offsets = np.zeros(len(batch) + 1, dtype=np.int64)
+                offsets[1:] = np.cumsum([coords.shape[0] for coords in list_coords])
+                coords = np.concatenate(list_coords, axis=0)
+                calc = self.calc if self.executor == "thread" else None
+                arr_mfs = await asyncio.get_running_loop().run_in_executor(
+                    self._pool, _calc_batch, calc, coords, batch[0][1], offsets
+                )
+            except Exception as exc:
+                for request in batch:
+                    if not request[2].done():
+                        request[2].set_exception(exc)
+                self.n_failed += len(batch)
+            else:
+                time_done = time.perf_counter()
+                for request, mfs in zip(batch, arr_mfs):
+                    if not request[2].done():
+                        request[2].set_result(mfs)
+                    self.latencies.append(time_done - request[3])
+                self.n_completed += len(batch)
+            self.n_batches += 1
+            self.n_batched += len(batch)
+        finally:
+            self._slots.release()
+            for _ in batch:
+                self._queue.task_done()
+
+
+_WORKER_CALC = None
+
+
+def _init_worker(calc):
+    global _WORKER_CALC
+    _WORKER_CALC = calc
+
+
+def _calc_batch(calc, coords, r, offsets):
+    calc = _WORKER_CALC if calc is None else calc
+    return calc.calc_mfs_batch(coords, r, offsets)
+
+
+async def generate_load(service, coords, offsets, r, rate, n_requests, seed=0):
+    """
+    Submit single jets with Poisson arrivals to a service.
+
+    Parameters
+    ----------
+    service    : MFBatchService
+    coords     : np.array with shape (N_total, n_dim)
+    offsets    : np.array with shape (N_jets + 1,)
+        jets are submitted cyclically
+    r          : float or array_like
+    rate       : float
+        the mean number of requests per second
+    n_requests : int
+    seed       : int, default 0
+
+    Returns
+    -------
+    list of np.array
+        MFs of submitted jets in order of submission
+
+    """
+    rng = np.random.default_rng(seed)
+    n_jets = offsets.shape[0] - 1
+    time_next = time.perf_counter()
+    tasks = []
+    for i in range(n_requests):
+        time_next += rng.exponential(1 / rate)
+        delay = time_next - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        jet = i % n_jets
+        tasks.append(asyncio.ensure_future(service.submit(coords[offsets[jet]:offsets[jet + 1]], r)))
+    return await asyncio.gather(*tasks)
+
+
+async def _run_load(args):
+    coords, offsets, _ = synthetic_jets.generate_jets(args.kind, args.n_jets, args.n_constituents, seed=args.seed)
+    r = cli.parse_radius(args.r)
+    calc = cli.make_calculator(args.calculator, quad_segs=args.quad_segs, bin_width=args.bin_width)
+    service = MFBatchService(
+        calc, max_batch_size=args.max_batch_size, max_wait=args.max_wait,
+        executor=args.executor, n_workers=args.workers,
+    )
+    async with service:
+        time_start = time.perf_counter()
+        await generate_load(service, coords, offsets, r, args.rate, args.n_requests, seed=args.seed)
+        elapsed = time.perf_counter() - time_start
+    metrics = service.metrics()
+    metrics["throughput"] = args.n_requests / elapsed
+    return metrics
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m mfjet.service", description="Run a synthetic load on the MF service.")
+    parser.add_argument("--calculator", default="pixel-marching-square", choices=sorted(cli.CALCULATORS))
+    parser.add_argument("--quad-segs", type=int, default=None)
+    parser.add_argument("--bin-width", type=float, default=0.05)
+    parser.add_argument("--r", default="0:0.5:11", help="radius grid, start:stop:num or comma-separated list")
+    parser.add_argument("--kind", default="top", choices=["qcd", "top"])
+    parser.add_argument("--n-jets", type=int, default=100)
+    parser.add_argument("--n-constituents", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=1000., help="mean requests per second")
+    parser.add_argument("--n-requests", type=int, default=2000)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait", type=float, default=0.002)
+    parser.add_argument("--executor", default="thread", choices=["thread", "process"])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    metrics = asyncio.run(_run_load(args))
+    json.dump(metrics, sys.stdout, indent=1)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
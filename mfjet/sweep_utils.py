@@ -0,0 +1,228 @@
+"""
+Collection of codes for the sweep line over a union of equal axis-aligned squares.
+
+A vertical line sweeps the squares from left to right. Squares enter the active set
+at their left edges and leave it at their right edges, and the cross-section S of the union
+between consecutive events is the union of active y-intervals.
+The area and the horizontal boundary are swept over slabs between events,
+and the vertical boundary at an event line is the symmetric difference of the cross-sections
+S_prev and S_next on its both sides.
+
+Since the Euler characteristic is additive, slicing the union into open slabs and event lines gives
+
+    chi = sum_{event lines} #components(S_prev | S_next) - sum_{slabs} #components(S)
+
+for the union of closed squares, where squares touching at a corner are connected.
+If they are not connected, each pinch point, where only two opposite quadrants are covered,
+adds one to the Euler characteristic.
+
+Instead of updating the active set event by event, the sweep is vectorized with NumPy.
+Pairs of slabs and their active squares are expanded at once, and the intervals of each slab
+sorted by their lower edges are merged into components by a running maximum of their upper edges.
+Cross-sections on both sides of each event line are merged from components of the two slabs.
+The work is proportional to the number of pairs, i.e., N_pt times the average number of slabs
+spanned by a square, and the pairs are processed in chunks to bound the memory.
+Since this grows quadratically where squares overlap with each other,
+squares covered by their neighbours are pruned beforehand, see prune_covered.
+Pruning removes most squares of dense clusters, but the worst case,
+e.g., overlapping squares along a diagonal line, remains O(N_pt^2).
+
+"""
+import numpy as np
+
+
+def compress(values, tol):
+    """
+    Compress coordinates into sorted unique edges, where values closer than tol are merged.
+
+    Parameters
+    ----------
+    values : np.array with shape (N,)
+    tol    : float
+
+    Returns
+    -------
+    grid : np.array with shape (N_edge,)
+        unique edges
+    idx  : np.array of int with shape (N,)
+        index of the edge of each value
+
+    """
+    order = np.argsort(values)
+    sorted_values = values[order]
+    is_new = np.concatenate([[True], np.diff(sorted_values) > tol])
+    grid = sorted_values[is_new]
+    idx = np.empty(values.shape[0], dtype=int)
+    idx[order] = np.cumsum(is_new) - 1
+    return grid, idx
+
+
+def prune_covered(coords, r):
+    """
+    Remove squares covered by the union of other squares.
+    Points are binned into cells of width r / 2, so that points in a cell are closer than r
+    along each axis. If another point of the cell lies in a closed quadrant of a point,
+    its square covers the quarter of the square of the point in that quadrant.
+    Hence only points with an empty quadrant within their cells, i.e., points on the four staircases
+    of each cell, are kept, and the union of squares is unchanged.
+
+    Parameters
+    ----------
+    coords : np.array with shape (N_pt, 2)
+        centers of squares
+    r      : float
+        half-width of squares, r > 0
+
+    Returns
+    -------
+    np.array with shape (N_kept, 2)
+
+    """
+    coords = np.unique(coords, axis=0)
+    n_pt = coords.shape[0]
+    _, cell = np.unique(np.floor(coords / (0.5 * r)), axis=0, return_inverse=True)
+    cell = cell.reshape(-1).astype(np.int64)
+    keep = np.zeros(n_pt, dtype=bool)
+    for sign in [(1, 1), (1, -1), (-1, 1), (-1, -1)]:
+        x, y = coords[:, 0] * sign[0], coords[:, 1] * sign[1]
+        # points sorted by decreasing x within each cell, and the running maximum of dense ranks of y
+        order = np.lexsort((-y, -x, cell))
+        key = cell[order] * n_pt + np.unique(y, return_inverse=True)[1].reshape(-1)[order]
+        is_empty = np.empty(n_pt, dtype=bool)
+        is_empty[0] = True
+        np.greater(key[1:], np.maximum.accumulate(key)[:-1], out=is_empty[1:])
+        keep[order[is_empty]] = True
+    return coords[keep]
+
+
+def merge_intervals(start, stop, lo, hi, n_units, max_pairs=2 ** 20):
+    """
+    Merge integer intervals active over ranges of units into connected components of each unit.
+    Interval k covers cells [lo[k], hi[k]) in units [start[k], stop[k]),
+    and intervals sharing an edge are connected.
+
+    Parameters
+    ----------
+    start     : np.array of int with shape (N,)
+    stop      : np.array of int with shape (N,)
+    lo        : np.array of int with shape (N,)
+    hi        : np.array of int with shape (N,)
+    n_units   : int
+        the number of units, stop <= n_units
+    max_pairs : int, default 2**20
+        the maximum number of pairs of units and intervals expanded at once
+
+    Returns
+    -------
+    unit     : np.array of int with shape (N_comp,)
+        unit of each component, in ascending order
+    comp_lo  : np.array of int with shape (N_comp,)
+        the lowest edge of each component
+    comp_hi  : np.array of int with shape (N_comp,)
+        the highest edge of each component
+
+    """
+    # intervals sorted by lo stay sorted within each unit by the stable sort of units
+    order = np.argsort(lo, kind="stable")
+    start, stop, lo, hi = start[order], stop[order], lo[order], hi[order]
+    n_cells = int(hi.max(initial=0)) + 1
+
+    # chunks of units bounded by the number of pairs
+    n_active = np.cumsum(
+        np.bincount(start, minlength=n_units + 1) - np.bincount(stop, minlength=n_units + 1)
+    )[:n_units]
+    cum_active = np.cumsum(n_active)
+    bounds = np.searchsorted(cum_active, np.arange(max_pairs, cum_active[-1] if n_units else 0, max_pairs))
+    bounds = np.unique(np.concatenate([[0], bounds, [n_units]]))
+
+    list_unit, list_lo, list_hi = [], [], []
+    for unit_lo, unit_hi in zip(bounds[:-1], bounds[1:]):
+        sel = np.nonzero((start < unit_hi) & (stop > unit_lo))[0]
+        first = np.maximum(start[sel], unit_lo)
+        counts = np.minimum(stop[sel], unit_hi) - first
+        n_pairs = int(counts.sum())
+        if n_pairs == 0:
+            continue
+        unit = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(n_pairs)
+        # radix sort for units fitting in 16 bits
+        order = np.argsort(unit.astype(np.uint16) if n_units <= 2 ** 16 else unit, kind="stable")
+        pair_idx = np.repeat(sel, counts)[order]
+        base = unit[order] * n_cells
+
+        # an interval starts a new component unless it touches the running maximum of upper edges
+        key_lo = base + lo[pair_idx]
+        key_hi = np.maximum.accumulate(base + hi[pair_idx])
+        is_new = np.empty(n_pairs, dtype=bool)
+        is_new[0] = True
+        np.greater(key_lo[1:], key_hi[:-1], out=is_new[1:])
+        idx_new = np.nonzero(is_new)[0]
+        idx_last = np.append(idx_new[1:] - 1, n_pairs - 1)
+        list_unit.append(base[idx_new] // n_cells)
+        list_lo.append(key_lo[idx_new] - base[idx_new])
+        list_hi.append(key_hi[idx_last] - base[idx_new])
+
+    if not list_unit:
+        empty = np.zeros(0, dtype=int)
+        return empty, empty, empty
+    return np.concatenate(list_unit), np.concatenate(list_lo), np.concatenate(list_hi)
+
+
+def sweep_squares(coords, r, diagonal_connected=False, eps=1e-9, max_pairs=2 ** 20):
+    """
+    Calculate Minkowski functionals of the union of squares by the sweep line.
+
+    Parameters
+    ----------
+    coords             : np.array with shape (N_pt, 2)
+        centers of squares
+    r                  : float
+        half-width of squares, r > 0
+    diagonal_connected : bool, default False
+        If true, squares touching only at a corner are connected.
+    eps                : float, default 1e-9
+        Edges closer than (eps) * (2r) are merged.
+    max_pairs          : int, default 2**20
+        the maximum number of pairs of slabs and squares expanded at once
+
+    Returns
+    -------
+    np.array with shape (3,)
+        Euler characteristic, boundary length and area
+
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if coords.shape[0] == 0:
+        return np.zeros(3)
+    coords = prune_covered(coords, r)
+    n_pt = coords.shape[0]
+    tol = eps * 2 * r
+    grid_x, idx_x = compress(np.concatenate([coords[:, 0] - r, coords[:, 0] + r]), tol)
+    grid_y, idx_y = compress(np.concatenate([coords[:, 1] - r, coords[:, 1] + r]), tol)
+    enter, leave = idx_x[:n_pt], idx_x[n_pt:]
+    lo_y, hi_y = idx_y[:n_pt], idx_y[n_pt:]
+    n_lines = grid_x.shape[0]
+
+    # cross-sections of slabs between lines i and i + 1,
+    # and unions of both sides of line i merged from components of slabs i - 1 and i
+    slab, slab_lo, slab_hi = merge_intervals(enter, leave, lo_y, hi_y, n_lines - 1, max_pairs)
+    line, line_lo, line_hi = merge_intervals(slab, slab + 2, slab_lo, slab_hi, n_lines, max_pairs)
+    slab_length = grid_y[slab_hi] - grid_y[slab_lo]
+    line_length = grid_y[line_hi] - grid_y[line_lo]
+    width = np.diff(grid_x)[slab]
+
+    area = np.sum(slab_length * width)
+    # each slab is the previous side of one line and the next side of another
+    length = 2 * np.sum(width) + 2 * np.sum(line_length) - 2 * np.sum(slab_length)
+    euler = line.shape[0] - slab.shape[0]
+
+    if not diagonal_connected:
+        # pinch points, where a component of the previous slab ends at the edge
+        # on which a component of the next slab starts, or vice versa
+        n_edges = grid_y.shape[0]
+        key_prev_hi = (slab + 1) * n_edges + slab_hi
+        key_prev_lo = (slab + 1) * n_edges + slab_lo
+        key_next_lo = slab * n_edges + slab_lo
+        key_next_hi = slab * n_edges + slab_hi
+        euler += np.intersect1d(key_prev_hi, key_next_lo, assume_unique=True).shape[0]
+        euler += np.intersect1d(key_prev_lo, key_next_hi, assume_unique=True).shape[0]
+    return np.array([euler, length, area], dtype=float)
@@ -0,0 +1,141 @@
+"""
+Generators of synthetic jets for tests and benchmarks.
+
+Jets are point clouds of constituents in the (eta, phi) plane centered at the jet axis,
+together with transverse momentum fractions of constituents.
+They mimic the geometry of jets, not their physics.
+
+* QCD-like jets: a single collimated prong, whose constituents are distributed
+  with a heavy-tailed radial profile around the axis.
+* top-like jets: three collimated prongs with separations of the order of the jet radius.
+
+"""
+import numpy as np
+
+from . import batch_utils
+
+
+def generate_qcd_jet(n_constituents, rng=None, prong_width=0.05, jet_radius=0.8):
+    """
+    Generate a QCD-like jet with a single collimated prong.
+
+    Parameters
+    ----------
+    n_constituents : int
+        the number of constituents
+    rng            : np.random.Generator or int, optional
+        random number generator or seed
+    prong_width    : float, default 0.05
+        typical angular size of the prong
+    jet_radius     : float, default 0.8
+        constituents are confined within this distance from the axis
+
+    Returns
+    -------
+    coords : np.array with shape (n_constituents, 2)
+    pt     : np.array with shape (n_constituents,)
+        momentum fractions of constituents summing to 1
+
+    """
+    rng = np.random.default_rng(rng)
+    return _generate_prongs(rng, n_constituents, np.zeros((1, 2)), np.ones(1), prong_width, jet_radius)
+
+
+def generate_top_jet(n_constituents, rng=None, prong_width=0.05, jet_radius=0.8, prong_separation=0.4):
+    """
+    Generate a top-like jet with three collimated prongs.
+
+    Parameters
+    ----------
+    n_constituents   : int
+        the number of constituents
+    rng              : np.random.Generator or int, optional
+        random number generator or seed
+    prong_width      : float, default 0.05
+        typical angular size of each prong
+    jet_radius       : float, default 0.8
+        constituents are confined within this distance from the axis
+    prong_separation : float, default 0.4
+        typical distance between prongs
+
+    Returns
+    -------
+    coords : np.array with shape (n_constituents, 2)
+    pt     : np.array with shape (n_constituents,)
+        momentum fractions of constituents summing to 1
+
+    """
+    rng = np.random.default_rng(rng)
+    # prongs on a triangle with random orientation and size around the axis
+    angle = rng.uniform(0, 2 * np.pi) + np.array([0, 2 * np.pi / 3, 4 * np.pi / 3])
+    distance = prong_separation / np.sqrt(3) * rng.uniform(0.6, 1.4, size=3)
+    prong_axes = distance[:, np.newaxis] * np.stack([np.cos(angle), np.sin(angle)], axis=-1)
+    prong_axes = prong_axes - prong_axes.mean(axis=0)
+    prong_pt = rng.dirichlet(np.full(3, 3.))
+    return _generate_prongs(rng, n_constituents, prong_axes, prong_pt, prong_width, jet_radius)
+
+
+def generate_jets(kind, n_jets, n_constituents, seed=0, **kwargs):
+    """
+    Generate a ragged batch of synthetic jets.
+
+    Parameters
+    ----------
+    kind           : str
+        "qcd" or "top"
+    n_jets         : int
+        the number of jets
+    n_constituents : int or tuple of int
+        the number of constituents of each jet, or a range [low, high)
+        from which the numbers are drawn uniformly
+    seed           : int, default 0
+        random seed, the batch is reproducible for a given seed
+    kwargs         :
+        parameters passed to generate_qcd_jet or generate_top_jet
+
+    Returns
+    -------
+    coords  : np.array with shape (N_total, 2)
+    offsets : np.array with shape (N_jets + 1,)
+    pt      : np.array with shape (N_total,)
+
+    """
+    if kind == "qcd":
+        generate = generate_qcd_jet
+    elif kind == "top":
+        generate = generate_top_jet
+    else:
+        raise ValueError(f"unknown kind: {kind}")
+
+    rng = np.random.default_rng(seed)
+    if np.ndim(n_constituents) == 0:
+        arr_n = np.full(n_jets, n_constituents, dtype=int)
+    else:
+        arr_n = rng.integers(n_constituents[0], n_constituents[1], size=n_jets)
+
+    list_coords, list_pt = [], []
+    for n in arr_n:
+        coords, pt = generate(n, rng, **kwargs)
+        list_coords.append(coords)
+        list_pt.append(pt)
+    coords, offsets = batch_utils.ragged_to_flat(list_coords)
+    return coords, offsets, np.concatenate([np.zeros(0)] + list_pt)
+
+
+def _generate_prongs(rng, n_constituents, prong_axes, prong_pt, prong_width, jet_radius):
+    # constituents are assigned to prongs with probabilities proportional to prong momenta
+    prong = rng.choice(prong_pt.shape[0], size=n_constituents, p=prong_pt)
+    # heavy-tailed radial profile, i.e., collinear emissions with a soft wide-angle tail
+    radius = prong_width * rng.pareto(2., size=n_constituents)
+    angle = rng.uniform(0, 2 * np.pi, size=n_constituents)
+    coords = prong_axes[prong] + radius[:, np.newaxis] * np.stack([np.cos(angle), np.sin(angle)], axis=-1)
+
+    # constituents outside the jet are folded back into the jet
+    distance = np.linalg.norm(coords, axis=-1)
+    outside = distance > jet_radius
+    coords[outside] *= (jet_radius * rng.uniform(size=np.count_nonzero(outside)) / distance[outside])[:, np.newaxis]
+
+    # harder constituents are closer to prong axes
+    pt = rng.exponential(size=n_constituents) / (1 + radius / prong_width)
+    pt = pt / pt.sum() if n_constituents > 0 else pt
+    return coords, pt
@@ -1,3 +1,721 @@
+"""
+Cross-engine consistency tests and an opt-in performance regression gate.
+
+Run from the repository root::
+
+    python -m unittest tests/tests.py
+
+Stated tolerances
+-----------------
+* Pixel engines (MFPixelCalculator with "shapely" and "sweep" backends, and
+  MFPixelCalculatorMarchingSquare) agree exactly on boundary length and area,
+  and MFManhattanCalculator agrees with them on grid-aligned inputs.
+  The Euler characteristic agrees exactly except that the shapely engine counts holes
+  pinched at a diagonal corner, so that the difference is bounded by the number of
+  diagonal 2x2 configurations of the dilated image.
+* MFEuclideanCalculator converges to MFEuclideanCalculatorAlphaComplex with quad_segs:
+  relative errors of length and area decrease with quad_segs and are below 1e-3
+  for quad_segs = 64, and Euler characteristics agree for quad_segs >= 8.
+* Engines of the same geometry (clusters or not, sweep line or shapely, tiles or not,
+  periodic or flat away from the seam) agree within rounding errors.
+
+Performance gate
+----------------
+Timings of all engines on synthetic jets are recorded by mfjet.benchmark if
+MFJET_PERF_OUTPUT is set, and compared with a stored baseline if MFJET_PERF_BASELINE is set::
+
+    MFJET_PERF_OUTPUT=baseline.json python -m unittest tests/tests.py
+    MFJET_PERF_BASELINE=baseline.json python -m unittest tests/tests.py
+
+The gate fails if an engine is slower than the baseline by more than the factor
+MFJET_PERF_THRESHOLD, default 1.5. MFJET_PERF_N_JETS sets the number of jets, default 20.
+
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
 import unittest
+import zipfile
+
+import numpy as np
+import scipy.signal
+
+import mfjet
+from mfjet import benchmark
+from mfjet import cache_utils
+from mfjet import cli
+from mfjet import cluster_utils
+from mfjet import jit_utils
+from mfjet import parallel_utils
+from mfjet import persistence_utils
+from mfjet import service
+from mfjet import sweep_utils
+from mfjet import synthetic_jets
+
+
+def make_jets(n_jets=30, seed=0):
+    coords, offsets, _ = synthetic_jets.generate_jets("top", n_jets, (5, 80), seed=seed)
+    return [coords[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+class TestPixelConsistency(unittest.TestCase):
+    # a power of two, so that pixel edges are exact in floating point
+    bin_width = 1 / 16
+
+    def setUp(self):
+        self.list_coords = make_jets()
+        self.r = np.arange(12) * self.bin_width * 0.5
+        self.calc_shapely = mfjet.MFPixelCalculator(bin_width=self.bin_width)
+        self.calc_sweep = mfjet.MFPixelCalculator(bin_width=self.bin_width, backend="sweep")
+        self.calc_ms = mfjet.MFPixelCalculatorMarchingSquare(bin_width=self.bin_width)
+
+    def count_diagonal(self, coords):
+        # the number of diagonal 2x2 configurations of the dilated image for each r
+        img = self.calc_ms.coord_to_img(coords)
+        n_diagonal = []
+        for square_width in self.calc_ms.r_to_square_width(self.r):
+            img_dilated = self.calc_ms.dilate_img_by_square(img, square_width)
+            count_code = self.calc_ms.count_binary_encoding(img_dilated[np.newaxis])[0]
+            n_diagonal.append(count_code[6] + count_code[9])
+        return np.array(n_diagonal)
+
+    def assert_pixel_mfs_equal(self, arr_mfs, arr_mfs_ref, coords):
+        np.testing.assert_allclose(arr_mfs[..., 1:], arr_mfs_ref[..., 1:], rtol=1e-9, atol=1e-9)
+        diff_euler = np.abs(arr_mfs[..., 0] - arr_mfs_ref[..., 0])
+        self.assertTrue(np.all(diff_euler <= self.count_diagonal(coords)))
+
+    def test_sweep_equals_marching_square(self):
+        for coords in self.list_coords:
+            np.testing.assert_allclose(
+                self.calc_sweep.calc_mfs(coords, self.r), self.calc_ms.calc_mfs(coords, self.r),
+                rtol=1e-9, atol=1e-9
+            )
+
+    def test_shapely_equals_marching_square(self):
+        for coords in self.list_coords:
+            self.assert_pixel_mfs_equal(
+                self.calc_shapely.calc_mfs(coords, self.r), self.calc_ms.calc_mfs(coords, self.r), coords
+            )
+
+    def test_manhattan_on_grid(self):
+        calc = mfjet.MFManhattanCalculator()
+        for coords in self.list_coords:
+            coords_grid = mfjet.coords_to_binned_coords(coords, bin_width=self.bin_width)
+            self.assert_pixel_mfs_equal(
+                calc.calc_mfs(coords_grid, self.calc_shapely.discretize_r(self.r)),
+                self.calc_ms.calc_mfs(coords, self.r),
+                coords
+            )
+
+    def test_marching_square_variants(self):
+        list_calc = [
+            mfjet.MFPixelCalculatorMarchingSquare(bin_width=self.bin_width, radius_scan="dilation"),
+            mfjet.MFPixelCalculatorMarchingSquare(bin_width=self.bin_width, tile_size=8),
+        ]
+        for coords in self.list_coords:
+            arr_mfs_ref = self.calc_ms.calc_mfs(coords, self.r)
+            for calc in list_calc:
+                np.testing.assert_array_equal(calc.calc_mfs(coords, self.r), arr_mfs_ref)
+        np.testing.assert_array_equal(
+            self.calc_ms.calc_mfs_batch(self.list_coords, self.r),
+            [self.calc_ms.calc_mfs(coords, self.r) for coords in self.list_coords]
+        )
+
+    def test_jit_kernel(self):
+        # the kernel runs as plain Python without numba
+        list_coords = self.list_coords[:5]
+        offsets = np.cumsum([0] + [coords.shape[0] for coords in list_coords])
+        arr_mfs_ref = self.calc_ms.calc_mfs_batch(list_coords, self.r)
+        np.testing.assert_array_equal(self.calc_ms.calc_mfs_jit(np.concatenate(list_coords), self.r, offsets), arr_mfs_ref)
+        if jit_utils.HAS_NUMBA:
+            calc = mfjet.MFPixelCalculatorMarchingSquare(bin_width=self.bin_width, backend="numba")
+            np.testing.assert_array_equal(calc.calc_mfs_batch(list_coords, self.r), arr_mfs_ref)
+        else:
+            with self.assertWarns(RuntimeWarning):
+                calc = mfjet.MFPixelCalculatorMarchingSquare(bin_width=self.bin_width, backend="numba")
+            self.assertEqual(calc.backend, "numpy")
+
+    def test_grey_level(self):
+        # the excursion set at a threshold is the image of points with weights not smaller than it
+        coords, offsets, pt = synthetic_jets.generate_jets("top", 5, (5, 80), seed=3)
+        for start, stop in zip(offsets[:-1], offsets[1:]):
+            jet_coords, jet_pt = coords[start:stop], pt[start:stop]
+            thresholds = np.quantile(jet_pt, [0.9, 0, 1, 0.5])
+            arr_mfs = self.calc_ms.calc_mfs_grey(jet_coords, jet_pt, thresholds, self.r)
+            self.assertEqual(arr_mfs.shape, (4,) + self.r.shape + (3,))
+            for threshold, mfs in zip(thresholds, arr_mfs):
+                np.testing.assert_array_equal(mfs, self.calc_ms.calc_mfs(jet_coords[jet_pt >= threshold], self.r))
+
+    def test_binary_encoding(self):
+        # 2x2 encodings are the convolution with filter_binary of integer images of earlier releases
+        for coords in self.list_coords[:5]:
+            img = self.calc_ms.coord_to_img(coords)
+            self.assertEqual(img.dtype, bool)
+            code = scipy.signal.convolve(img.astype(int), self.calc_ms.filter_binary)
+            np.testing.assert_array_equal(
+                self.calc_ms.count_binary_encoding(img[np.newaxis])[0], np.bincount(code.ravel(), minlength=16)
+            )
+            np.testing.assert_array_equal(
+                self.calc_ms.calc_mfs(img=img.astype(int), r=self.r), self.calc_ms.calc_mfs(coords, self.r)
+            )
+
+    def test_image_stack(self):
+        rng = np.random.default_rng(6)
+        imgs = rng.random((6, 12, 15)) < 0.3
+        imgs[0] = False
+        imgs[1] = True
+        # pixels on the corners and edges of the image
+        imgs[2, 0, 0] = imgs[2, -1, -1] = imgs[2, 0, 7] = imgs[2, 5, -1] = True
+        imgs[3, :, 0] = True
+        list_calc = [
+            self.calc_ms,
+            mfjet.MFPixelCalculatorMarchingSquare(bin_width=self.bin_width, radius_scan="dilation"),
+        ]
+        for calc in list_calc:
+            for r in [0., 2.5 * self.bin_width, self.r]:
+                arr_mfs_ref = np.array([calc.calc_mfs(img=img, r=r) for img in imgs])
+                np.testing.assert_array_equal(calc.calc_mfs(img=imgs, r=r), arr_mfs_ref)
+                np.testing.assert_array_equal(calc.calc_mfs_from_imgs(imgs, r), arr_mfs_ref)
+        # a single pixel in the corner is a square
+        img = np.zeros((4, 4), dtype=bool)
+        img[0, 0] = True
+        np.testing.assert_array_equal(
+            self.calc_ms.calc_mfs(img=img[np.newaxis], r=self.bin_width)[0],
+            [1., 12 * self.bin_width, 9 * self.bin_width ** 2]
+        )
+
+    def test_periodic_away_from_seam(self):
+        period = 128 * self.bin_width
+        list_calc = [
+            (self.calc_ms, mfjet.MFPixelCalculatorMarchingSquare(bin_width=self.bin_width, phi_period=period)),
+            (self.calc_shapely, mfjet.MFPixelCalculator(bin_width=self.bin_width, phi_period=period)),
+        ]
+        for coords in self.list_coords[:10]:
+            # jets are centered at phi = 0 and wrap around the seam
+            coords_shifted = coords + np.array([0, 0.5 * period])
+            for calc, calc_periodic in list_calc:
+                np.testing.assert_allclose(
+                    calc_periodic.calc_mfs(coords, self.r), calc.calc_mfs(coords_shifted, self.r),
+                    rtol=1e-9, atol=1e-9
+                )
+
+
+class TestManhattanConsistency(unittest.TestCase):
+    def setUp(self):
+        self.list_coords = make_jets(seed=1)
+        self.r = np.linspace(0.005, 0.3, 10)
+
+    def test_sweep_line(self):
+        calc = mfjet.MFManhattanCalculator()
+        calc_sweep = mfjet.MFManhattanCalculatorSweepLine()
+        for coords in self.list_coords:
+            np.testing.assert_allclose(calc_sweep.calc_mfs(coords, self.r), calc.calc_mfs(coords, self.r), rtol=1e-9, atol=1e-9)
+
+    def test_sweep_line_events(self):
+        # the event sweep agrees with the compressed grid, including squares touching at corners
+        rng = np.random.default_rng(0)
+        list_grid = [rng.integers(0, 8, size=(20, 2)).astype(float) for _ in range(20)]
+        r_grid = np.arange(1, 8) * 0.5
+        for diagonal_connected in [False, True]:
+            calc = mfjet.MFManhattanCalculatorSweepLine(diagonal_connected=diagonal_connected)
+            calc_events = mfjet.MFManhattanCalculatorSweepLine(diagonal_connected=diagonal_connected, max_dense_cells=0)
+            for coords, r in [(coords, self.r) for coords in self.list_coords] + [(coords, r_grid) for coords in list_grid]:
+                np.testing.assert_allclose(calc_events.calc_mfs(coords, r), calc.calc_mfs(coords, r), rtol=1e-9, atol=1e-9)
+
+    def test_sweep_pruning(self):
+        # squares covered by others are pruned without changing the union, and pairs are expanded in chunks
+        calc = mfjet.MFManhattanCalculatorSweepLine()
+        for coords in self.list_coords:
+            coords = np.concatenate([coords, coords[:3]])
+            for r in self.r[::3]:
+                coords_pruned = sweep_utils.prune_covered(coords, r)
+                np.testing.assert_allclose(calc.calc_mfs(coords_pruned, r), calc.calc_mfs(coords, r), rtol=1e-9, atol=1e-9)
+                np.testing.assert_allclose(
+                    sweep_utils.sweep_squares(coords, r, max_pairs=16), calc.calc_mfs(coords, r), rtol=1e-9, atol=1e-9
+                )
+        coords = max(self.list_coords, key=len)
+        self.assertLess(sweep_utils.prune_covered(coords, self.r[-1]).shape[0], 0.7 * coords.shape[0])
+
+    def test_split_components(self):
+        calc = mfjet.MFManhattanCalculator(split_components=True)
+        calc_union = mfjet.MFManhattanCalculator(split_components=False)
+        for coords in self.list_coords:
+            np.testing.assert_allclose(calc.calc_mfs(coords, self.r), calc_union.calc_mfs(coords, self.r), rtol=1e-9, atol=1e-9)
+
+    def test_threads(self):
+        # radii evaluated on a thread pool, both by clusters and by the union of all points
+        for split_components in [True, False]:
+            calc = mfjet.MFManhattanCalculator(split_components=split_components)
+            calc_threads = mfjet.MFManhattanCalculator(split_components=split_components, n_threads=4)
+            for coords in self.list_coords:
+                np.testing.assert_array_equal(calc_threads.calc_mfs(coords, self.r), calc.calc_mfs(coords, self.r))
+
+
+class TestEuclideanConsistency(unittest.TestCase):
+    def setUp(self):
+        self.list_coords = make_jets(n_jets=10, seed=2)
+        self.r = np.linspace(0.01, 0.5, 12)
+        calc_alpha = mfjet.MFEuclideanCalculatorAlphaComplex()
+        self.list_mfs_alpha = [calc_alpha.calc_mfs(coords, self.r) for coords in self.list_coords]
+
+    def calc_errors(self, calc):
+        errors = []
+        for coords, arr_mfs_alpha in zip(self.list_coords, self.list_mfs_alpha):
+            arr_mfs = calc.calc_mfs(coords, self.r)
+            errors.append(np.concatenate([
+                np.abs(arr_mfs[:, :1] - arr_mfs_alpha[:, :1]),
+                np.abs(arr_mfs[:, 1:] / arr_mfs_alpha[:, 1:] - 1),
+            ], axis=-1).max(axis=0))
+        return np.max(errors, axis=0)
+
+    def test_quad_segs_convergence(self):
+        list_quad_segs = [4, 8, 16, 32, 64]
+        errors = np.array([self.calc_errors(mfjet.MFEuclideanCalculator(quad_segs=quad_segs)) for quad_segs in list_quad_segs])
+        self.assertTrue(np.all(np.diff(errors[:, 1:], axis=0) < 0), errors)
+        self.assertTrue(np.all(errors[-1, 1:] < 1e-3), errors)
+        self.assertTrue(np.all(errors[1:, 0] == 0), errors)
+
+    def test_split_components(self):
+        calc = mfjet.MFEuclideanCalculator(split_components=True)
+        calc_union = mfjet.MFEuclideanCalculator(split_components=False)
+        for coords in self.list_coords:
+            np.testing.assert_allclose(calc.calc_mfs(coords, self.r), calc_union.calc_mfs(coords, self.r), rtol=1e-9, atol=1e-9)
+
+    def test_threads(self):
+        # radii evaluated on a thread pool, both by clusters and by the union of all points
+        for split_components in [True, False]:
+            calc = mfjet.MFEuclideanCalculator(split_components=split_components)
+            calc_threads = mfjet.MFEuclideanCalculator(split_components=split_components, n_threads=4)
+            for coords in self.list_coords:
+                np.testing.assert_array_equal(calc_threads.calc_mfs(coords, self.r), calc.calc_mfs(coords, self.r))
+
+    def test_single_cluster(self):
+        calc = mfjet.MFEuclideanCalculator(split_components=True)
+        calc_union = mfjet.MFEuclideanCalculator(split_components=False)
+        for coords in self.list_coords:
+            is_single = cluster_utils.is_single_cluster(coords, self.r)
+            np.testing.assert_array_equal(
+                is_single, [cluster_utils.calc_cluster_labels(coords, 2 * r * (1 + 1e-9))[0] == 1 for r in self.r]
+            )
+            # radii linking all points take the vectorized union
+            np.testing.assert_array_equal(
+                calc.calc_mfs(coords, self.r)[is_single], calc_union.calc_mfs(coords, self.r)[is_single]
+            )
+        self.assertTrue(np.any(is_single) and not np.all(is_single))
+
+    def test_periodic_away_from_seam(self):
+        period = 2 * np.pi
+        calc = mfjet.MFEuclideanCalculator()
+        calc_periodic = mfjet.MFEuclideanCalculator(phi_period=period)
+        for coords in self.list_coords:
+            np.testing.assert_allclose(
+                calc_periodic.calc_mfs(coords, self.r), calc.calc_mfs(coords + np.array([0, np.pi]), self.r),
+                rtol=1e-9, atol=1e-9
+            )
+
+    def test_collinear_on_grid(self):
+        # pixel centers of a jet whose Delaunay triangulation has flat triangles
+        # on the collinear hull points from (-0.26, 0.13) to (-0.22, 0.17)
+        coords = np.array([
+            [-0.32, -0.1], [-0.26, 0.13], [-0.24, 0.15], [-0.23, 0.16], [-0.22, 0.09], [-0.22, 0.15],
+            [-0.22, 0.17], [-0.21, 0.15], [-0.18, 0.14], [-0.08, 0.04], [-0.01, -0.27], [-0.01, -0.26],
+            [0.01, -0.27], [0.01, -0.23], [0.02, -0.45], [0.02, -0.27], [0.2, 0.12], [0.21, 0.11],
+        ])
+        r = np.linspace(0.0137, 0.5137, 11)
+        arr_mfs = mfjet.MFEuclideanCalculatorAlphaComplex().calc_mfs(coords, r)
+        arr_mfs_ref = mfjet.MFEuclideanCalculator(quad_segs=64).calc_mfs(coords, r)
+        np.testing.assert_array_equal(arr_mfs[:, 0], arr_mfs_ref[:, 0])
+        np.testing.assert_allclose(arr_mfs[:, 1:], arr_mfs_ref[:, 1:], rtol=1e-3)
+
+
+class TestPixelEuclidean(unittest.TestCase):
+    bin_width = 0.01
+
+    def test_stated_errors(self):
+        calc = mfjet.MFPixelCalculatorEuclidean(bin_width=self.bin_width)
+        calc_alpha = mfjet.MFEuclideanCalculatorAlphaComplex()
+        # maximum errors stated in the docstring for r / bin_width >= 2, 10, 20, 50
+        list_k = [2, 10, 20, 50]
+        list_bound = [[8, 0.2, 0.3], [5, 0.12, 0.015], [4, 0.09, 0.005], [1, 0.07, 0.002]]
+        for coords in make_jets(n_jets=10, seed=7):
+            coords_pixel = mfjet.coords_to_binned_coords(coords, bin_width=self.bin_width)
+            for k, bound in zip(list_k, list_bound):
+                r = np.linspace(k, 2 * k, 5) * self.bin_width
+                arr_mfs = calc.calc_mfs(coords, r)
+                arr_mfs_alpha = calc_alpha.calc_mfs(coords_pixel, r)
+                self.assertTrue(np.all(np.abs(arr_mfs[:, 0] - arr_mfs_alpha[:, 0]) <= bound[0]))
+                self.assertTrue(np.all(np.abs(arr_mfs[:, 1:] / arr_mfs_alpha[:, 1:] - 1) <= bound[1:]))
+
+    def test_zero_radius(self):
+        calc = mfjet.MFPixelCalculatorEuclidean(bin_width=self.bin_width)
+        coords = np.array([[0., 0.], [0.001, 0.], [0.5, 0.5]])
+        np.testing.assert_array_equal(calc.calc_mfs(coords, 0.), [2, 0, 0])
+        np.testing.assert_array_equal(calc.calc_mfs(coords, [0., 0.])[:, 0], [2, 2])
+
+
+class TestVoxel(unittest.TestCase):
+    def test_cuboids(self):
+        # a cuboid with edges (a, b, c) has MFs (1, pi (a + b + c), 2 (ab + bc + ca), abc)
+        calc = mfjet.MFVoxelCalculator(bin_width=(1., 2., 0.5))
+        r = np.array([0., 1.])
+        arr_mfs = calc.calc_mfs(np.zeros((1, 3)), r)
+        edges = calc.r_to_cuboid_width(r) * calc.bin_width
+        np.testing.assert_allclose(edges[0], calc.bin_width)
+        np.testing.assert_allclose(arr_mfs, np.stack([
+            np.ones(2), np.pi * edges.sum(axis=-1),
+            2 * (edges[:, 0] * edges[:, 1] + edges[:, 1] * edges[:, 2] + edges[:, 2] * edges[:, 0]),
+            edges.prod(axis=-1),
+        ], axis=-1))
+
+    def test_diagonal_connected(self):
+        coords = np.array([[0., 0., 0.], [1., 1., 0.]])
+        self.assertEqual(mfjet.MFVoxelCalculator().calc_mfs(coords, 0.)[0], 2)
+        self.assertEqual(mfjet.MFVoxelCalculator(diagonal_connected=True).calc_mfs(coords, 0.)[0], 1)
+
+    def test_batch(self):
+        rng = np.random.default_rng(7)
+        list_coords = [rng.integers(0, 6, size=(n, 3)).astype(float) for n in (1, 5, 0, 12)]
+        calc = mfjet.MFVoxelCalculator(aspect=(0., 1., 1.))
+        r = np.array([0., 1., 2.5])
+        arr_mfs = calc.calc_mfs_batch(list_coords, r, chunk_size=3)
+        for coords, mfs in zip(list_coords, arr_mfs):
+            expected = calc.calc_mfs(coords, r) if coords.shape[0] else np.zeros((3, 4))
+            np.testing.assert_allclose(mfs, expected)
+
+
+class TestPersistence(unittest.TestCase):
+    def test_manhattan_on_grid(self):
+        calc = mfjet.MFManhattanCalculator()
+        rng = np.random.default_rng(5)
+        r = np.arange(1, 10) * 0.5
+        for diagonal_connected in [False, True]:
+            calc_sweep = mfjet.MFManhattanCalculatorSweepLine(diagonal_connected=diagonal_connected)
+            for _ in range(50):
+                coords = rng.integers(0, 8, size=(rng.integers(2, 25), 2)).astype(float)
+                np.testing.assert_allclose(
+                    calc.calc_mfs_persistence(coords, r, diagonal_connected=diagonal_connected),
+                    calc_sweep.calc_mfs(coords, r), rtol=1e-9, atol=1e-9
+                )
+        np.testing.assert_array_equal(calc.calc_mfs_persistence([[0, 0], [1, 1]], 0.5), [2, 8, 2])
+        np.testing.assert_array_equal(calc.calc_mfs_persistence([[0, 0], [1, 1]], 0.5, diagonal_connected=True), [1, 8, 2])
+
+    def test_manhattan_events(self):
+        calc = mfjet.MFManhattanCalculator()
+        coords = make_jets(n_jets=1, seed=5)[0]
+        r = np.linspace(0.01, 0.3, 10)
+        arr_mfs, list_events = calc.calc_mfs_persistence(coords, r, return_events=True)
+        self.assertEqual(len(list_events), 4)
+        euler = sum(
+            persistence_utils.eval_events(events["birth"], events["death"], events["weight"], r)
+            for events in list_events
+        ) / 4
+        np.testing.assert_allclose(euler, arr_mfs[:, 0])
+        np.testing.assert_allclose(arr_mfs, calc.calc_mfs(coords, r), rtol=1e-9, atol=1e-9)
+
+    def test_euclidean(self):
+        calc = mfjet.MFEuclideanCalculatorAlphaComplex()
+        r = np.linspace(0, 0.5, 12)
+        for coords in make_jets(n_jets=10, seed=6):
+            np.testing.assert_allclose(calc.calc_mfs_persistence(coords, r), calc.calc_mfs(coords, r), rtol=1e-9, atol=1e-9)
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.list_coords = make_jets(n_jets=2, seed=4)
+        self.r = np.linspace(0.01, 0.5, 6)
+
+    def assert_profiled(self, calc, stages, counter):
+        with calc.profile() as profiler:
+            calc.calc_mfs(self.list_coords[0], self.r)
+            calc.calc_mfs_batch(self.list_coords, self.r)
+        self.assertEqual(set(profiler.stage_time), set(stages))
+        self.assertEqual(set(profiler.stage_calls), set(stages))
+        self.assertTrue(all(profiler.stage_calls[name] > 0 for name in stages))
+        self.assertEqual(set(profiler.counters), {counter})
+        self.assertGreater(profiler.counters[counter], 0)
+
+    def test_shapely(self):
+        stages = ["cluster", "buffer", "union", "measure"]
+        self.assert_profiled(mfjet.MFEuclideanCalculator(), stages, "vertices")
+        self.assert_profiled(mfjet.MFManhattanCalculator(), stages, "vertices")
+        # the Manhattan calculator held by the pixel calculator shares its profiler
+        self.assert_profiled(mfjet.MFPixelCalculator(bin_width=0.05), ["pixelization"] + stages, "vertices")
+
+    def test_marching_square(self):
+        stages = ["pixelization", "dilation", "measure"]
+        for radius_scan in ["distance_transform", "dilation"]:
+            calc = mfjet.MFPixelCalculatorMarchingSquare(bin_width=0.05, radius_scan=radius_scan)
+            self.assert_profiled(calc, stages, "image_pixels")
+
+    def test_persistence(self):
+        calc = mfjet.MFEuclideanCalculator()
+        with calc.profile() as profiler:
+            calc.calc_mfs_persistence(self.list_coords[0], self.r)
+        self.assertEqual(set(profiler.stage_time), {"alpha_complex", "persistence", "measure"})
+
+    def test_disabled(self):
+        calc = mfjet.MFPixelCalculator(bin_width=0.05)
+        self.assertIsNone(calc.profiler)
+        with calc.profile() as profiler:
+            pass
+        calc.calc_mfs(self.list_coords[0], self.r)
+        profiler_enabled = calc.enable_profiling()
+        calc.disable_profiling()
+        calc.calc_mfs_batch(self.list_coords, self.r)
+        for this_profiler in [profiler, profiler_enabled]:
+            self.assertEqual(this_profiler.as_dict(), {"stages": {}, "counters": {}})
+        self.assertIsNone(calc.profiler)
+        self.assertIsNone(calc.calc.profiler)
+
+
+class TestDataset(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        # members of the archive start past 64 KiB
+        self.coords, self.offsets, _ = synthetic_jets.generate_jets("qcd", 200, (20, 40), seed=3)
+        self.input_path = os.path.join(self.tmpdir.name, "jets.npz")
+        self.output_path = os.path.join(self.tmpdir.name, "mfs.npy")
+        mfjet.save_ragged(self.input_path, self.coords, self.offsets)
+        self.r = np.linspace(0, 0.3, 4)
+
+    def test_round_trip(self):
+        with zipfile.ZipFile(self.input_path) as archive:
+            self.assertGreater(archive.getinfo("offsets.npy").header_offset, 2 ** 16)
+        coords, offsets = mfjet.load_ragged(self.input_path)
+        np.testing.assert_array_equal(coords, self.coords)
+        np.testing.assert_array_equal(offsets, self.offsets)
+
+    def test_resume(self):
+        calc = mfjet.MFPixelCalculatorMarchingSquare(bin_width=0.05)
+
+        def interrupt(n_done, n_jets):
+            if n_done >= 64:
+                raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            mfjet.featurize_dataset(calc, self.input_path, self.output_path, self.r, chunk_size=64, callback=interrupt)
+        list_done = []
+        arr_mfs = mfjet.featurize_dataset(
+            calc, self.input_path, self.output_path, self.r, chunk_size=64,
+            callback=lambda n_done, n_jets: list_done.append(n_done)
+        )
+        self.assertEqual(list_done[0], 64)
+        np.testing.assert_array_equal(arr_mfs, calc.calc_mfs_batch(self.coords, self.r, self.offsets))
+
+    def test_no_resume_with_other_calculator(self):
+        mfjet.featurize_dataset(
+            mfjet.MFPixelCalculatorMarchingSquare(bin_width=0.05), self.input_path, self.output_path, self.r
+        )
+        calc = mfjet.MFPixelCalculatorMarchingSquare(bin_width=0.1)
+        arr_mfs = mfjet.featurize_dataset(calc, self.input_path, self.output_path, self.r)
+        np.testing.assert_array_equal(arr_mfs, calc.calc_mfs_batch(self.coords, self.r, self.offsets))
+
+
+    def test_voxel(self):
+        # 3D points have four MFs
+        rng = np.random.default_rng(8)
+        coords = rng.integers(0, 5, size=(30, 3)).astype(float)
+        offsets = np.array([0, 12, 12, 30])
+        input_path = os.path.join(self.tmpdir.name, "voxels.npz")
+        mfjet.save_ragged(input_path, coords, offsets)
+        calc = mfjet.MFVoxelCalculator()
+        r = np.array([0.1, 0.2])
+        arr_mfs = mfjet.featurize_dataset(calc, input_path, self.output_path, r, chunk_size=2)
+        self.assertEqual(arr_mfs.shape, (3, 2, 4))
+        np.testing.assert_array_equal(arr_mfs, calc.calc_mfs_batch(coords, r, offsets))
+
+
+class TestCLI(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.coords, self.offsets, _ = synthetic_jets.generate_jets("qcd", 100, (5, 40), seed=3)
+        self.input_path = os.path.join(self.tmpdir.name, "jets.npz")
+        self.output_path = os.path.join(self.tmpdir.name, "mfs.npy")
+        mfjet.save_ragged(self.input_path, self.coords, self.offsets)
+        self.r = np.linspace(0, 0.3, 4)
+
+    def test_parse_radius(self):
+        np.testing.assert_array_equal(cli.parse_radius("0:0.3:4"), self.r)
+        np.testing.assert_array_equal(cli.parse_radius("0,0.1"), [0., 0.1])
+
+    def test_make_calculator(self):
+        calc = cli.make_calculator("pixel-marching-square", bin_width=0.05, quad_segs=None)
+        self.assertIsInstance(calc, mfjet.MFPixelCalculatorMarchingSquare)
+        self.assertEqual(calc.bin_width, 0.05)
+        with self.assertRaises(ValueError):
+            cli.make_calculator("hexagon")
+        with self.assertRaisesRegex(ValueError, "quad_segs"):
+            cli.make_calculator("pixel-marching-square", bin_width=0.05, quad_segs=8)
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            cli.main([self.input_path, "-o", self.output_path, "--calculator", "voxel", "--phi-period", "6.28"])
+
+    def test_main(self):
+        cache_path = os.path.join(self.tmpdir.name, "mfs.sqlite")
+        status = cli.main([
+            self.input_path, "-o", self.output_path, "--calculator", "pixel-marching-square",
+            "--bin-width", "0.05", "--r", "0:0.3:4", "--workers", "2", "--chunk-size", "32",
+            "--cache", cache_path, "--quiet"
+        ])
+        self.assertEqual(status, 0)
+        calc = mfjet.MFPixelCalculatorMarchingSquare(bin_width=0.05)
+        np.testing.assert_array_equal(np.load(self.output_path), calc.calc_mfs_batch(self.coords, self.r, self.offsets))
+        # the write-ahead log is checkpointed and removed when the cache is closed
+        self.assertTrue(os.path.exists(cache_path))
+        self.assertFalse(os.path.exists(cache_path + "-wal"))
+
+
+class RecordingCalculator:
+    # records radii computed by the wrapped calculator
+    def __init__(self, calc):
+        self.calc = calc
+        self.list_r = []
+
+    def calc_mfs(self, coords, r):
+        self.list_r.append(np.array(r))
+        return self.calc.calc_mfs(coords, r)
+
+    def calc_mfs_batch(self, coords, r, offsets=None):
+        self.list_r.append(np.array(r))
+        return self.calc.calc_mfs_batch(coords, r, offsets)
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "mfs.sqlite")
+        self.list_coords = make_jets(n_jets=5, seed=5)
+
+    def test_overlapping_grids(self):
+        calc = RecordingCalculator(mfjet.MFManhattanCalculator())
+        with cache_utils.MFCache(self.path) as cache:
+            calc_cached = cache_utils.CachedCalculator(calc, cache)
+            r_coarse = np.linspace(0, 0.2, 5)
+            r_fine = np.linspace(0, 0.2, 9)
+            calc_cached.calc_mfs_batch(self.list_coords, r_coarse)
+            arr_mfs = calc_cached.calc_mfs_batch(self.list_coords, r_fine)
+            # only radii missing in the coarse grid are computed
+            np.testing.assert_array_equal(calc.list_r[-1], np.setdiff1d(r_fine, r_coarse))
+            np.testing.assert_array_equal(arr_mfs, calc.calc.calc_mfs_batch(self.list_coords, r_fine))
+            n_calls = len(calc.list_r)
+            calc_cached.calc_mfs(self.list_coords[0], r_fine)
+            self.assertEqual(len(calc.list_r), n_calls)
+
+    def test_size_bound(self):
+        jets = [cache_utils.coords_key(coords) for coords in self.list_coords]
+        r = np.linspace(0, 1, 10)
+        with cache_utils.MFCache(self.path) as cache:
+            for jet in jets:
+                cache.put(jet, b"calc", r, np.zeros((10, 3)))
+            # replaced entries are not counted twice
+            cache.put(jets[0], b"calc", r, np.ones((10, 3)))
+            n_entries, size = cache.size()
+            self.assertEqual(n_entries, 50)
+            self.assertEqual(size, cache._connect().execute("SELECT SUM(size) FROM mfs").fetchone()[0])
+        # reopening with a smaller bound evicts least recently used entries
+        with cache_utils.MFCache(self.path, max_bytes=size // 2) as cache:
+            n_entries, size_evicted = cache.size()
+            self.assertLessEqual(size_evicted, size // 2)
+            self.assertEqual(n_entries, 25)
+            self.assertEqual(cache.get(jets[-1], b"calc", r).keys(), set(r.tolist()))
+
+
+class TestService(unittest.TestCase):
+    def test_micro_batching(self):
+        calc = mfjet.MFPixelCalculatorMarchingSquare(bin_width=0.05)
+        list_coords = make_jets(n_jets=8, seed=4)
+        r = np.linspace(0, 0.3, 4)
+
+        async def run():
+            async with service.MFBatchService(calc, max_batch_size=16, max_wait=0.05) as mf_service:
+                results = await asyncio.gather(
+                    *[mf_service.submit(coords, r) for coords in list_coords],
+                    mf_service.submit([], r),
+                    mf_service.submit(np.ones((4, 3)), r),
+                    return_exceptions=True,
+                )
+            return results, mf_service.metrics()
+
+        results, metrics = asyncio.run(run())
+        # a malformed request fails alone
+        self.assertIsInstance(results[-1], ValueError)
+        for coords, arr_mfs in zip(list_coords, results):
+            np.testing.assert_array_equal(arr_mfs, calc.calc_mfs(coords, r))
+        np.testing.assert_array_equal(results[-2], np.zeros((4, 3)))
+        self.assertEqual(metrics["n_requests"], 10)
+        self.assertEqual(metrics["n_completed"], 9)
+        self.assertEqual(metrics["n_failed"], 1)
+        self.assertEqual(metrics["n_batches"], 1)
+        self.assertEqual(metrics["mean_batch_size"], 9)
+
+
+class FailingCalculator:
+    # raises an error whose traceback is larger than the pipe buffer
+    def calc_mfs_batch(self, coords, r, offsets=None):
+        raise ValueError("x" * 2 ** 20)
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        self.coords, self.offsets, _ = synthetic_jets.generate_jets("qcd", 100, (0, 60), seed=4)
+        self.r = np.linspace(0, 0.4, 5)
+
+    def test_shared_memory(self):
+        calc = mfjet.MFPixelCalculatorMarchingSquare(bin_width=0.05)
+        np.testing.assert_array_equal(
+            parallel_utils.calc_mfs_shared(calc, self.coords, self.r, self.offsets, n_workers=2, min_chunk_size=4),
+            calc.calc_mfs_batch(self.coords, self.r, self.offsets)
+        )
+
+    def test_worker_error(self):
+        with self.assertRaisesRegex(RuntimeError, "ValueError"):
+            parallel_utils.calc_mfs_shared(FailingCalculator(), self.coords, self.r, self.offsets, n_workers=4)
+
+    def test_chunks(self):
+        # chunks cover all jets in order, and each holds at least min_chunk_size jets except the last one
+        list_stop = [0]
+        while list_stop[-1] < self.offsets.shape[0] - 1:
+            list_stop.append(parallel_utils.next_chunk_stop(self.offsets, list_stop[-1], n_workers=4, min_chunk_size=3))
+        self.assertTrue(np.all(np.diff(list_stop)[:-1] >= 3))
+        # chunks shrink as the remaining constituents decrease
+        n_constituents = np.diff(self.offsets[list_stop])
+        self.assertGreater(n_constituents[0], n_constituents[-2])
+
+
+@unittest.skipUnless(
+    os.environ.get("MFJET_PERF_BASELINE") or os.environ.get("MFJET_PERF_OUTPUT"),
+    "set MFJET_PERF_BASELINE or MFJET_PERF_OUTPUT to run the performance gate"
+)
+class TestPerformanceGate(unittest.TestCase):
+    def test_no_slowdown(self):
+        # one case of each engine at the default factors of the benchmark suite
+        sweeps = {key: [value] for key, value in benchmark.DEFAULT_FACTORS.items()}
+        result = benchmark.run_benchmarks(
+            kinds=("top",), sweeps=sweeps, n_jets=int(os.environ.get("MFJET_PERF_N_JETS", 20))
+        )
+        for case in result["results"]:
+            print(f"{case['calculator']:>24s}: {case['time_per_jet'] * 1e3:.3f} ms/jet", file=sys.stderr)
+
+        output_path = os.environ.get("MFJET_PERF_OUTPUT")
+        if output_path:
+            with open(output_path, "w") as file:
+                json.dump(result, file, indent=1)
+
+        baseline_path = os.environ.get("MFJET_PERF_BASELINE")
+        if baseline_path:
+            with open(baseline_path, "r") as file:
+                baseline = json.load(file)
+            threshold = float(os.environ.get("MFJET_PERF_THRESHOLD", 1.5))
+            comparison = benchmark.compare_benchmarks(baseline, result)
+            self.assertTrue(comparison, "no case of the baseline matches the current run")
+            slow = [f"{case['calculator']}: {ratio:.2f}x" for case, ratio in comparison if ratio > threshold]
+            self.assertFalse(slow, f"slower than the baseline by more than {threshold}x: " + ", ".join(slow))
 
 
+if __name__ == "__main__":
+    unittest.main()